@@ -0,0 +1,202 @@
+import json
+import re
+import time
+
+# Compacts the a11y JSON sent by VLMPageHostImpl into a short, token-budgeted
+# listing for the VLM prompt. Accepted shapes:
+#   {"role": ..., "name": ..., "bbox": [x, y, w, h], "id": ..., "children": [...]}
+#   {"nodes": [{"id": ..., "child_ids": [...], ...}, ...]}  (flat, AXTreeUpdate style)
+#   a top-level list of either of the above.
+# `bbox` may also be {"x", "y", "width", "height"}.
+
+INTERACTIVE_ROLES = {
+    "button", "link", "textfield", "textbox", "searchbox", "combobox", "checkbox", "radiobutton", "radio",
+    "menuitem", "menuitemcheckbox", "menuitemradio", "tab", "option", "listboxoption", "switch", "slider",
+    "spinbutton", "popupbutton", "togglebutton", "textfieldwithcombobox", "disclosuretriangle",
+}
+CONTEXT_ROLES = {"heading", "image", "img", "dialog", "alertdialog", "alert"}
+INPUT_ROLES = {"textfield", "textbox", "searchbox", "combobox", "textfieldwithcombobox"}
+
+_WORD_RE = re.compile(r"\w+")
+_STOPWORDS = {"the", "a", "an", "and", "or", "of", "to", "in", "on", "for", "find", "about", "with", "is", "what"}
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def node_role(node):
+    return str(node.get("role", "")).replace("_", "").replace("-", "").lower()
+
+
+def node_bbox(node):
+    bbox = node.get("bbox") or node.get("bounds")
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        return [float(v) for v in bbox]
+    if isinstance(bbox, dict):
+        return [float(bbox.get("x", 0)), float(bbox.get("y", 0)), float(bbox.get("width", 0)), float(bbox.get("height", 0))]
+    return None
+
+
+def iter_nodes(tree):
+    """Yield (node, depth) in document order without recursion."""
+    if isinstance(tree, dict) and isinstance(tree.get("nodes"), list):
+        nodes = tree["nodes"]
+        by_id = {n.get("id"): n for n in nodes if isinstance(n, dict)}
+        child_ids = {c for n in nodes if isinstance(n, dict) for c in n.get("child_ids", ())}
+        roots = [n for n in nodes if isinstance(n, dict) and n.get("id") not in child_ids]
+        stack = [(n, 0) for n in reversed(roots)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            for cid in reversed(node.get("child_ids", ())):
+                child = by_id.get(cid)
+                if child is not None:
+                    stack.append((child, depth + 1))
+        return
+    roots = tree if isinstance(tree, list) else [tree]
+    stack = [(n, 0) for n in reversed(roots) if isinstance(n, dict)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        children = node.get("children")
+        if isinstance(children, list):
+            for child in reversed(children):
+                if isinstance(child, dict):
+                    stack.append((child, depth + 1))
+
+
+def short_id(node_id, fallback):
+    # Chromium AX node ids are stable for the life of a document; base36 keeps them short.
+    if isinstance(node_id, int) or (isinstance(node_id, str) and node_id.isdigit()):
+        value = int(node_id)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+        out = ""
+        while True:
+            value, rem = divmod(value, 36)
+            out = digits[rem] + out
+            if not value:
+                return out
+    return f"n{fallback}"
+
+
+def objective_terms(objective):
+    return {w for w in _WORD_RE.findall((objective or "").lower()) if w not in _STOPWORDS and len(w) > 1}
+
+
+class CompactNode:
+    __slots__ = ("sid", "node_id", "role", "name", "bbox", "order", "score")
+
+    def __init__(self, sid, node_id, role, name, bbox, order):
+        self.sid = sid
+        self.node_id = node_id
+        self.role = role
+        self.name = name
+        self.bbox = bbox
+        self.order = order
+        self.score = 0.0
+
+    def line(self, map_bbox=None):
+        text = f"[{self.sid}] {self.role}"
+        if self.name:
+            text += f' "{self.name}"'
+        if self.bbox:
+            x, y, w, h = map_bbox(self.bbox) if map_bbox else self.bbox
+            text += f" @{int(x)},{int(y)},{int(w)},{int(h)}"
+        return text
+
+
+class CompactTree:
+    def __init__(self, text, nodes, stats):
+        self.text = text
+        self.nodes = nodes
+        self.by_sid = {n.sid: n for n in nodes}
+        self.stats = stats
+
+    def render(self, map_bbox=None):
+        """The listing with bboxes passed through `map_bbox` (e.g. into screenshot pixels)."""
+        if map_bbox is None or not self.nodes:
+            return self.text
+        return "\n".join(n.line(map_bbox) for n in self.nodes)
+
+
+class A11yCompactor:
+    def __init__(self, token_budget=1500, viewport=(1280, 800), viewport_margin=200, max_name_chars=80):
+        self.token_budget = token_budget
+        self.viewport = viewport
+        self.viewport_margin = viewport_margin
+        self.max_name_chars = max_name_chars
+
+    def _in_viewport(self, bbox, viewport):
+        if bbox is None:
+            return True
+        x, y, w, h = bbox
+        vw, vh = viewport
+        m = self.viewport_margin
+        return x + w >= -m and y + h >= -m and x <= vw + m and y <= vh + m and (w > 0 or h > 0)
+
+    def _score(self, node, terms, viewport):
+        score = 1.0 if node.role in INTERACTIVE_ROLES else 0.3
+        if node.role in INPUT_ROLES:
+            score += 1.0
+        if terms and node.name:
+            words = set(_WORD_RE.findall(node.name.lower()))
+            score += 3.0 * len(terms & words) / len(terms)
+        if node.bbox is not None and node.bbox[1] <= viewport[1]:
+            score += 0.5  # above the fold
+        return score
+
+    def compact(self, a11y_tree, objective=None, tree=None, viewport=None):
+        """`tree` is the already-parsed a11y_tree, when the caller has one; `viewport`
+        is the page's CSS (width, height) when known."""
+        started = time.perf_counter()
+        viewport = viewport or self.viewport
+        raw_bytes = len(a11y_tree.encode("utf-8")) if isinstance(a11y_tree, str) else len(a11y_tree)
+        if tree is None:
+            try:
+                tree = json.loads(a11y_tree)
+            except (TypeError, ValueError):
+                text = a11y_tree[: self.token_budget * 4]
+                return CompactTree(text, [], self._stats(raw_bytes, text, 0, 0, started))
+
+        candidates = []
+        total = 0
+        for order, (node, _) in enumerate(iter_nodes(tree)):
+            total += 1
+            role = node_role(node)
+            name = " ".join(str(node.get("name") or "").split())[: self.max_name_chars]
+            if role not in INTERACTIVE_ROLES and not (role in CONTEXT_ROLES and name):
+                continue  # wrappers and static containers collapse away
+            bbox = node_bbox(node)
+            if not self._in_viewport(bbox, viewport):
+                continue
+            candidates.append(CompactNode(short_id(node.get("id"), order), node.get("id"), role, name, bbox, order))
+
+        terms = objective_terms(objective)
+        for node in candidates:
+            node.score = self._score(node, terms, viewport)
+        kept, used = [], 0
+        for node in sorted(candidates, key=lambda n: (-n.score, n.order)):
+            cost = estimate_tokens(node.line()) + 1
+            if used + cost > self.token_budget:
+                continue
+            kept.append(node)
+            used += cost
+        kept.sort(key=lambda n: n.order)
+        text = "\n".join(n.line() for n in kept)
+        if not text:
+            # Nothing recognisable; hand the model a truncated raw tree rather than nothing.
+            text = a11y_tree[: self.token_budget * 4]
+        return CompactTree(text, kept, self._stats(raw_bytes, text, total, len(kept), started))
+
+    def _stats(self, raw_bytes, text, total, kept, started):
+        out_bytes = len(text.encode("utf-8"))
+        return {
+            "input_bytes": raw_bytes,
+            "output_bytes": out_bytes,
+            "nodes_in": total,
+            "nodes_kept": kept,
+            "compression_ratio": round(raw_bytes / out_bytes, 2) if out_bytes else 0.0,
+            "estimated_tokens": estimate_tokens(text),
+            "compact_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
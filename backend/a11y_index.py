@@ -0,0 +1,124 @@
+import json
+import math
+import re
+from array import array
+
+from a11y_compactor import iter_nodes, node_bbox, node_role
+from spatial_index import SpatialGrid
+
+# One parse of the a11y tree per step, shared by the fast-path rules, the
+# prompt compactor and bbox grounding. Nodes are stored column-wise in
+# document order (role and name lists, one flat float array of x, y, w, h
+# with NaN for nodes without a box) rather than as one object per node, so a
+# 10k-node page costs a few flat arrays. IndexedNode is a view onto one row.
+
+_NAN = float("nan")
+
+
+class IndexedNode:
+    __slots__ = ("index", "order")
+
+    def __init__(self, index, order):
+        self.index = index
+        self.order = order
+
+    @property
+    def node(self):
+        return self.index.raw_nodes[self.order]
+
+    @property
+    def depth(self):
+        return self.index.depths[self.order]
+
+    @property
+    def role(self):
+        return self.index.roles[self.order]
+
+    @property
+    def name(self):
+        return self.index.names[self.order]
+
+    @property
+    def bbox(self):
+        return self.index.bbox(self.order)
+
+    @property
+    def value(self):
+        return str(self.node.get("value") or "")
+
+    @property
+    def visible(self):
+        bbox = self.bbox
+        return bbox is not None and bbox[2] > 0 and bbox[3] > 0
+
+
+class A11yIndex:
+    def __init__(self, raw, tree):
+        self.raw = raw
+        self.tree = tree  # None when the client sent something that is not JSON
+        self.raw_nodes = []
+        self.depths = array("i")
+        self.roles = []
+        self.names = []
+        self.boxes = array("d")
+        self.by_role = {}
+        interned = {}
+        for order, (node, depth) in enumerate(iter_nodes(tree) if tree is not None else ()):
+            role = node_role(node)
+            role = interned.setdefault(role, role)
+            self.raw_nodes.append(node)
+            self.depths.append(depth)
+            self.roles.append(role)
+            self.names.append(" ".join(str(node.get("name") or "").split()))
+            self.boxes.extend(node_bbox(node) or (_NAN, _NAN, _NAN, _NAN))
+            self.by_role.setdefault(role, array("i")).append(order)
+        self._raw_lower = None
+        self._spatial = None
+
+    @classmethod
+    def build(cls, a11y_tree):
+        try:
+            tree = json.loads(a11y_tree)
+        except (TypeError, ValueError):
+            tree = None
+        return cls(a11y_tree, tree)
+
+    def __len__(self):
+        return len(self.raw_nodes)
+
+    @property
+    def nodes(self):
+        return [IndexedNode(self, i) for i in range(len(self.raw_nodes))]
+
+    def bbox(self, order):
+        x = self.boxes[order * 4]
+        if math.isnan(x):
+            return None
+        return [x, self.boxes[order * 4 + 1], self.boxes[order * 4 + 2], self.boxes[order * 4 + 3]]
+
+    @property
+    def raw_lower(self):
+        if self._raw_lower is None:
+            self._raw_lower = self.raw.lower()
+        return self._raw_lower
+
+    def find(self, roles=None, name_pattern=None):
+        """Nodes in document order with one of `roles` whose name matches `name_pattern` (a compiled regex)."""
+        if roles is None:
+            orders = range(len(self.raw_nodes))
+        else:
+            orders = sorted(i for r in roles for i in self.by_role.get(r, ()))
+        for order in orders:
+            if name_pattern is None or name_pattern.search(self.names[order]):
+                yield IndexedNode(self, order)
+
+    def spatial(self, roles, cell_size=64):
+        """Grid index over visible nodes with one of `roles`; built on first use."""
+        key = (frozenset(roles), cell_size)
+        if self._spatial is None or self._spatial[0] != key:
+            self._spatial = (key, SpatialGrid(self, roles, cell_size))
+        return self._spatial[1]
+
+
+def compile_pattern(pattern):
+    return re.compile(pattern, re.IGNORECASE) if pattern else None
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# Observation -> action cache for /vlm/act. Keys combine the normalised a11y
+# tree, a perceptual hash of the screenshot, the objective and the model
+# identity, so a back navigation or no-op scroll that reproduces a state the
+# model has already answered skips generation entirely.
+
+def normalize_a11y_tree(a11y_tree):
+    try:
+        return json.dumps(json.loads(a11y_tree), sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return " ".join(a11y_tree.split())
+
+def image_dhash(image, hash_size=8):
+    """64-bit difference hash; stable across JPEG re-encodes and tiny repaints."""
+    pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+def cache_key(a11y_tree, image_hash, objective, model_id):
+    h = hashlib.sha256()
+    for part in (normalize_a11y_tree(a11y_tree), image_hash, objective or "", model_id):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+class ActionCache:
+    def __init__(self, max_entries=1024, ttl_s=600.0, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # key -> (expires_at, action)
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if disk_path:
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS actions (key TEXT PRIMARY KEY, action TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS actions_expires_at ON actions (expires_at)")
+            self._prune_disk(time.time())
+            self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._entries[key]
+            if self._conn is not None:
+                row = self._conn.execute("SELECT action, expires_at FROM actions WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    action = json.loads(row[0])
+                    self._store(key, action, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return dict(action)
+            self.misses += 1
+            return None
+
+    def put(self, key, action):
+        now = time.time()
+        expires_at = now + self.ttl_s
+        with self._lock:
+            self._store(key, dict(action), expires_at)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO actions (key, action, expires_at) VALUES (?, ?, ?)",
+                                   (key, json.dumps(action), expires_at))
+                self._prune_disk(now)
+                self._conn.commit()
+
+    def _prune_disk(self, now):
+        # Same bound as the memory tier: drop expired rows, then the ones closest to expiring.
+        self._conn.execute("DELETE FROM actions WHERE expires_at < ?", (now,))
+        self._conn.execute("DELETE FROM actions WHERE key IN "
+                           "(SELECT key FROM actions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def _store(self, key, action, expires_at):
+        self._entries[key] = (expires_at, action)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM actions")
+                self._conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,66 @@
+import json
+from typing import List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, ValidationError
+
+# Typed form of the action JSON described in the /vlm/act system prompt. The
+# JSON schema drives vLLM's guided decoding, so the engine can only emit a
+# conforming object and stops once it closes; parse_action validates
+# whatever an engine returned into a VLMAction either way.
+
+
+class VLMAction(BaseModel):
+    action: Literal["click", "scroll", "type"]
+    target_id: Optional[Union[str, int]] = None  # [id] from the compacted a11y listing
+    target_bbox: Optional[List[float]] = Field(default=None, min_length=4, max_length=4)
+    text: Optional[str] = None
+    direction: Optional[Literal["up", "down"]] = None
+    thought: Optional[str] = None
+
+    def to_response(self):
+        return self.model_dump(exclude_none=True)
+
+
+ACTION_SCHEMA = VLMAction.model_json_schema()
+
+
+class ActionParseError(ValueError):
+    pass
+
+
+def first_json_object(text):
+    """The first balanced {...} in `text`, ignoring braces inside strings, or None."""
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = escaped = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+        start = text.find("{", start + 1)
+    return None
+
+
+def parse_action(text):
+    """Validate a generation into a VLMAction. Raises ActionParseError."""
+    candidate = first_json_object(text or "")
+    if candidate is None:
+        raise ActionParseError("No JSON object in model output.")
+    try:
+        return VLMAction.model_validate(json.loads(candidate))
+    except (ValueError, ValidationError) as e:
+        raise ActionParseError(f"Model output does not match the action schema: {e}") from e
@@ -0,0 +1,62 @@
+"""Measure a11y tree compaction throughput (MB/s) and compression ratio.
+
+Usage: python benchmarks/bench_a11y_compaction.py [--corpus DIR] [--budget 1500] [--repeat 5]
+
+DIR holds saved trees (*.json), e.g. debug_latest_a11y.json dumps from
+mock_server.py. Without --corpus a synthetic corpus is generated.
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from a11y_compactor import A11yCompactor
+from synthetic import make_a11y_tree
+
+
+def load_corpus(corpus_dir):
+    if corpus_dir:
+        trees = []
+        for path in sorted(glob.glob(os.path.join(corpus_dir, "*.json"))):
+            with open(path, "r", encoding="utf-8") as f:
+                trees.append(f.read())
+        return trees
+    return [make_a11y_tree(n, seed=n) for n in (500, 2000, 5000, 10000, 20000)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus")
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--objective", default="quarterly revenue report")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    trees = load_corpus(args.corpus)
+    if not trees:
+        sys.exit("Corpus is empty.")
+    compactor = A11yCompactor(token_budget=args.budget)
+    total_bytes = sum(len(t.encode("utf-8")) for t in trees)
+
+    print(f"{'input KB':>10} {'output KB':>10} {'nodes in':>9} {'kept':>6} {'ratio':>8} {'ms':>8}")
+    for tree in trees:
+        stats = compactor.compact(tree, args.objective).stats
+        print(f"{stats['input_bytes'] / 1024:>10.1f} {stats['output_bytes'] / 1024:>10.1f} {stats['nodes_in']:>9} "
+              f"{stats['nodes_kept']:>6} {stats['compression_ratio']:>8.1f} {stats['compact_ms']:>8.2f}")
+
+    runs = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for tree in trees:
+            compactor.compact(tree, args.objective)
+        runs.append(time.perf_counter() - start)
+    best, median = min(runs), statistics.median(runs)
+    print(f"Corpus: {len(trees)} trees, {total_bytes / 1e6:.2f} MB")
+    print(f"Throughput: {total_bytes / 1e6 / median:.1f} MB/s median, {total_bytes / 1e6 / best:.1f} MB/s best")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Free-form vs schema-constrained action decoding, replayed through a fake engine.
+
+Usage: python benchmarks/bench_action_decoding.py [--recorded outputs.jsonl] [--samples 200] [--ms-per-token 0.5]
+
+--recorded takes JSONL lines with a "text" field: raw generations captured
+from the free-form path. Without it a synthetic mix is used. The fake engine
+sleeps ms-per-token for every token it emits. Free-form replay emits the
+whole recording (capped at max_tokens). Constrained replay emits only a
+schema-valid object and stops when it closes, which is what guided JSON
+decoding allows the model to produce.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from action_schema import ActionParseError, first_json_object, parse_action
+from osint_engine import estimate_tokens
+
+GOOD = '{"action": "click", "target_bbox": [412, 188, 96, 24], "thought": "Open the first result about the quarterly report."}'
+SYNTHETIC = [
+    (0.55, GOOD),
+    (0.15, "```json\n" + GOOD + "\n```"),
+    (0.10, "I will click the first result since it matches the objective.\n\n" + GOOD + "\n\nThis should open the report."),
+    (0.08, "{'action': 'scroll', 'direction': 'down', 'thought': 'Nothing relevant above the fold.'}"),
+    (0.07, '{"action": "click", "target_bbox": [412, 188, 96, 24], "thought": "The page lists ' + "many results " * 200),
+    (0.05, '{"action": "read_page", "thought": "Summarise the article."}'),
+]
+
+
+def synthetic_outputs(samples, seed):
+    rng = random.Random(seed)
+    weights, texts = zip(*SYNTHETIC)
+    return rng.choices(texts, weights=weights, k=samples)
+
+
+def legacy_parse(text):
+    # The pre-schema parser from vlm_server.run_action_step.
+    clean = text.strip()
+    if "```json" in clean:
+        clean = clean.split("```json")[1].split("```")[0].strip()
+    return json.loads(clean)
+
+
+def constrained_output(text):
+    candidate = first_json_object(text)
+    try:
+        return parse_action(candidate or "").model_dump_json(exclude_none=True)
+    except ActionParseError:
+        # The grammar would have forced a valid object of similar length instead.
+        return '{"action": "scroll", "direction": "down", "thought": "Nothing actionable identified."}'
+
+
+class ReplayEngine:
+    def __init__(self, ms_per_token, max_tokens):
+        self.ms_per_token = ms_per_token
+        self.max_tokens = max_tokens
+        self.tokens = 0
+
+    def generate(self, text):
+        tokens = min(estimate_tokens(text), self.max_tokens)
+        self.tokens += tokens
+        time.sleep(tokens * self.ms_per_token / 1000)
+        return text[: tokens * 4]
+
+
+def run(outputs, engine, parse, transform=lambda t: t):
+    failures = 0
+    start = time.perf_counter()
+    for text in outputs:
+        try:
+            parse(engine.generate(transform(text)))
+        except (ValueError, ActionParseError):
+            failures += 1
+    elapsed = time.perf_counter() - start
+    n = len(outputs)
+    return {"tokens_per_step": engine.tokens / n, "ms_per_step": elapsed / n * 1000, "parse_failure_rate": failures / n}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recorded")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--ms-per-token", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.recorded:
+        with open(args.recorded) as f:
+            outputs = [json.loads(line)["text"] for line in f if line.strip()]
+    else:
+        outputs = synthetic_outputs(args.samples, args.seed)
+
+    results = {
+        "free-form": run(outputs, ReplayEngine(args.ms_per_token, 512), legacy_parse),
+        "constrained": run(outputs, ReplayEngine(args.ms_per_token, 256), parse_action, constrained_output),
+    }
+    print(f"Replayed {len(outputs)} generations at {args.ms_per_token} ms/token")
+    print(f"{'path':<12} {'tokens/step':>12} {'ms/step':>10} {'parse failures':>15}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['tokens_per_step']:>12.1f} {r['ms_per_step']:>10.2f} {r['parse_failure_rate']:>15.1%}")
+
+
+if __name__ == "__main__":
+    main()
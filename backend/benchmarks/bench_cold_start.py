@@ -0,0 +1,127 @@
+"""Cold start: time from launching vlm_server.py to its first responses.
+
+Usage: python benchmarks/bench_cold_start.py [--load-ms 0 2000 10000] [--runs 3]
+
+Launches `vlm_server.py --engine sim` (in a scratch directory, with a sim
+profile whose load_ms stands in for model load time) and polls every few
+milliseconds for the first:
+
+  healthz    GET /healthz 200: the socket is bound
+  fast act   POST /vlm/act answered by a fast-path rule (consent banner)
+  503        POST /vlm/act refused with 503 + Retry-After while loading
+  ready      GET /readyz 200
+  model act  POST /vlm/act 200 answered by the engine
+
+Also reports how long `import vlm_server` takes in a fresh interpreter.
+Before the server bound its socket after the model loaded, every column
+but import waited for load_ms.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = os.path.join(BACKEND, "vlm_server.py")
+TREE = '{"role": "RootWebArea", "name": "Results", "children": [{"role": "link", "name": "Result", "bbox": [10, 10, 200, 20]}]}'
+CONSENT_TREE = '{"role": "RootWebArea", "name": "News", "children": [{"role": "button", "name": "Accept all", "bbox": [600, 500, 120, 32]}]}'
+COLUMNS = ("healthz", "fast act", "503", "ready", "model act")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _png_b64(size=(1280, 800)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, "white").save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def import_seconds():
+    code = "import time; t = time.perf_counter(); import vlm_server; print(time.perf_counter() - t)"
+    with tempfile.TemporaryDirectory() as scratch:
+        out = subprocess.run([sys.executable, "-c", code], cwd=scratch, env={**os.environ, "PYTHONPATH": BACKEND},
+                             capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def run(load_ms, timeout_s, poll_s):
+    """Seconds from launch to each milestone in COLUMNS (None if never seen)."""
+    port = _free_port()
+    image = _png_b64()
+    seen = dict.fromkeys(COLUMNS)
+    with tempfile.TemporaryDirectory() as scratch:
+        profile = os.path.join(scratch, "sim_profile.json")
+        with open(profile, "w") as f:
+            json.dump({"load_ms": load_ms}, f)
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, SERVER, "--engine", "sim", "--sim-profile", profile, "--port", str(port)],
+            cwd=scratch, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        def mark(name):
+            if seen[name] is None:
+                seen[name] = time.perf_counter() - started
+
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+                while seen["model act"] is None and time.perf_counter() - started < timeout_s:
+                    try:
+                        if client.get("/healthz").status_code == 200:
+                            mark("healthz")
+                        if seen["fast act"] is None and client.post(
+                                "/vlm/act", json={"image_base64": image, "a11y_tree": CONSENT_TREE}).status_code == 200:
+                            mark("fast act")
+                        if seen["ready"] is None and client.get("/readyz").status_code == 200:
+                            mark("ready")
+                        status = client.post("/vlm/act", json={"image_base64": image, "a11y_tree": TREE}).status_code
+                        if status == 503:
+                            mark("503")
+                        elif status == 200:
+                            mark("model act")
+                    except httpx.TransportError:
+                        pass
+                    time.sleep(poll_s)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    return seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--load-ms", type=float, nargs="+", default=[0, 2000, 10000],
+                        help="Simulated model load times")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--poll-ms", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    imports = [import_seconds() for _ in range(args.runs)]
+    print(f"import vlm_server: {statistics.median(imports) * 1000:.0f} ms (median of {args.runs})")
+    print("Median seconds from launch, sim engine:")
+    print(f"{'load':>8}" + "".join(f"{name:>11}" for name in COLUMNS))
+    for load_ms in args.load_ms:
+        runs = [run(load_ms, args.timeout, args.poll_ms / 1000) for _ in range(args.runs)]
+        cells = []
+        for name in COLUMNS:
+            values = [r[name] for r in runs if r[name] is not None]
+            cells.append(f"{statistics.median(values):>10.2f}s" if values else f"{'-':>11}")
+        print(f"{load_ms / 1000:>7.1f}s" + "".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Decode/resize cost and vision tokens per frame, with and without preprocessing.
+
+Usage: python benchmarks/bench_image_preprocess.py [--frames 50] [--width 2560] [--height 1600] [--crop]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import make_screenshot
+from a11y_compactor import CompactNode
+from image_preprocess import ImagePreprocessor, vision_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--width", type=int, default=2560, help="Screenshot width in device pixels (HiDPI by default).")
+    parser.add_argument("--height", type=int, default=1600)
+    parser.add_argument("--viewport", type=int, nargs=2, default=(1280, 800))
+    parser.add_argument("--max-pixels", type=int, default=1280 * 28 * 28)
+    parser.add_argument("--crop", action="store_true", help="Crop to a synthetic cluster of a11y nodes.")
+    args = parser.parse_args()
+
+    jpeg = make_screenshot(args.width, args.height)
+    pre = ImagePreprocessor(max_pixels=args.max_pixels, crop_to_nodes=args.crop)
+    nodes = [CompactNode(str(i), i, "link", "result", [40, 120 + 30 * i, 500, 20], i) for i in range(10)]
+
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        image = Image.open(io.BytesIO(jpeg))
+        image.load()
+    naive_decode = (time.perf_counter() - start) / args.frames
+
+    decode = resize = 0.0
+    for _ in range(args.frames):
+        start = time.perf_counter()
+        image = pre.decode(Image.open(io.BytesIO(jpeg)))
+        mid = time.perf_counter()
+        prepared = pre.prepare(image, nodes, tuple(args.viewport))
+        decode += mid - start
+        resize += time.perf_counter() - mid
+    decode /= args.frames
+    resize /= args.frames
+
+    naive_tokens = vision_tokens(args.width, args.height, pre.patch)
+    print(f"Frame: {args.width}x{args.height} JPEG {len(jpeg)} bytes, viewport {args.viewport[0]}x{args.viewport[1]}")
+    print(f"{'path':<14} {'decode ms':>10} {'resize ms':>10} {'model size':>12} {'vision tokens':>14}")
+    print(f"{'full-res':<14} {naive_decode * 1000:>10.3f} {0:>10.3f} {f'{args.width}x{args.height}':>12} {naive_tokens:>14}")
+    size = "x".join(map(str, prepared.stats["model_size"]))
+    print(f"{'preprocessed':<14} {decode * 1000:>10.3f} {resize * 1000:>10.3f} {size:>12} {prepared.stats['vision_tokens']:>14}")
+    print(f"Decoded at {prepared.stats['decoded_size'][0]}x{prepared.stats['decoded_size'][1]} (JPEG draft); "
+          f"vision tokens cut by {1 - prepared.stats['vision_tokens'] / naive_tokens:.1%}")
+
+
+if __name__ == "__main__":
+    main()
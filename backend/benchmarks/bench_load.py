@@ -0,0 +1,214 @@
+"""Load generation for /vlm/act, /vlm/rlhf_log and /osint/analyze without GPU, Chrome or network.
+
+Usage: python benchmarks/bench_load.py [--scenarios act_mock act_slow act_sim rlhf_log osint]
+           [--concurrency 1 8 32] [--requests 200] [--slow-latency-ms 150] [--sim-profile profile.json]
+           [--output results.json] [--baseline baseline.json] [--max-regression 0.2]
+
+The app runs in this process behind httpx's ASGI transport, with its state
+(SQLite log, reports) in a scratch directory. Engines:
+
+  act_mock   the mock engine (request handling, fast path and logging only)
+  act_slow   MockLLM behind the real pipeline: decode, compaction, resize,
+             scheduler batching with --slow-latency-ms per batch, parsing
+  act_sim    the sim engine (mock_engine.py): lognormal latency with a median
+             of --slow-latency-ms, 4 items per batch round and 1% malformed
+             outputs, or whatever --sim-profile describes
+  rlhf_log   /vlm/rlhf_log with distinct screenshots (group-committed writes)
+  osint      /osint/analyze until the job's event stream ends, with a teacher
+             that sleeps --teacher-latency-ms per call
+
+Each run reports p50/p95/p99 latency, requests per second and RSS. With
+--output the results are saved as JSON; with --baseline they are compared
+against a saved run, and the exit status is 1 if any p95 or throughput
+regressed by more than --max-regression.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+from synthetic import make_a11y_tree, make_osint_corpus, make_screenshot
+
+SCENARIOS = ("act_mock", "act_slow", "act_sim", "rlhf_log", "osint")
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+class Workload:
+    """Pre-built request bodies, so generating load costs almost nothing per request."""
+
+    def __init__(self, args):
+        self.frames = [base64.b64encode(make_screenshot(seed=i)).decode("ascii") for i in range(8)]
+        self.tree = make_a11y_tree(args.tree_nodes, seed=0)
+        self.corpus = make_osint_corpus(args.osint_paragraphs, seed=0)
+
+    def act(self, i):
+        # A distinct root name per request keeps the action cache from answering.
+        tree = self.tree.replace('"Synthetic page"', f'"Synthetic page {i}"', 1)
+        return {"image_base64": self.frames[i % len(self.frames)], "a11y_tree": tree, "session_id": f"bench-{i % 16}"}
+
+    def rlhf(self, i):
+        return {"timestamp": str(i), "state_image_base64": self.frames[i % len(self.frames)], "state_a11y_tree": self.tree,
+                "vlm_bad_action": '{"action": "scroll"}', "human_good_action": '{"action": "click"}'}
+
+
+async def run_scenario(name, client, workload, concurrency, total):
+    latencies, errors, statuses = [], 0, {}
+    counter = iter(range(total))
+
+    async def one(i):
+        if name.startswith("act_"):
+            return await client.post("/vlm/act", json=workload.act(i))
+        if name == "rlhf_log":
+            return await client.post("/vlm/rlhf_log", json=workload.rlhf(i))
+        submitted = await client.post("/osint/analyze", json={"objective": f"Map the company network {i}", "raw_data": workload.corpus})
+        if submitted.status_code != 202:
+            return submitted
+        return await client.get(submitted.json()["events_url"])
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await one(i)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    ms = [v * 1000 for v in latencies]
+    return {
+        "scenario": name, "concurrency": concurrency, "requests": len(ms), "errors": errors,
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "rps": round(len(ms) / elapsed, 2),
+        "p50_ms": round(percentile(ms, 0.50), 2), "p95_ms": round(percentile(ms, 0.95), 2),
+        "p99_ms": round(percentile(ms, 0.99), 2), "max_ms": round(max(ms), 2),
+        "rss_mb": round(rss_mb(), 1), "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def configure(vlm_server, name, args):
+    from engine_manager import Engine, MockLLM
+    from mock_engine import SimulatedLLM
+    if name == "act_slow":
+        vlm_server.engines.active = Engine("vllm", llm=MockLLM(args.slow_latency_ms / 1000))
+    elif name == "act_sim":
+        profile = {"latency": {"dist": "lognormal", "median_ms": args.slow_latency_ms, "sigma": 0.5},
+                   "batch_capacity": 4, "malformed_rate": 0.01, "seed": 0}
+        if args.sim_profile:
+            with open(args.sim_profile) as f:
+                profile = json.load(f)
+        vlm_server.engines.active = Engine("sim", llm=SimulatedLLM.from_config(profile))
+    else:
+        vlm_server.engines.active = Engine("mock")
+    vlm_server.action_cache.invalidate()
+
+
+def compare(results, baseline, max_regression):
+    """Print per-run deltas against a baseline; return the regressions beyond max_regression."""
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'scenario':<10} {'conc':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8}   vs baseline")
+    for r in results:
+        base = previous.get((r["scenario"], r["concurrency"]))
+        if base is None:
+            continue
+        delta = {k: (r[k] - base[k]) / base[k] if base[k] else 0.0 for k in ("p50_ms", "p95_ms", "p99_ms", "rps")}
+        print(f"{r['scenario']:<10} {r['concurrency']:>4} {delta['p50_ms']:>+8.0%} {delta['p95_ms']:>+8.0%} "
+              f"{delta['p99_ms']:>+8.0%} {delta['rps']:>+8.0%}")
+        if delta["p95_ms"] > max_regression or -delta["rps"] > max_regression:
+            regressions.append((r["scenario"], r["concurrency"], delta))
+    return regressions
+
+
+async def main_async(args, vlm_server, workload):
+    results = []
+    transport = httpx.ASGITransport(app=vlm_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"{'scenario':<10} {'conc':>4} {'reqs':>5} {'errs':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rss MB':>7}")
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                configure(vlm_server, name, args)
+                total = max(concurrency, args.requests // 4 if name == "osint" else args.requests)
+                r = await run_scenario(name, client, workload, concurrency, total)
+                results.append(r)
+                print(f"{name:<10} {concurrency:>4} {r['requests']:>5} {r['errors']:>4} {r['rps']:>8.1f} "
+                      f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['rss_mb']:>7.1f}")
+    vlm_server.close_rlhf_writer()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run (a quarter of that for osint)")
+    parser.add_argument("--slow-latency-ms", type=float, default=150.0)
+    parser.add_argument("--sim-profile", help="sim engine profile for act_sim (see mock_engine.py)")
+    parser.add_argument("--teacher-latency-ms", type=float, default=20.0)
+    parser.add_argument("--tree-nodes", type=int, default=2000)
+    parser.add_argument("--osint-paragraphs", type=int, default=200)
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Compare against a JSON file written with --output")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    if args.sim_profile:
+        args.sim_profile = os.path.abspath(args.sim_profile)
+    workload = Workload(args)
+    with tempfile.TemporaryDirectory(prefix="smartchrome-bench-") as scratch:
+        os.chdir(scratch)  # relative db_path and reports_dir land here
+        import vlm_server
+        vlm_server.DB_PATH = os.path.join(scratch, "bench.db")
+        vlm_server.CONFIG["reports_dir"] = os.path.join(scratch, "reports")
+        vlm_server.init_db()
+        teacher_latency_s = args.teacher_latency_ms / 1000
+        vlm_server.osint_engine.complete = lambda system_prompt, prompt: time.sleep(teacher_latency_s) or "- Finding."
+        results = asyncio.run(main_async(args, vlm_server, workload))
+        os.chdir(BACKEND)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} run(s) regressed by more than {args.max_regression:.0%}.")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
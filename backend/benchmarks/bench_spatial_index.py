@@ -0,0 +1,63 @@
+"""Grid-indexed vs linear-scan bbox grounding on large a11y trees.
+
+Usage: python benchmarks/bench_spatial_index.py [--nodes 10000 50000] [--queries 2000]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import make_a11y_tree
+from a11y_compactor import INTERACTIVE_ROLES
+from a11y_index import A11yIndex
+from spatial_index import ground_bbox
+
+
+def linear_nearest(index, px, py, max_distance):
+    best = None
+    for order, role in enumerate(index.roles):
+        bbox = index.bbox(order)
+        if role not in INTERACTIVE_ROLES or bbox is None or bbox[2] <= 0 or bbox[3] <= 0:
+            continue
+        x, y, w, h = bbox
+        distance = math.hypot(max(x - px, 0.0, px - (x + w)), max(y - py, 0.0, py - (y + h)))
+        if best is None or (distance, w * h) < best[1:]:
+            best = (order, distance, w * h)
+    return best if best is not None and best[1] <= max_distance else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=float, default=48.0)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>7} {'parse+table ms':>15} {'grid ms':>8} {'grid us/query':>14} {'scan us/query':>14} {'agree':>6}")
+    for n in args.nodes:
+        tree = make_a11y_tree(n, seed=n)
+        start = time.perf_counter()
+        index = A11yIndex.build(tree)
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index.spatial(INTERACTIVE_ROLES)
+        grid_ms = (time.perf_counter() - start) * 1000
+
+        rng = random.Random(0)
+        points = [[rng.uniform(0, 1280), rng.uniform(0, 4800), 10, 10] for _ in range(args.queries)]
+        start = time.perf_counter()
+        grid_hits = [ground_bbox(index, p, INTERACTIVE_ROLES, args.max_distance)[0] for p in points]
+        grid_us = (time.perf_counter() - start) / len(points) * 1e6
+        scan_points = points[: max(1, args.queries // 20)]  # the scan is slow; sample
+        start = time.perf_counter()
+        scan_hits = [linear_nearest(index, p[0] + 5, p[1] + 5, args.max_distance) for p in scan_points]
+        scan_us = (time.perf_counter() - start) / len(scan_points) * 1e6
+        agree = sum((s[0] if s else None) == g for s, g in zip(scan_hits, grid_hits)) / len(scan_points)
+        print(f"{len(index):>7} {build_ms:>15.1f} {grid_ms:>8.1f} {grid_us:>14.1f} {scan_us:>14.1f} {agree:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
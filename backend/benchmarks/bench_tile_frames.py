@@ -0,0 +1,115 @@
+"""Replay a screenshot sequence as full JPEG frames vs SCT1 tile deltas.
+
+Usage: python benchmarks/bench_tile_frames.py [--frames-dir recorded/] [--steps 120] [--tile-size 64]
+
+With --frames-dir, every image in the directory (sorted by name) is replayed
+in order; otherwise a synthetic browsing session is generated (spinner ticks,
+typing, hover highlights and the occasional scroll).
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import make_screenshot
+from tile_codec import apply_tile_delta, changed_tiles, decode_tile_delta, encode_tile_delta
+
+
+def load_recorded(frames_dir):
+    names = sorted(n for n in os.listdir(frames_dir) if n.lower().endswith((".png", ".jpg", ".jpeg")))
+    return [Image.open(os.path.join(frames_dir, n)).convert("RGB") for n in names]
+
+
+def synthetic_session(steps, width, height, seed):
+    rng = random.Random(seed)
+    page = Image.open(io.BytesIO(make_screenshot(width, height * 3, seed))).convert("RGB")
+    scroll = 0
+    typed = 0
+    frames = []
+    for step in range(steps):
+        frame = page.crop((0, scroll, width, scroll + height))
+        draw = ImageDraw.Draw(frame)
+        kind = rng.random()
+        # Spinner in the corner on every frame, rotating through four states.
+        angle = step % 4 * 90
+        draw.pieslice([width - 40, 10, width - 16, 34], angle, angle + 270, fill=(30, 30, 30))
+        draw.rectangle([40, 60, 40 + 9 * typed, 74], fill=(0, 0, 200))
+        if kind < 0.25:
+            typed += 1  # one more character in the search box
+        elif kind < 0.45:
+            y = rng.randrange(80, height - 40, 24)
+            draw.rectangle([38, y - 2, 600, y + 14], outline=(0, 120, 255), width=2)  # hover highlight
+        elif kind < 0.55:
+            scroll = min(scroll + rng.choice((120, 240, 400)), height * 2)
+        frames.append(frame)
+    return frames
+
+
+def encode_jpeg(image, quality):
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def decode_full(data):
+    image = Image.open(io.BytesIO(data))
+    return image.convert("RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames-dir")
+    parser.add_argument("--steps", type=int, default=120)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--tile-size", type=int, default=64)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--skip-fraction", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    frames = load_recorded(args.frames_dir) if args.frames_dir else synthetic_session(args.steps, args.width, args.height, args.seed)
+    full_frames = [encode_jpeg(f, args.quality) for f in frames]
+
+    start = time.perf_counter()
+    for data in full_frames:
+        decode_full(data)
+    full_decode_s = time.perf_counter() - start
+
+    # The client diffs against what it last sent; the server rebuilds from the same base.
+    payloads, encode_s = [], 0.0
+    for previous, current in zip(frames, frames[1:]):
+        start = time.perf_counter()
+        cells = changed_tiles(previous, current, args.tile_size)
+        payloads.append(encode_tile_delta(0, current, cells, args.tile_size, quality=args.quality))
+        encode_s += time.perf_counter() - start
+
+    server_frame = decode_full(full_frames[0])
+    skipped = 0
+    decode_s = full_decode_s / len(full_frames)  # the initial full frame
+    for payload in payloads:
+        start = time.perf_counter()
+        delta = decode_tile_delta(payload)
+        apply_tile_delta(server_frame, delta)
+        decode_s += time.perf_counter() - start
+        skipped += delta.changed_fraction() < args.skip_fraction
+
+    full_bytes = sum(len(d) for d in full_frames)
+    delta_bytes = len(full_frames[0]) + sum(len(p) for p in payloads)
+    n = len(frames)
+    print(f"Replayed {n} frames at {frames[0].size[0]}x{frames[0].size[1]}, {args.tile_size}px tiles")
+    print(f"{'mode':<12} {'bytes':>12} {'bytes/frame':>12} {'server ms/frame':>16}")
+    print(f"{'full jpeg':<12} {full_bytes:>12} {full_bytes // n:>12} {full_decode_s / n * 1000:>16.3f}")
+    print(f"{'tile delta':<12} {delta_bytes:>12} {delta_bytes // n:>12} {decode_s / n * 1000:>16.3f}")
+    print(f"Bandwidth saved: {1 - delta_bytes / full_bytes:.1%}; server decode time saved: {1 - decode_s / full_decode_s:.1%}")
+    print(f"Client diff+encode: {encode_s / max(1, len(payloads)) * 1000:.3f} ms/frame")
+    print(f"Frames below skip threshold ({args.skip_fraction:.1%} changed): {skipped}/{len(payloads)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Samples/s iterating a training dataset: sharded + deduplicated images vs inline-image JSONL.
+
+Usage: python benchmarks/bench_training_shards.py [--samples 100000] [--jsonl-samples 10000] [--unique-images 500]
+
+Builds a sharded dataset of --samples examples (screenshots drawn from a pool
+of --unique-images, as consecutive agent steps mostly repeat frames) and an
+inline-image JSONL file of --jsonl-samples examples, which is all the legacy
+format can afford on disk. Throughput is per sample, so the two are comparable.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import make_a11y_tree, make_screenshot
+from teacher_worker import build_training_line
+from training_shards import IMAGE_URL_PREFIX, ShardWriter, ShardedDataset, dataset_bytes, inline_image
+
+
+def timed(fn):
+    start = time.perf_counter()
+    n = fn()
+    return n, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--jsonl-samples", type=int, default=10000)
+    parser.add_argument("--unique-images", type=int, default=500)
+    parser.add_argument("--tree-nodes", type=int, default=40)
+    args = parser.parse_args()
+
+    images = [make_screenshot(640, 400, seed=i) for i in range(args.unique_images)]
+    trees = [make_a11y_tree(args.tree_nodes, seed=i) for i in range(64)]
+
+    def example(i):
+        return images[(i // 4) % len(images)], trees[i % len(trees)], f"Step {i}: the human clicked the result.", '{"action": "click"}'
+
+    with tempfile.TemporaryDirectory() as scratch:
+        jsonl_path = os.path.join(scratch, "training_dataset.jsonl")
+        shards_dir = os.path.join(scratch, "training_dataset")
+
+        def write_jsonl():
+            with open(jsonl_path, "w") as f:
+                for i in range(args.jsonl_samples):
+                    f.write(json.dumps(build_training_line(*example(i))) + "\n")
+            return args.jsonl_samples
+
+        def write_shards():
+            writer = ShardWriter(shards_dir)
+            for i in range(args.samples):
+                image, tree, cot, good = example(i)
+                digest = writer.put_image(image)
+                line = build_training_line(None, tree, cot, good, IMAGE_URL_PREFIX + digest)
+                line["image"] = digest
+                writer.append(line)
+                if i % 1000 == 999:
+                    writer.commit()
+            writer.commit()
+            writer.close()
+            return args.samples
+
+        def read_jsonl():
+            n = 0
+            with open(jsonl_path) as f:
+                for line in f:
+                    inline_image(json.loads(line))
+                    n += 1
+            return n
+
+        def read_shards(shuffle, with_images):
+            def run():
+                with ShardedDataset(shards_dir) as dataset:
+                    return sum(1 for _ in dataset.iterate(shuffle=shuffle, with_images=with_images))
+            return run
+
+        rows = [("write jsonl", *timed(write_jsonl)), ("write shards", *timed(write_shards))]
+        rows += [
+            ("jsonl, records + images", *timed(read_jsonl)),
+            ("shards, sequential records", *timed(read_shards(False, False))),
+            ("shards, shuffled records", *timed(read_shards(True, False))),
+            ("shards, shuffled + images", *timed(read_shards(True, True))),
+        ]
+        jsonl_mb = os.path.getsize(jsonl_path) / 2 ** 20
+        shards_mb = dataset_bytes(shards_dir) / 2 ** 20
+
+    print(f"{'pass':<28} {'samples':>8} {'seconds':>8} {'samples/s':>10}")
+    for name, n, seconds in rows:
+        print(f"{name:<28} {n:>8} {seconds:>8.2f} {n / seconds:>10.0f}")
+    print(f"\ndisk: jsonl {jsonl_mb / args.jsonl_samples * 1024:.1f} KB/sample "
+          f"({jsonl_mb * args.samples / args.jsonl_samples:.0f} MB at {args.samples}), "
+          f"shards {shards_mb / args.samples * 1024:.1f} KB/sample ({shards_mb:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
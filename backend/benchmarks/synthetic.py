@@ -0,0 +1,57 @@
+import io
+import json
+import random
+
+from PIL import Image, ImageDraw
+
+# Synthetic observations at realistic sizes for benchmarks (no browser needed).
+
+ROLES = ["link", "button", "staticText", "heading", "textField", "image", "listItem", "checkBox", "paragraph"]
+
+def make_a11y_tree(n_nodes=2000, seed=0, viewport_height=800, wrapper_depth=4):
+    """Nested tree of roughly n_nodes nodes, ~100-150 bytes each, mostly wrappers and text like real pages."""
+    rng = random.Random(seed)
+    next_id = [1]
+
+    def node(role, name="", y=0):
+        node_id = next_id[0]
+        next_id[0] += 1
+        return {"id": node_id, "role": role, "name": name, "bbox": [rng.randint(0, 1100), y, rng.randint(40, 600), rng.randint(12, 40)], "children": []}
+
+    root = node("RootWebArea", "Synthetic page")
+    sections = []
+    while next_id[0] < n_nodes:
+        y = rng.randint(0, viewport_height * 6)
+        leaf = node(rng.choice(ROLES), " ".join(rng.choice(["market", "revenue", "report", "news", "login", "next", "page", "quarter", "analysis", "privacy"]) for _ in range(rng.randint(1, 6))), y)
+        for _ in range(rng.randint(0, wrapper_depth)):
+            wrapper = node("generic", "", y)
+            wrapper["children"].append(leaf)
+            leaf = wrapper
+        sections.append(leaf)
+    root["children"] = sections
+    return json.dumps(root)
+
+def make_screenshot(width=1280, height=800, seed=0, quality=80):
+    """JPEG bytes for a page-like frame: flat background, text-ish bars and a noisy image block."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for y in range(20, height, 24):
+        draw.rectangle([40, y, 40 + rng.randint(200, width - 400), y + 10], fill=(rng.randint(0, 80),) * 3)
+    img.paste(Image.effect_noise((width // 3, height // 3), 64).convert("RGB"), (width // 2, height // 4))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+def make_osint_corpus(n_paragraphs=200, seed=0, duplicate_rate=0.2):
+    """Scraped-page text: paragraphs of 40-120 words, some repeated verbatim like boilerplate."""
+    rng = random.Random(seed)
+    words = ["company", "filed", "quarterly", "revenue", "director", "subsidiary", "acquired", "registered",
+             "office", "shares", "investigation", "reported", "announced", "market", "partner", "contract"]
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        if paragraphs and rng.random() < duplicate_rate:
+            paragraphs.append(rng.choice(paragraphs))
+        else:
+            paragraphs.append(" ".join(rng.choice(words) for _ in range(rng.randint(40, 120))) + ".")
+    return "\n\n".join(paragraphs)
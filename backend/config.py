@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+
+# Shared configuration for the server, the teacher worker and the forge:
+# ../smartchrome_config.json (or $SMARTCHROME_CONFIG) over DEFAULTS.
+#
+# load_config() parses the file once per process and hands every module the
+# same dict. reload() re-reads it when its mtime or size changed and updates
+# that dict in place, so settings read per request (CONFIG.get(...) on the
+# request path) follow edits; settings used to build long-lived objects
+# (ports, scheduler sizes) need a restart unless an on_change() callback
+# rebuilds them. watch() polls from a daemon thread. Values set with
+# override() (command-line flags) win over the file across reloads.
+
+CONFIG_PATH = os.environ.get("SMARTCHROME_CONFIG") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smartchrome_config.json")
+
+DEFAULTS = {
+    "host": "127.0.0.1", "port": 8000, "db_path": "rlhf_tuples.db",
+    "engine": "mock", "model_path": None, "reports_dir": "reports",
+    "models_dir": "models", "training_dataset": "training_dataset",
+}
+
+CONFIG = {}
+_overrides = {}
+_listeners = []
+_lock = threading.Lock()
+_stamp = None
+_loaded = False
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _refresh():
+    """Re-read CONFIG_PATH into CONFIG; returns the keys whose values changed."""
+    global _stamp, _loaded
+    stamp = _file_stamp(CONFIG_PATH)
+    values = dict(DEFAULTS)
+    if stamp is not None:
+        try:
+            with open(CONFIG_PATH, "r") as f:
+                values.update(json.load(f))
+        except (OSError, ValueError) as e:
+            if not _loaded:
+                raise
+            # Usually an editor mid-save; keep serving the last good config.
+            print(f"Keeping the previous config: cannot read {CONFIG_PATH} ({e}).")
+            _stamp = stamp
+            return set()
+    values.update(_overrides)
+    changed = {key for key in values.keys() | CONFIG.keys() if values.get(key) != CONFIG.get(key)}
+    # In place, and without a window where a key is missing for concurrent readers.
+    CONFIG.update(values)
+    for key in CONFIG.keys() - values.keys():
+        del CONFIG[key]
+    _stamp = stamp
+    _loaded = True
+    return changed
+
+
+def load_config():
+    """The shared config dict, read from disk on first use."""
+    with _lock:
+        if not _loaded:
+            _refresh()
+    return CONFIG
+
+
+def reload():
+    """Re-read the file if it changed since the last read; returns the changed keys."""
+    with _lock:
+        if _loaded and _file_stamp(CONFIG_PATH) == _stamp:
+            return set()
+        changed = _refresh()
+    if changed:
+        for callback in list(_listeners):
+            callback(changed)
+    return changed
+
+
+def override(**values):
+    """Set values that take precedence over the file, across reloads."""
+    load_config()
+    with _lock:
+        _overrides.update(values)
+        CONFIG.update(values)
+
+
+def on_change(callback):
+    """Call callback(changed_keys) after a reload that changed something."""
+    _listeners.append(callback)
+    return callback
+
+
+def watch(interval_s=2.0):
+    """Poll the file from a daemon thread and reload it when it changes."""
+    def run():
+        while True:
+            time.sleep(interval_s)
+            try:
+                changed = reload()
+            except Exception as e:
+                print(f"Config reload failed: {e}")
+                continue
+            if changed:
+                print(f"Reloaded {CONFIG_PATH}: {', '.join(sorted(changed))} changed.")
+
+    thread = threading.Thread(target=run, daemon=True, name="config-watch")
+    thread.start()
+    return thread
@@ -0,0 +1,236 @@
+import asyncio
+import gc
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from PIL import Image
+
+from action_schema import ACTION_SCHEMA
+
+_versions = itertools.count(1)
+_reload_ids = itertools.count(1)
+
+
+class EngineLoadError(Exception):
+    pass
+
+
+class ReloadInProgressError(Exception):
+    pass
+
+
+class MockLLM:
+    """Stands in for vllm.LLM on CPU: one fixed action per input after
+    `latency_s` per batch, with the same output shape as llm.generate."""
+
+    text = '{"action": "scroll", "direction": "down", "thought": "Mock engine."}'
+
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+
+    def generate(self, batch, sampling_params=None):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return [SimpleNamespace(outputs=[SimpleNamespace(text=self.text)]) for _ in batch]
+
+
+class Engine:
+    """One loaded model plus the handles needed to run it.
+
+    `in_flight` counts requests currently holding a lease, so a retired
+    engine is only released once they have all finished.
+    """
+
+    def __init__(self, kind, model_path=None, llm=None, sampling_params=None, model=None, processor=None):
+        self.kind = kind
+        self.model_path = model_path
+        self.llm = llm
+        self.sampling_params = sampling_params
+        self.model = model
+        self.processor = processor
+        self.version = next(_versions)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+            self._idle.clear()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    def wait_idle(self, timeout=None):
+        return self._idle.wait(timeout)
+
+    @property
+    def model_id(self):
+        # Stable across restarts, unlike `version`; used to key cached actions.
+        return f"{self.kind}:{self.model_path}"
+
+    def generate(self, batch):
+        return self.llm.generate(batch, self.sampling_params)
+
+    def close(self):
+        llm, model = self.llm, self.model
+        self.llm = self.model = self.processor = None
+        del llm, model
+        gc.collect()
+        if self.kind == "vllm":
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+
+def action_sampling_params(config):
+    """Greedy decoding constrained to the action schema; the grammar only
+    admits EOS once the object closes, so generation stops right there."""
+    from vllm import SamplingParams
+    kwargs = {"temperature": 0.0, "max_tokens": config.get("action_max_tokens", 256)}
+    if config.get("guided_decoding", True):
+        try:
+            from vllm.sampling_params import GuidedDecodingParams
+            kwargs["guided_decoding"] = GuidedDecodingParams(json=ACTION_SCHEMA)
+        except ImportError:
+            print("This vLLM has no guided decoding; action JSON will be free-form.")
+            kwargs["max_tokens"] = config.get("action_max_tokens", 512)
+    return SamplingParams(**kwargs)
+
+
+def load_engine(kind, model_path, config):
+    """Load a model for `kind` ("vllm", "mlx", "sim" or "mock"). Raises EngineLoadError."""
+    try:
+        if kind == "mlx":
+            print(f"Initializing MLX-VLM with {model_path}...")
+            from mlx_vlm import load
+            model, processor = load(model_path)
+            return Engine("mlx", model_path, model=model, processor=processor)
+        if kind == "vllm":
+            print(f"Initializing VLLM with {model_path}...")
+            from vllm import LLM
+            llm_kwargs = {"model": model_path, "trust_remote_code": True, "max_model_len": 4096}
+            # Blue/green reloads hold two engines at once; leave room for both.
+            if config.get("vllm_gpu_memory_utilization"):
+                llm_kwargs["gpu_memory_utilization"] = config["vllm_gpu_memory_utilization"]
+            llm = LLM(**llm_kwargs)
+            return Engine("vllm", model_path, llm=llm, sampling_params=action_sampling_params(config))
+        if kind == "sim":
+            from mock_engine import SimulatedLLM
+            print("Using Simulated Engine.")
+            return Engine("sim", model_path, llm=SimulatedLLM.from_config(config.get("sim_engine")))
+        print("Using Mock Engine.")
+        return Engine("mock", model_path, llm=MockLLM())
+    except Exception as e:
+        raise EngineLoadError(f"Error loading {kind} engine from {model_path}: {e}") from e
+
+
+def generate_batch(batch):
+    """InferenceScheduler generate_fn. Items are (engine, input) so a batch
+    straddling a hot reload still runs each input on the engine that leased it."""
+    outputs = [None] * len(batch)
+    groups = {}
+    for i, (engine, _) in enumerate(batch):
+        groups.setdefault(engine, []).append(i)
+    for engine, indices in groups.items():
+        for i, output in zip(indices, engine.generate([batch[i][1] for i in indices])):
+            outputs[i] = output
+    return outputs
+
+
+def health_check(engine):
+    """Warm the engine up with a tiny request and fail if it cannot answer."""
+    if engine.kind != "vllm":
+        return
+    prompt = "<|im_start|>user\n<|vision_start|><|image_pad|><|vision_end|>Reply with {}.<|im_end|>\n<|im_start|>assistant\n"
+    outputs = engine.generate([{"prompt": prompt, "multi_modal_data": {"image": Image.new("RGB", (28, 28))}}])
+    if not outputs or not outputs[0].outputs:
+        raise EngineLoadError("Health check produced no output.")
+
+
+class EngineManager:
+    """Blue/green model swaps.
+
+    The active engine keeps serving while a replacement loads and is health
+    checked in a worker thread. Traffic switches with a single reference
+    assignment; the previous engine is released once its in-flight requests
+    drain. A failed load leaves the active engine untouched.
+    """
+
+    def __init__(self, config, loader=load_engine, checker=health_check, drain_timeout_s=120.0, on_swap=None):
+        self.config = config
+        self.on_swap = on_swap
+        self.loader = loader
+        self.checker = checker
+        self.drain_timeout_s = drain_timeout_s
+        self.active = Engine("mock")
+        self.reload_status = {"state": "idle"}
+        self._reload_task = None
+
+    def load_initial(self, kind, model_path):
+        try:
+            self.active = self.loader(kind, model_path, self.config)
+        except EngineLoadError as e:
+            print(f"{e}. Falling back to mock.")
+            self.active = load_engine("mock", model_path, self.config)
+        return self.active
+
+    @contextmanager
+    def lease(self):
+        engine = self.active
+        engine.acquire()
+        try:
+            yield engine
+        finally:
+            engine.release()
+
+    @property
+    def reloading(self):
+        return self._reload_task is not None and not self._reload_task.done()
+
+    def start_reload(self, kind, model_path):
+        if self.reloading:
+            raise ReloadInProgressError("A reload is already in progress.")
+        self.reload_status = {
+            "id": next(_reload_ids), "state": "loading", "engine": kind, "model_path": model_path,
+            "started": time.time(), "finished": None, "error": None,
+        }
+        self._reload_task = asyncio.get_running_loop().create_task(self._reload(kind, model_path))
+        return self.reload_status
+
+    def _set_state(self, state, **fields):
+        self.reload_status = {**self.reload_status, "state": state, **fields}
+
+    async def _reload(self, kind, model_path):
+        candidate = None
+        try:
+            candidate = await asyncio.to_thread(self.loader, kind, model_path, self.config)
+            self._set_state("health_check")
+            await asyncio.to_thread(self.checker, candidate)
+        except Exception as e:
+            if candidate is not None:
+                await asyncio.to_thread(candidate.close)
+            self._set_state("failed", error=str(e), finished=time.time(), active_version=self.active.version)
+            print(f"Reload failed, keeping {self.active.kind} engine v{self.active.version}: {e}")
+            return
+
+        previous, self.active = self.active, candidate
+        if self.on_swap:
+            self.on_swap(candidate)
+        self._set_state("draining", active_version=candidate.version)
+        drained = await asyncio.to_thread(previous.wait_idle, self.drain_timeout_s)
+        if not drained:
+            print(f"Engine v{previous.version} still has {previous.in_flight} requests after {self.drain_timeout_s}s; waiting.")
+            await asyncio.to_thread(previous.wait_idle)
+        await asyncio.to_thread(previous.close)
+        self._set_state("succeeded", finished=time.time())
@@ -0,0 +1,160 @@
+import time
+from urllib.parse import quote_plus
+
+from a11y_index import compile_pattern
+
+# Rule-based fast path ahead of the VLM. Each rule looks at the indexed a11y
+# tree (see a11y_index.py) and the session, and either returns an action or
+# None to defer. Rules are declared in config under "fast_path_rules":
+#   {"name": "consent_banner", "type": "click_node", "roles": ["button"], "name_pattern": "^accept"}
+# and run in order; the first hit wins. New rule types register with
+# @rule_type("name").
+
+RULE_TYPES = {}
+
+DEFAULT_RULES = [
+    {"name": "bootstrap_search", "type": "empty_page"},
+]
+
+
+def rule_type(name):
+    def register(cls):
+        RULE_TYPES[name] = cls
+        return cls
+    return register
+
+
+def _roles(roles):
+    return [r.replace("_", "").replace("-", "").lower() for r in roles] if roles else None
+
+
+class Rule:
+    def __init__(self, name, thought=None, max_hits_per_session=None, allow_repeat=False):
+        self.name = name
+        self.thought = thought
+        self.max_hits_per_session = max_hits_per_session
+        self.allow_repeat = allow_repeat
+        self.evaluations = 0
+        self.hits = 0
+        self.total_ns = 0
+
+    def match(self, index, session):
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            "evaluations": self.evaluations,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.evaluations, 4) if self.evaluations else 0.0,
+            "avg_us": round(self.total_ns / self.evaluations / 1000, 2) if self.evaluations else 0.0,
+        }
+
+
+@rule_type("empty_page")
+class EmptyPageRule(Rule):
+    """Blank tab or New Tab Page: search for the objective."""
+
+    def __init__(self, name, max_tree_chars=50, markers=("newtab",), url="https://www.google.com/search?q={query}", **kwargs):
+        kwargs.setdefault("thought", "Starting mission by searching for objective.")
+        kwargs.setdefault("allow_repeat", True)
+        super().__init__(name, **kwargs)
+        self.max_tree_chars = max_tree_chars
+        self.markers = [m.lower() for m in markers]
+        self.url = url
+
+    def match(self, index, session):
+        if not session.objective:
+            return None
+        if len(index.raw) < self.max_tree_chars or any(m in index.raw_lower for m in self.markers):
+            return {"action": "navigate", "url": self.url.format(query=quote_plus(session.objective)), "thought": self.thought}
+        return None
+
+
+@rule_type("click_node")
+class ClickNodeRule(Rule):
+    """Click the first visible node whose role and name match, e.g. a consent button."""
+
+    def __init__(self, name, name_pattern, roles=("button", "link"), **kwargs):
+        super().__init__(name, **kwargs)
+        self.roles = _roles(roles)
+        self.pattern = compile_pattern(name_pattern)
+
+    def match(self, index, session):
+        for entry in index.find(self.roles, self.pattern):
+            if entry.visible:
+                return {"action": "click", "target_bbox": entry.bbox, "thought": self.thought or f'Clicking "{entry.name}".'}
+        return None
+
+
+@rule_type("type_objective")
+class TypeObjectiveRule(Rule):
+    """Type the objective into an empty search box, once per session by default:
+    a site-header search box is on every page of a site, and the rule must not
+    take over from the model in the middle of a task."""
+
+    def __init__(self, name, name_pattern="search", roles=("searchbox", "textfield", "textbox", "combobox"), **kwargs):
+        kwargs.setdefault("thought", "Entering the objective into the search box.")
+        kwargs.setdefault("max_hits_per_session", 1)
+        super().__init__(name, **kwargs)
+        self.roles = _roles(roles)
+        self.pattern = compile_pattern(name_pattern)
+
+    def match(self, index, session):
+        if not session.objective:
+            return None
+        entries = list(index.find(self.roles, self.pattern))
+        objective = session.objective.casefold()
+        if any(objective in entry.value.casefold() for entry in entries):
+            return None  # already searched for on this page
+        for entry in entries:
+            if entry.visible and not entry.value.strip():
+                return {"action": "type", "target_bbox": entry.bbox, "text": session.objective, "thought": self.thought}
+        return None
+
+
+def build_rule(spec):
+    spec = dict(spec)
+    kind = spec.pop("type")
+    if kind not in RULE_TYPES:
+        raise ValueError(f"Unknown fast-path rule type {kind!r}.")
+    return RULE_TYPES[kind](spec.pop("name", kind), **spec)
+
+
+class FastPathEngine:
+    def __init__(self, rule_specs=None):
+        self.rules = [build_rule(spec) for spec in (DEFAULT_RULES if rule_specs is None else rule_specs)]
+        self.evaluations = 0
+        self.hits = 0
+        self.total_ns = 0
+
+    def evaluate(self, index, session):
+        """(rule_name, action) for the first rule that fires, or None to defer to the VLM."""
+        started = time.perf_counter_ns()
+        self.evaluations += 1
+        try:
+            for rule in self.rules:
+                if rule.max_hits_per_session is not None and session.fast_path_hits.get(rule.name, 0) >= rule.max_hits_per_session:
+                    continue
+                rule_started = time.perf_counter_ns()
+                rule.evaluations += 1
+                action = rule.match(index, session)
+                rule.total_ns += time.perf_counter_ns() - rule_started
+                # Repeating the exact action the tab just took means it did not work; let the model look.
+                if action is None or (action == session.last_action and not rule.allow_repeat):
+                    continue
+                rule.hits += 1
+                self.hits += 1
+                session.fast_path_hits[rule.name] = session.fast_path_hits.get(rule.name, 0) + 1
+                return rule.name, action
+            return None
+        finally:
+            self.total_ns += time.perf_counter_ns() - started
+
+    def stats(self):
+        return {
+            "evaluations": self.evaluations,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.evaluations, 4) if self.evaluations else 0.0,
+            "avg_us": round(self.total_ns / self.evaluations / 1000, 2) if self.evaluations else 0.0,
+            "rules": {rule.name: rule.stats() for rule in self.rules},
+        }
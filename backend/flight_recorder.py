@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import base64
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+# Flight recorder for the action loop, and offline replay of what it wrote.
+#
+#   <dir>/flight-YYYYmmdd-HHMMSS-<pid>-NNNN.trace    concatenated gzip members
+#
+# Decompressed, a trace file is a sequence of records:
+#   !I header length, header JSON, !I payload length, payload
+# A "blob" record carries a screenshot or an a11y tree as its payload, once
+# per content hash per file. A "step" record is one /vlm/act, /vlm/act/binary
+# or /vlm/objective call (request fields, response, status, latency and phase
+# timings) and names its blobs by hash. Files are self-contained, so the
+# oldest can be deleted when the directory exceeds its size cap.
+#
+# The request path only appends to a bounded queue; hashing, compression and
+# disk writes happen on the writer thread. Each batch it drains becomes one
+# gzip member, so a crash loses at most the batch in flight, and when the
+# queue is full steps are dropped (and counted) rather than waited on.
+
+TRACE_PREFIX = "flight-"
+TRACE_SUFFIX = ".trace"
+_LEN = struct.Struct("!I")
+
+_current_step = contextvars.ContextVar("flight_recorder_step", default=None)
+
+
+def note_phase(phase, seconds):
+    """Add a phase timing to the step being recorded in this context, if any.
+    asyncio.to_thread copies the context, so phases timed in threads count."""
+    step = _current_step.get()
+    if step is not None:
+        step["phases"][phase] = step["phases"].get(phase, 0.0) + seconds
+
+
+def _pack(header, payload=b""):
+    data = json.dumps(header, separators=(",", ":"), default=str).encode("utf-8")
+    return b"".join((_LEN.pack(len(data)), data, _LEN.pack(len(payload)), payload))
+
+
+def trace_files(directory):
+    """Trace files in a directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if name.startswith(TRACE_PREFIX) and name.endswith(TRACE_SUFFIX)]
+    return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+
+class FlightRecorder:
+    def __init__(self, directory, max_bytes=512 * 2 ** 20, max_file_bytes=32 * 2 ** 20, queue_size=1024,
+                 flush_interval_s=0.5, batch_size=256, compresslevel=6):
+        if max_file_bytes > max_bytes:
+            raise ValueError("max_file_bytes must not exceed max_bytes.")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.flush_interval_s = flush_interval_s
+        self.batch_size = batch_size
+        self.compresslevel = compresslevel
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._blobs = set()
+        self._sequence = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.errors = 0
+        self.blobs_written = 0
+        self.blobs_deduplicated = 0
+        self.bytes_written = 0
+        self.files_deleted = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True, name="flight-recorder")
+                    self._thread.start()
+
+    def record(self, entry, blobs=None):
+        """Queue a step for writing without blocking. `blobs` maps names to
+        bytes, str, or a callable returning either (run on the writer thread)."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((entry, blobs or {}))
+        except queue.Full:
+            self.dropped += 1
+
+    @contextmanager
+    def step(self, route, request, blobs=None, **fields):
+        """Record one request: the caller fills in step["response"]; status,
+        latency and phases timed with note_phase() are added here."""
+        entry = {"type": "step", "route": route, "ts": time.time(), "request": request, **fields,
+                 "phases": {}, "status": 200}
+        token = _current_step.set(entry)
+        start = time.perf_counter()
+        try:
+            yield entry
+        except Exception as e:
+            entry["status"] = getattr(e, "status_code", 500)
+            entry["error"] = str(getattr(e, "detail", e))
+            raise
+        finally:
+            _current_step.reset(token)
+            entry["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            entry["phases"] = {k: round(v * 1000, 3) for k, v in entry["phases"].items()}
+            self.record(entry, blobs)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval_s
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"Flight recorder dropped {len(batch)} steps: {e}")
+                # Blobs of the failed batch may be missing from this file; start a fresh one.
+                self._close_file()
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                break
+        self._close_file()
+
+    def _write_batch(self, batch):
+        if self._file is None or self._file.tell() >= self.max_file_bytes:
+            self._rotate()
+        chunks = []
+        for entry, blobs in batch:
+            refs = {}
+            for name, value in blobs.items():
+                if callable(value):
+                    try:
+                        value = value()
+                    except Exception:
+                        value = None
+                if value is None or not len(value):
+                    continue
+                data = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+                digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+                if digest in self._blobs:
+                    self.blobs_deduplicated += 1
+                else:
+                    chunks.append(_pack({"type": "blob", "hash": digest, "text": isinstance(value, str)}, data))
+                    self._blobs.add(digest)
+                    self.blobs_written += 1
+                refs[name] = digest
+            chunks.append(_pack({**entry, "blobs": refs}))
+        data = gzip.compress(b"".join(chunks), self.compresslevel)
+        self._file.write(data)
+        self._file.flush()
+        self.bytes_written += len(data)
+        self.recorded += len(batch)
+
+    def _rotate(self):
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{TRACE_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence:04d}{TRACE_SUFFIX}"
+        # Make room for a full new file before opening it, so the directory stays under max_bytes.
+        files = trace_files(self.directory)
+        total = sum(os.path.getsize(p) for p in files)
+        while files and total + self.max_file_bytes > self.max_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            self.files_deleted += 1
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, "ab")
+        self._blobs = set()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        """Block until every queued step has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queued": self._queue.qsize(),
+            "bytes_written": self.bytes_written,
+            "blobs_written": self.blobs_written,
+            "blobs_deduplicated": self.blobs_deduplicated,
+            "files_deleted": self.files_deleted,
+            "current_file": self._path,
+        }
+
+
+def read_trace(path):
+    """Steps from one trace file, with blobs resolved under step["data"]
+    (bytes, or str for text). Stops quietly at a truncated final member."""
+    blobs = {}
+    with gzip.open(path, "rb") as f:
+        try:
+            while True:
+                prefix = f.read(_LEN.size)
+                if len(prefix) < _LEN.size:
+                    return
+                header = json.loads(f.read(_LEN.unpack(prefix)[0]))
+                payload = f.read(_LEN.unpack(f.read(_LEN.size))[0])
+                if header.get("type") == "blob":
+                    blobs[header["hash"]] = payload.decode("utf-8") if header.get("text") else payload
+                elif header.get("type") == "step":
+                    header["data"] = {name: blobs.get(digest) for name, digest in header.pop("blobs", {}).items()}
+                    yield header
+        except (EOFError, zlib.error, struct.error, ValueError):
+            return
+
+
+def read_steps(paths):
+    """Steps from trace files and/or directories, in recorded order."""
+    files = []
+    for path in paths:
+        files.extend(trace_files(path) if os.path.isdir(path) else [path])
+    steps = [step for path in files for step in read_trace(path)]
+    steps.sort(key=lambda step: step["ts"])
+    return steps
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def _same_action(recorded, replayed):
+    if not isinstance(recorded, dict) or not isinstance(replayed, dict):
+        return recorded == replayed
+    ignored = ("thought", "skipped")
+    return ({k: v for k, v in recorded.items() if k not in ignored}
+            == {k: v for k, v in replayed.items() if k not in ignored})
+
+
+def _build_request(step, session_suffix):
+    from frame_codec import FRAME_CONTENT_TYPE, encode_frame
+
+    request = dict(step["request"])
+    data = step["data"]
+    if request.get("session_id") and session_suffix:
+        request["session_id"] += session_suffix
+    if step["route"] == "/vlm/act/binary":
+        headers = {"Content-Type": FRAME_CONTENT_TYPE}
+        for name, key in (("X-Session-Id", "session_id"), ("X-Tree-Version", "tree_version"),
+                          ("X-Base-Version", "base_version"), ("X-Viewport", "viewport")):
+            if request.get(key) is not None:
+                headers[name] = str(request[key])
+        return {"content": encode_frame(data.get("a11y_tree") or "", data.get("frame") or b""), "headers": headers}
+    if step["route"] == "/vlm/act":
+        request["a11y_tree"] = data.get("a11y_tree") or ""
+        request["image_base64"] = base64.b64encode(data.get("frame") or b"").decode("ascii")
+    return {"json": request}
+
+
+async def replay(steps, client, speed=1.0, session_suffix=""):
+    """Send recorded steps through an httpx.AsyncClient and compare.
+
+    Steps of one session are sent in order; sessions run concurrently. With
+    speed > 0 each step waits for its original offset divided by speed; with
+    speed 0 steps go out as fast as the server answers.
+    """
+    import httpx
+
+    httpx_errors = (httpx.HTTPError, OSError)
+    if not steps:
+        return {"steps": 0}
+    sessions = {}
+    for step in steps:
+        sessions.setdefault(step["request"].get("session_id"), []).append(step)
+    origin = steps[0]["ts"]
+    results = []
+
+    async def run_session(session_steps):
+        for step in session_steps:
+            if speed:
+                delay = (step["ts"] - origin) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            start = time.perf_counter()
+            try:
+                response = await client.post(step["route"], **_build_request(step, session_suffix))
+                status = response.status_code
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = response.text
+            except httpx_errors as e:
+                status, body = 0, str(e)
+            results.append((step, status, body, (time.perf_counter() - start) * 1000))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[run_session(s) for s in sessions.values()])
+    wall_s = time.perf_counter() - started
+
+    acts = [r for r in results if r[0]["route"] != "/vlm/objective"]
+    recorded_ms = [r[0]["latency_ms"] for r in acts]
+    replay_ms = [r[3] for r in acts]
+    compared = [r for r in acts if r[0]["status"] == 200 and r[1] == 200]
+    return {
+        "steps": len(results),
+        "sessions": len(sessions),
+        "wall_s": round(wall_s, 3),
+        "steps_per_s": round(len(results) / wall_s, 1) if wall_s else 0.0,
+        "status_mismatches": sum(1 for r in results if r[0]["status"] != r[1]),
+        "resyncs": sum(1 for r in results if r[1] == 409),
+        "actions_compared": len(compared),
+        "actions_matched": sum(1 for r in compared if _same_action(r[0].get("response"), r[2])),
+        "recorded_p50_ms": round(_percentile(recorded_ms, 50), 2),
+        "recorded_p95_ms": round(_percentile(recorded_ms, 95), 2),
+        "replay_p50_ms": round(_percentile(replay_ms, 50), 2),
+        "replay_p95_ms": round(_percentile(replay_ms, 95), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Action-loop flight recorder tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="Summarise trace files or directories")
+    info.add_argument("paths", nargs="+")
+    play = commands.add_parser("replay", help="Feed traces back into a running server")
+    play.add_argument("paths", nargs="+")
+    play.add_argument("--url", default="http://127.0.0.1:8000")
+    play.add_argument("--speed", type=float, default=1.0,
+                      help="Multiple of the original pace; 0 sends each step as soon as the last one returned")
+    play.add_argument("--session-suffix", default="",
+                      help="Appended to session ids so a replay does not collide with live sessions")
+    play.add_argument("--timeout", type=float, default=120.0)
+    play.add_argument("--output", help="Write the comparison as JSON")
+    args = parser.parse_args()
+
+    steps = read_steps(args.paths)
+    if args.command == "info":
+        routes = {}
+        for step in steps:
+            routes[step["route"]] = routes.get(step["route"], 0) + 1
+        duration = steps[-1]["ts"] - steps[0]["ts"] if steps else 0.0
+        print(f"{len(steps)} steps over {duration:.1f}s from "
+              f"{len({s['request'].get('session_id') for s in steps})} sessions: "
+              + ", ".join(f"{route} {n}" for route, n in sorted(routes.items())))
+        return
+
+    import httpx
+
+    async def run():
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            return await replay(steps, client, args.speed, args.session_suffix)
+
+    summary = asyncio.run(run())
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
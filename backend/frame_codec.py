@@ -0,0 +1,71 @@
+import io
+import struct
+
+# Binary observation frame used by POST /vlm/act/binary:
+#   4 bytes  magic b"SCF1"
+#   4 bytes  big-endian uint32 length of the UTF-8 a11y tree
+#   N bytes  a11y tree (UTF-8 JSON)
+#   rest     encoded screenshot (JPEG/PNG) bytes
+FRAME_MAGIC = b"SCF1"
+FRAME_CONTENT_TYPE = "application/x-smartchrome-frame"
+_HEADER = struct.Struct("!4sI")
+
+
+class FrameFormatError(ValueError):
+    pass
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview, so PIL can decode an image
+    that lives inside a larger buffer without copying it out first."""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._pos = max(0, pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def encode_frame(a11y_tree, image_bytes):
+    tree = a11y_tree.encode("utf-8") if isinstance(a11y_tree, str) else a11y_tree
+    return b"".join((_HEADER.pack(FRAME_MAGIC, len(tree)), tree, image_bytes))
+
+
+def decode_frame(body):
+    """Split a binary frame into (a11y_tree str, image memoryview)."""
+    view = memoryview(body)
+    if len(view) < _HEADER.size:
+        raise FrameFormatError("Frame is shorter than its header.")
+    magic, tree_len = _HEADER.unpack_from(view)
+    if magic != FRAME_MAGIC:
+        raise FrameFormatError("Bad frame magic.")
+    tree_end = _HEADER.size + tree_len
+    if tree_end > len(view):
+        raise FrameFormatError("A11y tree length exceeds frame size.")
+    a11y_tree = str(view[_HEADER.size:tree_end], "utf-8")
+    return a11y_tree, view[tree_end:]
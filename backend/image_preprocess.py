@@ -0,0 +1,134 @@
+import math
+import time
+
+from PIL import Image
+
+# Screenshot preprocessing for the vision encoder. Qwen2.5-VL style models
+# cut the image into 28px patches (14px ViT patches merged 2x2), one vision
+# token each, so a HiDPI viewport costs 4x the prefill of the same page at 1x
+# without telling the model anything new. Frames are decoded at reduced scale
+# where the codec allows it, optionally cropped to the region the compacted
+# a11y nodes cover, and resized to a patch-aligned size within a pixel budget.
+# The model answers in coordinates of the image it saw; BBoxTransform maps
+# them back to page (CSS viewport) coordinates, so prepare() needs the CSS
+# viewport the frame was captured at. Without one the frame is taken to be
+# at 1x (one device pixel per CSS pixel).
+
+
+def smart_resize(width, height, patch=28, min_pixels=4 * 28 * 28, max_pixels=1280 * 28 * 28):
+    """Aspect-preserving (width, height), both multiples of `patch`, within the pixel budget."""
+    w = max(patch, round(width / patch) * patch)
+    h = max(patch, round(height / patch) * patch)
+    if w * h > max_pixels:
+        beta = math.sqrt(width * height / max_pixels)
+        w = max(patch, math.floor(width / beta / patch) * patch)
+        h = max(patch, math.floor(height / beta / patch) * patch)
+    elif w * h < min_pixels:
+        beta = math.sqrt(min_pixels / (width * height))
+        w = math.ceil(width * beta / patch) * patch
+        h = math.ceil(height * beta / patch) * patch
+    return w, h
+
+
+def vision_tokens(width, height, patch=28):
+    return math.ceil(width / patch) * math.ceil(height / patch)
+
+
+class BBoxTransform:
+    """model_px = (page_px - offset) * scale, per axis."""
+
+    def __init__(self, scale_x=1.0, scale_y=1.0, offset_x=0.0, offset_y=0.0):
+        self.scale_x = scale_x
+        self.scale_y = scale_y
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    def to_model(self, bbox):
+        x, y, w, h = bbox
+        return [(x - self.offset_x) * self.scale_x, (y - self.offset_y) * self.scale_y, w * self.scale_x, h * self.scale_y]
+
+    def to_page(self, bbox):
+        x, y, w, h = bbox
+        return [round(x / self.scale_x + self.offset_x), round(y / self.scale_y + self.offset_y),
+                round(w / self.scale_x), round(h / self.scale_y)]
+
+
+class PreparedImage:
+    def __init__(self, image, transform, stats):
+        self.image = image
+        self.transform = transform
+        self.stats = stats
+
+
+class ImagePreprocessor:
+    def __init__(self, patch=28, min_pixels=4 * 28 * 28, max_pixels=1280 * 28 * 28,
+                 crop_to_nodes=False, crop_margin=48, crop_max_fraction=0.8):
+        self.patch = patch
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.crop_to_nodes = crop_to_nodes
+        self.crop_margin = crop_margin
+        self.crop_max_fraction = crop_max_fraction
+
+    def decode(self, image):
+        """Load a lazily opened image, letting JPEG decode straight to a reduced scale."""
+        started = time.perf_counter()
+        source_size = image.size
+        if getattr(image, "format", None) == "JPEG":
+            # draft() picks the largest 1/2, 1/4 or 1/8 DCT scale still at least this big.
+            image.draft("RGB", smart_resize(*image.size, self.patch, self.min_pixels, self.max_pixels))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.load()
+        image.info["source_size"] = source_size
+        image.info["decode_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return image
+
+    def _crop_box(self, nodes, page_w, page_h):
+        boxes = [n.bbox for n in nodes if n.bbox is not None and n.bbox[2] > 0 and n.bbox[3] > 0]
+        if not self.crop_to_nodes or not boxes:
+            return None
+        m = self.crop_margin
+        x0 = max(0.0, min(b[0] for b in boxes) - m)
+        y0 = max(0.0, min(b[1] for b in boxes) - m)
+        x1 = min(page_w, max(b[0] + b[2] for b in boxes) + m)
+        y1 = min(page_h, max(b[1] + b[3] for b in boxes) + m)
+        if x1 - x0 < self.patch or y1 - y0 < self.patch:
+            return None
+        if (x1 - x0) * (y1 - y0) > self.crop_max_fraction * page_w * page_h:
+            return None  # not worth losing the surrounding context
+        return x0, y0, x1, y1
+
+    def prepare(self, image, nodes=(), viewport=None):
+        """Resize (and optionally crop) a decoded frame for the model. `viewport` is
+        the page's CSS (width, height); defaults to the source frame size. Returns PreparedImage."""
+        started = time.perf_counter()
+        img_w, img_h = image.size
+        source_w, source_h = image.info.get("source_size", image.size)
+        page_w, page_h = viewport or (source_w, source_h)
+        # Device pixels per CSS pixel of the decoded image (HiDPI and draft scaling folded in).
+        device_x, device_y = img_w / page_w, img_h / page_h
+        decode_ms = image.info.get("decode_ms", 0.0)
+
+        crop = self._crop_box(nodes, page_w, page_h)
+        offset_x = offset_y = 0.0
+        if crop is not None:
+            offset_x, offset_y = crop[0], crop[1]
+            box = (round(crop[0] * device_x), round(crop[1] * device_y), round(crop[2] * device_x), round(crop[3] * device_y))
+            image = image.crop(box)
+        region_w, region_h = image.size
+        target = smart_resize(region_w, region_h, self.patch, self.min_pixels, self.max_pixels)
+        if target != image.size:
+            image = image.resize(target, Image.BILINEAR, reducing_gap=2.0)
+        transform = BBoxTransform(device_x * target[0] / region_w, device_y * target[1] / region_h, offset_x, offset_y)
+        stats = {
+            "source_size": [source_w, source_h],
+            "decoded_size": [img_w, img_h],
+            "model_size": list(target),
+            "cropped": crop is not None,
+            "vision_tokens": vision_tokens(*target, self.patch),
+            "source_vision_tokens": vision_tokens(source_w, source_h, self.patch),
+            "decode_ms": decode_ms,
+            "resize_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+        return PreparedImage(image, transform, stats)
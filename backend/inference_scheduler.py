@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class _PendingRequest:
+    __slots__ = ("item", "deadline", "future")
+
+    def __init__(self, item, deadline, future):
+        self.item = item
+        self.deadline = deadline
+        self.future = future
+
+
+class InferenceScheduler:
+    """Continuous micro-batching front for a blocking ``generate`` function.
+
+    Callers ``submit`` one input each; a single worker task drains the queue
+    into batches of at most ``max_batch_size`` inputs (waiting no longer than
+    ``max_wait_ms`` for a batch to fill) and runs ``generate_fn(batch)`` in a
+    worker thread so the event loop keeps serving other requests.
+    ``generate_fn`` must return one output per input, in order.
+    """
+
+    def __init__(self, generate_fn, max_batch_size=8, max_wait_ms=10, max_queue_size=64, default_timeout_s=30.0):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, max_wait_ms / 1000.0)
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.default_timeout_s = default_timeout_s
+        self.batches_run = 0
+        self.items_run = 0
+        self.expired = 0
+        self.rejected = 0
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    def _ensure_started(self):
+        # The worker is bound to the loop that first submits; rebinding keeps
+        # the scheduler usable from test clients that spin a loop per request.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = loop.create_task(self._run())
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item, timeout_s=None):
+        self._ensure_started()
+        timeout_s = self.default_timeout_s if timeout_s is None else timeout_s
+        future = self._loop.create_future()
+        pending = _PendingRequest(item, time.monotonic() + timeout_s, future)
+        try:
+            self._queue.put_nowait(pending)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_queue_size} pending).")
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout_s)
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError(f"Inference did not complete within {timeout_s:.1f}s.")
+
+    async def _collect_batch(self):
+        batch = [await self._queue.get()]
+        batch_deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = batch_deadline - time.monotonic()
+            if remaining <= 0:
+                # Take whatever is already queued without waiting further.
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            now = time.monotonic()
+            live = []
+            for pending in batch:
+                if pending.future.done():
+                    continue
+                if pending.deadline <= now:
+                    self.expired += 1
+                    pending.future.set_exception(DeadlineExceededError("Request expired while queued."))
+                    continue
+                live.append(pending)
+            if not live:
+                continue
+
+            try:
+                outputs = await asyncio.to_thread(self.generate_fn, [p.item for p in live])
+                if len(outputs) != len(live):
+                    raise RuntimeError(f"generate returned {len(outputs)} outputs for {len(live)} inputs.")
+            except Exception as e:
+                for pending in live:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            self.items_run += len(live)
+            for pending, output in zip(live, outputs):
+                if not pending.future.done():
+                    pending.future.set_result(output)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "avg_batch_size": round(self.items_run / self.batches_run, 2) if self.batches_run else 0.0,
+        }
@@ -1,48 +1,107 @@
 import os
 import sys
 import json
+import time
 import requests
-
-# Load Configuration
-def load_config():
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smartchrome_config.json")
-    if os.path.exists(config_path):
-        with open(config_path, "r") as f:
-            return json.load(f)
-    return {
-        "engine": "mock", "model_path": None, "training_dataset": "training_dataset.jsonl",
-        "models_dir": "models", "host": "127.0.0.1", "port": 8000
-    }
+import training_shards
+from config import load_config
 
 CONFIG = load_config()
 
+def count_training_examples(path):
+    if training_shards.is_sharded_dataset(path):
+        return training_shards.read_index(path)["records"]
+    if os.path.isfile(path):  # legacy JSONL; convert with `python training_shards.py convert`
+        with open(path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    return 0
+
+def iter_training_examples(path, epoch=0, seed=0):
+    """(training line, screenshot bytes) pairs: in a per-epoch shuffled order
+    for a sharded dataset, in file order for legacy JSONL."""
+    if not training_shards.is_sharded_dataset(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    example = json.loads(line)
+                    yield example, training_shards.inline_image(example)
+        return
+    with training_shards.ShardedDataset(path) as dataset:
+        yield from dataset.iterate(shuffle=True, seed=seed, epoch=epoch, with_images=True)
+
+def run_epochs(path, train_step, epochs=1, seed=0):
+    """Feed every example to train_step(example, image_bytes) once per epoch; returns the step count."""
+    steps = 0
+    for epoch in range(epochs):
+        for example, image in iter_training_examples(path, epoch=epoch, seed=seed):
+            train_step(example, image)
+            steps += 1
+    return steps
+
+def _train_epochs(train_step):
+    steps = run_epochs(CONFIG["training_dataset"], train_step,
+                       epochs=CONFIG.get("train_epochs", 1), seed=CONFIG.get("train_seed", 0))
+    print(f"Trained on {steps} examples.")
+
 def linux_cuda_fine_tune():
     print(f"Fine-tuning {CONFIG['model_path']} on CUDA...")
-    # SFT logic...
+    def sft_step(example, image):
+        pass  # SFT logic...
+    _train_epochs(sft_step)
     new_model_path = os.path.join(CONFIG["models_dir"], "SmartChrome-v2.gguf")
     print(f"Saved to {new_model_path}")
     trigger_reload(new_model_path)
 
 def mac_apple_silicon_fine_tune():
     print(f"Fine-tuning {CONFIG['model_path']} on MLX...")
-    # MLX logic...
+    def mlx_step(example, image):
+        pass  # MLX logic...
+    _train_epochs(mlx_step)
     new_model_path = os.path.join(CONFIG["models_dir"], "SmartChrome-v2-mlx.safetensors")
     print(f"Saved to {new_model_path}")
     trigger_reload(new_model_path)
 
-def trigger_reload(path):
+def trigger_reload(path, timeout_s=1800, poll_interval_s=5):
     url = f"http://{CONFIG['host']}:{CONFIG['port']}/vlm/reload"
     try:
-        requests.post(url, json={"new_model_path": path})
+        response = requests.post(url, json={"new_model_path": path})
+        response.raise_for_status()
         print("Reload triggered.")
     except Exception as e:
         print(f"Reload failed: {e}")
+        return None
+
+    # The server keeps serving the old model while the new one loads; poll until it settles.
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        time.sleep(poll_interval_s)
+        try:
+            status = requests.get(url).json()
+        except Exception as e:
+            print(f"Reload status unavailable: {e}")
+            continue
+        if status.get("state") == "succeeded":
+            print(f"Reload succeeded: now serving {status.get('model_path')} (v{status.get('active_version')}).")
+            return status
+        if status.get("state") == "failed":
+            print(f"Reload failed, previous model still active: {status.get('error')}")
+            return status
+        print(f"Reload {status.get('state')}...")
+    print("Timed out waiting for reload.")
+    return None
 
 if __name__ == "__main__":
-    if not os.path.exists(CONFIG["training_dataset"]):
+    legacy = training_shards.legacy_jsonl_path(CONFIG["training_dataset"])
+    if not CONFIG["training_dataset"].endswith(".jsonl") and os.path.isfile(legacy):
+        # teacher_worker converts it on start; until then its lines are not in training_dataset.
+        print(f"Warning: {legacy} has not been converted to the sharded dataset in {CONFIG['training_dataset']}. "
+              f"Start teacher_worker.py once, or run `python training_shards.py convert {legacy} {CONFIG['training_dataset']}`.")
+    examples = count_training_examples(CONFIG["training_dataset"])
+    if not examples:
         print("No training data.")
         sys.exit(0)
-        
+    print(f"{examples} training examples in {CONFIG['training_dataset']}.")
+
     if CONFIG["engine"] == "mlx":
         mac_apple_silicon_fine_tune()
     elif CONFIG["engine"] == "vllm":
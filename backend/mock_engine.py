@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from engine_manager import MockLLM
+from inference_scheduler import QueueFullError
+
+# The "sim" engine: a CPU stand-in for vllm.LLM for load-testing the browser
+# dispatcher and actuator against the real request path (decode, compaction,
+# scheduler batching, parsing, grounding) on a machine without a GPU.
+#
+# Configured by CONFIG["sim_engine"] (or `vlm_server.py --engine sim
+# --sim-profile profile.json`):
+#
+#   {"latency": {"dist": "lognormal", "median_ms": 350, "sigma": 0.5},
+#    "batch_capacity": 4, "per_item_ms": 10,
+#    "malformed_rate": 0.01, "error_rate": 0.0, "overload_rate": 0.0,
+#    "timeout_rate": 0.0, "timeout_s": 31,
+#    "script": [{"action": "click", "target_id": "3"}, ...],  or  "replay": ["traces/"],
+#    "debug_dump_rate": 0.01, "debug_dump_dir": "debug_dumps", "debug_dump_keep": 50,
+#    "seed": 1, "load_ms": 20000}
+#
+# generate() runs in the scheduler's worker thread, so the simulated latency
+# never blocks the event loop; like a real engine, a slow batch delays the
+# batches queued behind it. A batch larger than batch_capacity runs in
+# ceil(n / batch_capacity) rounds, each costing one latency sample plus
+# per_item_ms per item. Per batch, error_rate raises (the step falls back to
+# the default action), overload_rate raises QueueFullError (503) and
+# timeout_rate sleeps timeout_s (504 once it exceeds request_timeout_s).
+# Per item, malformed_rate returns text that fails to parse. Scripted or
+# replayed actions are returned in order, cycling; their boxes are in the
+# pixels of the image the model sees. load_ms stands in for the time a real
+# model takes to load, for exercising cold starts.
+
+DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+
+
+class SimulatedEngineError(RuntimeError):
+    pass
+
+
+class LatencyModel:
+    """Samples seconds from {"dist": ..., ...}. Parameters are in milliseconds;
+    an optional cap_ms bounds the long tail."""
+
+    def __init__(self, spec=None, rng=None):
+        spec = dict(spec or {})
+        self.dist = spec.pop("dist", "constant")
+        if self.dist not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {self.dist!r}; expected one of {DISTRIBUTIONS}.")
+        self.params = spec
+        self.rng = rng or random.Random()
+
+    def sample(self):
+        p = self.params
+        if self.dist == "constant":
+            ms = p.get("ms", 0.0)
+        elif self.dist == "uniform":
+            ms = self.rng.uniform(p.get("min_ms", 0.0), p.get("max_ms", 0.0))
+        elif self.dist == "exponential":
+            ms = self.rng.expovariate(1.0 / p["mean_ms"]) if p.get("mean_ms") else 0.0
+        else:
+            ms = self.rng.lognormvariate(math.log(p["median_ms"]), p.get("sigma", 0.5))
+        return max(0.0, min(ms, p.get("cap_ms", ms))) / 1000
+
+
+def replayed_actions(paths):
+    """Actions a server answered in flight-recorder traces, in order."""
+    from flight_recorder import read_steps
+    actions = []
+    for step in read_steps(paths):
+        response = step.get("response")
+        if step["route"] != "/vlm/objective" and step["status"] == 200 and isinstance(response, dict):
+            actions.append({k: v for k, v in response.items() if k != "skipped"})
+    return actions
+
+
+class SimulatedLLM(MockLLM):
+    def __init__(self, latency=None, batch_capacity=8, per_item_ms=0.0, malformed_rate=0.0, error_rate=0.0,
+                 overload_rate=0.0, timeout_rate=0.0, timeout_s=31.0, script=None, debug_dump_rate=0.0,
+                 debug_dump_dir="debug_dumps", debug_dump_keep=50, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        super().__init__()
+        self.batch_capacity = max(1, int(batch_capacity))
+        self.per_item_s = per_item_ms / 1000
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_s = timeout_s
+        self.script = [json.dumps(action) for action in script or ()]
+        self.debug_dump_rate = debug_dump_rate
+        self.debug_dump_dir = debug_dump_dir
+        self.debug_dump_keep = debug_dump_keep
+        self._lock = threading.Lock()
+        self._position = 0
+        self._dumps = 0
+        self.batches = 0
+        self.items = 0
+        self.injected = {"malformed": 0, "error": 0, "overload": 0, "timeout": 0}
+
+    @classmethod
+    def from_config(cls, spec):
+        spec = dict(spec or {})
+        load_s = spec.pop("load_ms", 0) / 1000
+        replay = spec.pop("replay", None)
+        if replay:
+            spec["script"] = replayed_actions([replay] if isinstance(replay, str) else replay)
+            if not spec["script"]:
+                raise ValueError(f"No replayable actions in {replay}.")
+        llm = cls(**spec)
+        if load_s:
+            time.sleep(load_s)
+        return llm
+
+    def _roll(self, rate):
+        return rate and self.rng.random() < rate
+
+    def _next_text(self):
+        if self._roll(self.malformed_rate):
+            self.injected["malformed"] += 1
+            return '{"action": "click", "target_bbox": [1, 2'
+        if not self.script:
+            return self.text
+        text = self.script[self._position % len(self.script)]
+        self._position += 1
+        return text
+
+    def _dump(self, item):
+        with self._lock:
+            self._dumps += 1
+            number = self._dumps
+        os.makedirs(self.debug_dump_dir, exist_ok=True)
+        base = os.path.join(self.debug_dump_dir, f"dump-{number:06d}")
+        image = (item.get("multi_modal_data") or {}).get("image")
+        if image is not None:
+            image.convert("RGB").save(base + ".jpg", quality=80)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(item.get("prompt", ""))
+        stale = os.path.join(self.debug_dump_dir, f"dump-{number - self.debug_dump_keep:06d}")
+        for ext in (".jpg", ".txt"):
+            if os.path.exists(stale + ext):
+                os.remove(stale + ext)
+
+    def generate(self, batch, sampling_params=None):
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            if self._roll(self.overload_rate):
+                self.injected["overload"] += 1
+                raise QueueFullError("Simulated engine overload.")
+            hang = self._roll(self.timeout_rate)
+            fail = not hang and self._roll(self.error_rate)
+            if hang:
+                self.injected["timeout"] += 1
+            if fail:
+                self.injected["error"] += 1
+            delay = self.timeout_s if hang else sum(
+                self.latency.sample() + self.per_item_s * len(batch[start:start + self.batch_capacity])
+                for start in range(0, len(batch), self.batch_capacity))
+            texts = [self._next_text() for _ in batch]
+            dumps = [item for item in batch if self._roll(self.debug_dump_rate)]
+        for item in dumps:
+            self._dump(item)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise SimulatedEngineError("Simulated engine failure.")
+        return [SimpleNamespace(outputs=[SimpleNamespace(text=text)]) for text in texts]
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items, "script_length": len(self.script),
+                "debug_dumps": self._dumps, "injected": dict(self.injected)}
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import re
+import time
+
+# Map-reduce summarisation for /osint/analyze. `complete(system_prompt, user_content)`
+# is a blocking chat-completion call; it is run in worker threads so chunk
+# summaries proceed concurrently without blocking the event loop.
+# It may return None (the OpenAI client does, e.g. on a content-filter stop);
+# that fails the job with EmptyCompletionError rather than leaving a hole in
+# the brief.
+
+_WORD_RE = re.compile(r"\w+")
+
+class EmptyCompletionError(RuntimeError):
+    pass
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting English scrape text.
+    return len(text) // 4 + 1
+
+def split_paragraphs(text):
+    return [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+def shingles(paragraph, k=5):
+    words = _WORD_RE.findall(paragraph.lower())
+    if len(words) <= k:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+def dedup_paragraphs(paragraphs, threshold=0.8):
+    """Drop exact and near-duplicate paragraphs (shingle Jaccard >= threshold).
+
+    Returns (kept_paragraphs, dropped_paragraphs), preserving first-seen order.
+    """
+    kept, dropped = [], []
+    seen_exact = set()
+    kept_shingles = []
+    index = {}  # shingle -> ids of kept paragraphs containing it
+    for paragraph in paragraphs:
+        normalized = " ".join(_WORD_RE.findall(paragraph.lower()))
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        if digest in seen_exact:
+            dropped.append(paragraph)
+            continue
+        paragraph_shingles = shingles(paragraph)
+        overlap = {}
+        for shingle in paragraph_shingles:
+            for pid in index.get(shingle, ()):
+                overlap[pid] = overlap.get(pid, 0) + 1
+        is_duplicate = False
+        for pid, shared in overlap.items():
+            union = len(paragraph_shingles) + len(kept_shingles[pid]) - shared
+            if union and shared / union >= threshold:
+                is_duplicate = True
+                break
+        if is_duplicate:
+            dropped.append(paragraph)
+            continue
+        seen_exact.add(digest)
+        pid = len(kept_shingles)
+        kept_shingles.append(paragraph_shingles)
+        for shingle in paragraph_shingles:
+            index.setdefault(shingle, []).append(pid)
+        kept.append(paragraph)
+    return kept, dropped
+
+def _split_oversized(paragraph, budget):
+    # Fall back to word-boundary splits for paragraphs larger than a chunk.
+    words = paragraph.split()
+    piece, pieces = [], []
+    size = 0
+    for word in words:
+        cost = estimate_tokens(word + " ")
+        if piece and size + cost > budget:
+            pieces.append(" ".join(piece))
+            piece, size = [], 0
+        piece.append(word)
+        size += cost
+    if piece:
+        pieces.append(" ".join(piece))
+    return pieces
+
+def pack_chunks(paragraphs, budget):
+    chunks, current = [], []
+    size = 0
+    for paragraph in paragraphs:
+        parts = _split_oversized(paragraph, budget) if estimate_tokens(paragraph) > budget else [paragraph]
+        for part in parts:
+            cost = estimate_tokens(part)
+            if current and size + cost > budget:
+                chunks.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(part)
+            size += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+class OSINTMapReduce:
+    def __init__(self, complete, chunk_tokens=3000, merge_tokens=3000, concurrency=4, dedup_threshold=0.8):
+        self.complete = complete
+        self.chunk_tokens = chunk_tokens
+        self.merge_tokens = merge_tokens
+        self.concurrency = concurrency
+        self.dedup_threshold = dedup_threshold
+
+    def _prepare(self, raw_data):
+        paragraphs = split_paragraphs(raw_data)
+        kept, dropped = dedup_paragraphs(paragraphs, self.dedup_threshold)
+        return paragraphs, kept, dropped, pack_chunks(kept, self.chunk_tokens)
+
+    def _system_prompt(self, objective):
+        return f"You are an expert OSINT Analyst. Your objective is: {objective}."
+
+    def _final_prompt(self, raw_data):
+        return f"Here is raw, unstructured data scraped by an autonomous agent:\n{raw_data}\n\nDeduplicate this information, extract the core insights, and generate a professional, well-structured Markdown brief."
+
+    def _map_prompt(self, index, total, chunk):
+        return f"Here is part {index + 1} of {total} of raw data scraped by an autonomous agent:\n{chunk}\n\nExtract every insight relevant to the objective as concise Markdown bullet points. Keep names, numbers, dates and sources."
+
+    def _merge_prompt(self, partials, final):
+        joined = "\n\n---\n\n".join(partials)
+        if final:
+            return f"Here are partial briefs produced from different parts of a scraped dataset:\n{joined}\n\nMerge them, remove repetition, and generate a professional, well-structured Markdown brief."
+        return f"Here are partial briefs produced from different parts of a scraped dataset:\n{joined}\n\nMerge them into one set of concise Markdown bullet points without losing distinct facts."
+
+    async def _call_all(self, system_prompt, prompts, stats):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def call(prompt):
+            async with semaphore:
+                stats["llm_calls"] += 1
+                result = await asyncio.to_thread(self.complete, system_prompt, prompt)
+                if result is None:
+                    raise EmptyCompletionError("The model returned no content (for example, a content-filter stop).")
+                return result.strip()
+
+        return await asyncio.gather(*[call(p) for p in prompts])
+
+    async def run(self, objective, raw_data, on_progress=None):
+        """Returns (markdown_brief, stats)."""
+        stats = {"llm_calls": 0, "reduce_levels": 0, "timings_ms": {}}
+        started = time.perf_counter()
+        system_prompt = self._system_prompt(objective)
+
+        stage = time.perf_counter()
+        paragraphs, kept, dropped, chunks = await asyncio.to_thread(self._prepare, raw_data)
+        stats.update({
+            "paragraphs": len(paragraphs),
+            "duplicate_paragraphs": len(dropped),
+            "tokens_in": estimate_tokens(raw_data),
+            "tokens_saved_by_dedup": sum(estimate_tokens(p) for p in dropped),
+            "chunks": len(chunks),
+        })
+        stats["timings_ms"]["dedup"] = round((time.perf_counter() - stage) * 1000, 2)
+        if on_progress:
+            on_progress("dedup", stats, None)
+
+        if len(chunks) <= 1:
+            stage = time.perf_counter()
+            [brief] = await self._call_all(system_prompt, [self._final_prompt("\n\n".join(kept))], stats)
+            stats["timings_ms"]["reduce"] = round((time.perf_counter() - stage) * 1000, 2)
+            stats["timings_ms"]["total"] = round((time.perf_counter() - started) * 1000, 2)
+            return brief, stats
+
+        stage = time.perf_counter()
+        partials = await self._call_all(system_prompt, [self._map_prompt(i, len(chunks), c) for i, c in enumerate(chunks)], stats)
+        stats["timings_ms"]["map"] = round((time.perf_counter() - stage) * 1000, 2)
+        if on_progress:
+            on_progress("map", stats, "\n\n".join(partials))
+
+        stage = time.perf_counter()
+        while True:
+            groups = self._group(partials)
+            final = len(groups) == 1
+            partials = await self._call_all(system_prompt, [self._merge_prompt(g, final) for g in groups], stats)
+            stats["reduce_levels"] += 1
+            if final:
+                break
+            if on_progress:
+                on_progress("reduce", stats, "\n\n".join(partials))
+        stats["timings_ms"]["reduce"] = round((time.perf_counter() - stage) * 1000, 2)
+        stats["timings_ms"]["total"] = round((time.perf_counter() - started) * 1000, 2)
+        return partials[0], stats
+
+    def _group(self, partials):
+        groups, current = [], []
+        size = 0
+        for partial in partials:
+            cost = estimate_tokens(partial)
+            if current and size + cost > self.merge_tokens:
+                groups.append(current)
+                current, size = [], 0
+            current.append(partial)
+            size += cost
+        groups.append(current)
+        # Always make progress: never emit one group per partial past the first level.
+        if len(groups) == len(partials) and len(partials) > 1:
+            groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+        return groups
@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+TERMINAL_STATES = ("succeeded", "failed")
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class OSINTJob:
+    def __init__(self, objective, raw_data):
+        self.id = uuid.uuid4().hex
+        self.objective = objective
+        self.raw_data = raw_data
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.report_path = None
+        self.stats = None
+        self.error = None
+        self.partial_markdown = ""
+        self.events = []
+        self._seq = itertools.count(1)
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATES
+
+    def emit(self, event, data):
+        self.events.append((next(self._seq), event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "objective": self.objective,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "report_path": self.report_path,
+            "stats": self.stats,
+            "error": self.error,
+        }
+
+    async def stream(self, after_seq=0):
+        """Yield (seq, event, data) from after_seq until the job finishes."""
+        while True:
+            changed = self._changed
+            for seq, event, data in self.events:
+                if seq > after_seq:
+                    after_seq = seq
+                    yield seq, event, data
+            if self.done:
+                return
+            await changed.wait()
+
+
+def format_sse(seq, event, data):
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class OSINTJobManager:
+    """Runs OSINT analyses as background jobs on a bounded pool of worker tasks.
+
+    `run_job(job)` is an async callable that does the work, reports progress
+    through `job.emit(...)` and returns (report_path, stats).
+    """
+
+    def __init__(self, run_job, workers=2, max_pending=32, max_retained=100):
+        self.run_job = run_job
+        self.workers = max(1, int(workers))
+        self.max_pending = max_pending
+        self.max_retained = max_retained
+        self.jobs = OrderedDict()
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, objective, raw_data):
+        self._ensure_started()
+        job = OSINTJob(objective, raw_data)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError(f"OSINT job queue is full ({self.max_pending} pending).")
+        self.jobs[job.id] = job
+        self._evict()
+        job.emit("status", {"status": job.status})
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_retained)]:
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.emit("status", {"status": job.status})
+            try:
+                job.report_path, job.stats = await self.run_job(job)
+                job.status = "succeeded"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            job.finished = time.time()
+            job.raw_data = None
+            job.emit("status", job.summary())
@@ -0,0 +1,173 @@
+import base64
+import binascii
+import hashlib
+import queue
+import socket
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+# RLHF tuple storage. Screenshots live once in `frames`, keyed by the SHA-256
+# of the image bytes; `tuples.image_hash` references them. `tuples.image_base64`
+# is only populated by databases that predate the blob store and is cleared
+# by migrate_inline_images().
+
+def connect(db_path, timeout=30.0):
+    conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def init_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tuples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            image_base64 TEXT,
+            a11y_tree TEXT,
+            bad_action TEXT,
+            good_action TEXT,
+            processed INTEGER DEFAULT 0,
+            image_hash TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS frames (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        )
+    """)
+    for column in ("processed INTEGER DEFAULT 0", "image_hash TEXT"):
+        try:
+            cursor.execute(f"ALTER TABLE tuples ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass
+    # Serves the teacher's `processed = 0 AND id > ? ORDER BY id` scans.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tuples_processed ON tuples (processed, id)")
+    conn.commit()
+
+def frame_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def store_frame(cursor, image_bytes):
+    digest = frame_hash(image_bytes)
+    cursor.execute("INSERT OR IGNORE INTO frames (hash, data) VALUES (?, ?)", (digest, image_bytes))
+    return digest
+
+def load_frame(conn, digest):
+    row = conn.execute("SELECT data FROM frames WHERE hash = ?", (digest,)).fetchone()
+    return bytes(row[0]) if row else None
+
+def load_tuple_image(conn, image_hash, image_base64=None):
+    """Image bytes for a tuple row, from the blob store or a legacy inline column."""
+    if image_hash:
+        return load_frame(conn, image_hash)
+    if image_base64:
+        return base64.b64decode(image_base64)
+    return None
+
+def migrate_inline_images(conn, batch_size=200):
+    """Move inline base64 screenshots into the frames table. Returns rows converted."""
+    converted = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, image_base64 FROM tuples WHERE id > ? AND image_hash IS NULL AND image_base64 IS NOT NULL ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        cursor = conn.cursor()
+        for row_id, image_base64 in rows:
+            last_id = row_id
+            try:
+                image_bytes = base64.b64decode(image_base64, validate=True)
+            except (binascii.Error, ValueError):
+                print(f"Skipping tuple {row_id}: image_base64 is not valid base64.")
+                continue
+            digest = store_frame(cursor, image_bytes)
+            cursor.execute("UPDATE tuples SET image_hash = ?, image_base64 = NULL WHERE id = ?", (digest, row_id))
+            converted += 1
+        conn.commit()
+    return converted
+
+# Wakeup channel to teacher_worker: a best-effort UDP datagram on localhost.
+# A lost datagram only delays work until the worker's next fallback check.
+_notify_socket = None
+
+def notify_teacher(port, host="127.0.0.1"):
+    global _notify_socket
+    try:
+        if _notify_socket is None:
+            _notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _notify_socket.setblocking(False)
+        _notify_socket.sendto(b"tuples", (host, port))
+    except OSError:
+        pass
+
+class RLHFWriter:
+    """Single long-lived WAL connection that group-commits tuple inserts.
+
+    submit() is thread-safe and returns a Future resolved with the new row id
+    once the transaction containing it has committed.
+    """
+
+    def __init__(self, db_path, max_batch=64):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._conn = connect(db_path)
+        init_schema(self._conn)
+        self._thread = threading.Thread(target=self._run, name="rlhf-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, timestamp, image_bytes, a11y_tree, bad_action, good_action):
+        future = Future()
+        self._queue.put(((timestamp, image_bytes, a11y_tree, bad_action, good_action), future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._conn.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        row_ids = []
+        try:
+            cursor = self._conn.cursor()
+            for (timestamp, image_bytes, a11y_tree, bad_action, good_action), _ in batch:
+                digest = store_frame(cursor, image_bytes)
+                cursor.execute("""
+                    INSERT INTO tuples (timestamp, image_hash, a11y_tree, bad_action, good_action)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (timestamp, digest, a11y_tree, bad_action, good_action))
+                row_ids.append(cursor.lastrowid)
+            self._conn.commit()
+        except Exception as e:
+            self._conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), row_id in zip(batch, row_ids):
+            future.set_result(row_id)
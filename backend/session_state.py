@@ -0,0 +1,348 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from a11y_compactor import short_id, node_role
+from tile_codec import apply_tile_delta
+
+# Per-tab state for the action loop. Each browser tab (session) owns its
+# objective, reasoning log and the last acknowledged a11y tree, so clients
+# can send tree deltas instead of the full tree on every step.
+#
+# Delta format (applied to the flat node map of `base_version`):
+#   {"upsert": [{"id": 7, "role": "link", "name": "...", "bbox": [...], "child_ids": [...]}, ...],
+#    "remove": [3, 4],
+#    "root_ids": [1]}          # optional, only when the roots change
+#
+# Screenshots work the same way: the last frame is kept per session and
+# SCT1 tile deltas (see tile_codec.py) are pasted into it in place.
+#
+# The reasoning log is a stream of sequenced events in a fixed-capacity ring
+# (EventLog) that the Commander follows over SSE; /vlm/status shows its tail.
+
+DEFAULT_SESSION = "default"
+REASONING_LOG_TAIL = 10
+
+
+class TreeVersionMismatch(Exception):
+    kind = "tree"
+
+    def __init__(self, session_id, server_version, base_version):
+        super().__init__(f"Session {session_id} is at {self.kind} version {server_version}, delta is against {base_version}.")
+        self.server_version = server_version
+        self.base_version = base_version
+
+
+class FrameVersionMismatch(TreeVersionMismatch):
+    kind = "frame"
+
+
+class DeltaFormatError(ValueError):
+    pass
+
+
+def _is_node_id(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def validate_delta(delta):
+    """Raise DeltaFormatError unless `delta` has the shape documented above."""
+    if not isinstance(delta, dict):
+        raise DeltaFormatError("a11y delta must be a JSON object.")
+    for key in ("remove", "root_ids"):
+        ids = delta.get(key, [])
+        if not isinstance(ids, list) or not all(_is_node_id(node_id) for node_id in ids):
+            raise DeltaFormatError(f"a11y delta {key!r} must be a list of node ids.")
+    upsert = delta.get("upsert", [])
+    if not isinstance(upsert, list) or not all(isinstance(node, dict) and _is_node_id(node.get("id")) for node in upsert):
+        raise DeltaFormatError("a11y delta 'upsert' must be a list of nodes with an 'id'.")
+
+
+def flatten_tree(tree):
+    """Convert any accepted a11y tree shape into ({id: node}, root_ids)."""
+    nodes = OrderedDict()
+    roots = []
+    if isinstance(tree, dict) and isinstance(tree.get("nodes"), list):
+        child_ids = {c for n in tree["nodes"] if isinstance(n, dict) for c in n.get("child_ids", ())}
+        for node in tree["nodes"]:
+            if isinstance(node, dict):
+                nodes[node.get("id")] = node
+                if node.get("id") not in child_ids:
+                    roots.append(node.get("id"))
+        return nodes, roots
+
+    synthetic = 0
+    top = tree if isinstance(tree, list) else [tree]
+    stack = [(n, None) for n in reversed(top) if isinstance(n, dict)]
+    while stack:
+        node, parent_id = stack.pop()
+        node_id = node.get("id")
+        if node_id is None or node_id in nodes:
+            synthetic += 1
+            node_id = f"_{synthetic}"
+        flat = {k: v for k, v in node.items() if k != "children"}
+        flat["id"] = node_id
+        flat["child_ids"] = []
+        nodes[node_id] = flat
+        if parent_id is None:
+            roots.append(node_id)
+        else:
+            nodes[parent_id]["child_ids"].append(node_id)
+        for child in reversed(node.get("children") or ()):
+            if isinstance(child, dict):
+                stack.append((child, node_id))
+    return nodes, roots
+
+
+def _signature(node):
+    return (node.get("role"), node.get("name"), json.dumps(node.get("bbox")))
+
+
+def diff_nodes(old, new):
+    """(added, removed, changed) node lists between two flat node maps."""
+    added = [n for i, n in new.items() if i not in old]
+    removed = [n for i, n in old.items() if i not in new]
+    changed = [n for i, n in new.items() if i in old and _signature(old[i]) != _signature(n)]
+    return added, removed, changed
+
+
+class EventLog:
+    """Sequenced events in a ring of `capacity`. A subscriber resumes after
+    the last seq it saw; if the ring has already dropped some of the events
+    after it, the stream starts with a "gap" event saying how many."""
+
+    def __init__(self, capacity=256):
+        self.events = deque(maxlen=capacity)
+        self.seq = 0
+        self._changed = asyncio.Event()
+
+    def emit(self, event, data):
+        self.seq += 1
+        self.events.append((self.seq, event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return self.seq
+
+    def since(self, after_seq):
+        """(missed, events) with seq > after_seq; missed were already overwritten."""
+        if after_seq > self.seq:
+            after_seq = 0  # a seq from before a server restart
+        pending = self.seq - after_seq
+        missed = max(0, pending - len(self.events))
+        return missed, list(itertools.islice(self.events, len(self.events) - (pending - missed), None))
+
+    def tail(self, n):
+        return list(itertools.islice(self.events, max(0, len(self.events) - n), None))
+
+    async def stream(self, after_seq=0, follow=True, keepalive_s=15.0):
+        """Yield (seq, event, data) after after_seq; without follow, stop once
+        caught up. While idle, (None, "keepalive", None) every keepalive_s."""
+        while True:
+            changed = self._changed
+            missed, events = self.since(after_seq)
+            if missed:
+                yield events[0][0] - 1, "gap", {"missed": missed}
+            for seq, event, data in events:
+                after_seq = seq
+                yield seq, event, data
+            if not follow:
+                return
+            if not events:
+                try:
+                    await asyncio.wait_for(changed.wait(), keepalive_s)
+                except asyncio.TimeoutError:
+                    yield None, "keepalive", None
+
+
+class Session:
+    def __init__(self, session_id, objective, event_capacity=256):
+        self.id = session_id
+        self.objective = objective
+        self.events = EventLog(event_capacity)
+        self.tree_version = 0
+        self.nodes = OrderedDict()
+        self.root_ids = []
+        self.changes = ([], [], [])
+        self.steps = 0
+        self.delta_steps = 0
+        self.resyncs = 0
+        self.bytes_received = 0
+        self.bytes_full_equivalent = 0
+        self.frame = None
+        self.frame_version = 0
+        self.frame_changed_fraction = 1.0
+        self.frames_full = 0
+        self.frames_delta = 0
+        self.frames_skipped = 0
+        self.full_frame_bytes = 0
+        self.image_bytes_received = 0
+        self.image_bytes_full_equivalent = 0
+        self.last_action = None
+        self.fast_path_hits = {}
+        self.last_seen = time.time()
+
+    def log(self, message, event="reasoning"):
+        return self.events.emit(event, {"ts": time.time(), "message": message})
+
+    @property
+    def reasoning_log(self):
+        return [f"[{datetime.fromtimestamp(data['ts']).strftime('%H:%M:%S')}] {data['message']}"
+                for _, _, data in self.events.tail(REASONING_LOG_TAIL)]
+
+    def tree_json(self):
+        return json.dumps({"nodes": list(self.nodes.values())})
+
+    def apply_full_tree(self, a11y_tree, version=None):
+        self.steps += 1
+        try:
+            nodes, roots = flatten_tree(json.loads(a11y_tree))
+        except (TypeError, ValueError):
+            # Not JSON: nothing to diff, pass the text through untouched.
+            nodes, roots = OrderedDict(), []
+        self.changes = diff_nodes(self.nodes, nodes) if self.nodes else ([], [], [])
+        self.nodes, self.root_ids = nodes, roots
+        self.tree_version = version if version is not None else self.tree_version + 1
+        size = len(a11y_tree.encode("utf-8"))
+        self.bytes_received += size
+        self.bytes_full_equivalent += size
+        return a11y_tree
+
+    def apply_delta(self, delta, base_version, version=None, delta_bytes=0):
+        # Checked up front: a delta that fails halfway would leave the tree
+        # half-applied at the old version.
+        validate_delta(delta)
+        if base_version != self.tree_version or not self.nodes:
+            self.resyncs += 1
+            raise TreeVersionMismatch(self.id, self.tree_version, base_version)
+        self.steps += 1
+        self.delta_steps += 1
+        added, removed, changed = [], [], []
+        for node_id in delta.get("remove", ()):
+            node = self.nodes.pop(node_id, None)
+            if node is not None:
+                removed.append(node)
+        for node in delta.get("upsert", ()):
+            node_id = node.get("id")
+            previous = self.nodes.get(node_id)
+            if previous is None:
+                added.append(node)
+            elif _signature(previous) != _signature(node):
+                changed.append(node)
+            self.nodes[node_id] = node
+        if "root_ids" in delta:
+            self.root_ids = list(delta["root_ids"])
+        self.changes = (added, removed, changed)
+        self.tree_version = version if version is not None else self.tree_version + 1
+        tree_json = self.tree_json()
+        self.bytes_received += delta_bytes
+        self.bytes_full_equivalent += len(tree_json.encode("utf-8"))
+        return tree_json
+
+    def set_frame(self, image, encoded_bytes):
+        self.frame = image
+        self.frame_version += 1
+        self.frame_changed_fraction = 1.0
+        self.frames_full += 1
+        self.full_frame_bytes = encoded_bytes
+        self.image_bytes_received += encoded_bytes
+        self.image_bytes_full_equivalent += encoded_bytes
+
+    def apply_frame_delta(self, delta, encoded_bytes):
+        if self.frame is None or delta.base_version != self.frame_version:
+            self.resyncs += 1
+            raise FrameVersionMismatch(self.id, self.frame_version, delta.base_version)
+        apply_tile_delta(self.frame, delta)
+        self.frame_version += 1
+        self.frame_changed_fraction = delta.changed_fraction()
+        self.frames_delta += 1
+        self.image_bytes_received += encoded_bytes
+        # Deltas are billed against the size of the last full frame the client sent.
+        self.image_bytes_full_equivalent += max(self.full_frame_bytes, encoded_bytes)
+        return self.frame
+
+    def tree_changed(self):
+        return any(self.changes)
+
+    def describe_changes(self, limit=15):
+        added, removed, changed = self.changes
+        if not (added or removed or changed):
+            return ""
+        lines = [f"Changes since previous step: +{len(added)} added, -{len(removed)} removed, ~{len(changed)} changed"]
+        for prefix, nodes in (("+", added), ("~", changed), ("-", removed)):
+            for node in nodes:
+                if len(lines) > limit:
+                    break
+                name = " ".join(str(node.get("name") or "").split())[:60]
+                lines.append(f"{prefix} [{short_id(node.get('id'), 0)}] {node_role(node)}" + (f' "{name}"' if name else ""))
+        return "\n".join(lines)
+
+    def stats(self):
+        saved = self.bytes_full_equivalent - self.bytes_received
+        return {
+            "session_id": self.id,
+            "objective": self.objective,
+            "tree_version": self.tree_version,
+            "nodes": len(self.nodes),
+            "steps": self.steps,
+            "delta_steps": self.delta_steps,
+            "resyncs": self.resyncs,
+            "bytes_received": self.bytes_received,
+            "bytes_saved": saved,
+            "bytes_saved_per_step": round(saved / self.steps, 1) if self.steps else 0.0,
+            "frame_version": self.frame_version,
+            "frames_full": self.frames_full,
+            "frames_delta": self.frames_delta,
+            "frames_skipped": self.frames_skipped,
+            "image_bytes_received": self.image_bytes_received,
+            "image_bytes_saved": self.image_bytes_full_equivalent - self.image_bytes_received,
+        }
+
+
+class SessionStore:
+    def __init__(self, default_objective, max_sessions=256, idle_ttl_s=3600, event_capacity=256):
+        self.default_objective = default_objective
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self.event_capacity = event_capacity
+        self._sessions = OrderedDict()
+        self.default = self.get(DEFAULT_SESSION)
+
+    def get(self, session_id=None):
+        session_id = session_id or DEFAULT_SESSION
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = Session(session_id, self.default_objective, self.event_capacity)
+            self._sessions[session_id] = session
+            self._evict()
+        self._sessions.move_to_end(session_id)
+        session.last_seen = time.time()
+        return session
+
+    def find(self, session_id):
+        return self._sessions.get(session_id or DEFAULT_SESSION)
+
+    def all(self):
+        return list(self._sessions.values())
+
+    def _evict(self):
+        cutoff = time.time() - self.idle_ttl_s
+        for session_id in list(self._sessions):
+            if session_id == DEFAULT_SESSION:
+                continue
+            if len(self._sessions) > self.max_sessions or self._sessions[session_id].last_seen < cutoff:
+                del self._sessions[session_id]
+
+    def set_objective(self, objective, session_id=None):
+        """Set one tab's objective, or with no session_id the global mission,
+        which every session still following the previous mission adopts."""
+        if session_id:
+            self.get(session_id).objective = objective
+            return
+        previous = self.default_objective
+        self.default_objective = objective
+        for session in self._sessions.values():
+            if session.objective == previous:
+                session.objective = objective
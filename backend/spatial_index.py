@@ -0,0 +1,84 @@
+import math
+from array import array
+
+# Uniform grid over node boxes (page coordinates) for grounding model-predicted
+# bboxes. Each cell lists the nodes overlapping it; nodes spanning more than
+# max_cells_per_node cells (page-sized containers) go to a short list that is
+# always checked, so one huge node does not fill the whole grid.
+
+
+class SpatialGrid:
+    def __init__(self, index, roles, cell_size=64, max_cells_per_node=256):
+        self.index = index
+        self.cell_size = cell_size
+        self.cells = {}
+        self.oversized = array("i")
+        self.count = 0
+        boxes = index.boxes
+        orders = sorted(i for r in roles for i in index.by_role.get(r, ()))
+        for order in orders:
+            x, y, w, h = boxes[order * 4:order * 4 + 4]
+            if not (w > 0 and h > 0):  # also false for NaN
+                continue
+            self.count += 1
+            c0, r0 = int(x // cell_size), int(y // cell_size)
+            c1, r1 = int((x + w) // cell_size), int((y + h) // cell_size)
+            if (c1 - c0 + 1) * (r1 - r0 + 1) > max_cells_per_node:
+                self.oversized.append(order)
+                continue
+            for row in range(r0, r1 + 1):
+                for col in range(c0, c1 + 1):
+                    cell = self.cells.get((col, row))
+                    if cell is None:
+                        cell = self.cells[(col, row)] = array("i")
+                    cell.append(order)
+
+    def _distance(self, order, px, py):
+        boxes = self.index.boxes
+        x, y, w, h = boxes[order * 4:order * 4 + 4]
+        dx = max(x - px, 0.0, px - (x + w))
+        dy = max(y - py, 0.0, py - (y + h))
+        return math.hypot(dx, dy), w * h
+
+    def nearest(self, px, py, max_distance=48.0):
+        """(order, distance) of the closest node to the point, preferring the
+        smallest box among those containing it; None beyond max_distance."""
+        best = None
+        for order in self.oversized:
+            best = self._better(best, order, px, py)
+        size = self.cell_size
+        col, row = int(px // size), int(py // size)
+        rings = int(math.ceil(max_distance / size))
+        for ring in range(rings + 1):
+            # Anything in ring k is at least (k - 1) * size away.
+            if best is not None and best[1] < (ring - 1) * size:
+                break
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    for order in self.cells.get((c, r), ()):
+                        best = self._better(best, order, px, py)
+        if best is None or best[1] > max_distance:
+            return None
+        return best[0], best[1]
+
+    def _better(self, best, order, px, py):
+        distance, area = self._distance(order, px, py)
+        if best is None or (distance, area) < (best[1], best[2]):
+            return order, distance, area
+        return best
+
+
+def ground_bbox(index, bbox, roles, max_distance=48.0, cell_size=64):
+    """Snap a predicted [x, y, w, h] to the actionable node under or nearest its centre.
+
+    Returns (node_order, snapped_bbox, status) with status "inside", "snapped"
+    or "ungrounded" (node_order and bbox None).
+    """
+    x, y, w, h = bbox
+    hit = index.spatial(roles, cell_size).nearest(x + w / 2, y + h / 2, max_distance)
+    if hit is None:
+        return None, None, "ungrounded"
+    order, distance = hit
+    return order, [round(v) for v in index.bbox(order)], "inside" if distance == 0 else "snapped"
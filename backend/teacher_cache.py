@@ -0,0 +1,148 @@
+import hashlib
+import heapq
+import io
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+from action_cache import image_dhash
+from osint_engine import shingles
+
+# Two ways of not asking the teacher the same question twice.
+#
+# TeacherCache is a persistent prompt -> completion store keyed by a hash of
+# (model, system prompt, prompt). teacher_worker and /osint/analyze share one
+# SQLite file in WAL mode, so a scrape summarised last week or a mentor prompt
+# replayed after a crash costs nothing.
+#
+# TupleClusterer groups near-duplicate RLHF tuples before the teacher sees
+# them: humans tend to correct the same mistake on the same page many times.
+# Tuples share a cluster when their (bad_action, good_action) pair is equal,
+# their screenshot dHashes are within max_hamming bits and the bottom-k
+# sketches of their a11y-tree shingles estimate a Jaccard similarity of at
+# least tree_threshold. Only each cluster's first tuple goes to the teacher.
+
+def prompt_key(model, system_prompt, prompt):
+    h = hashlib.sha256()
+    for part in (model, system_prompt or "", prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+class TeacherCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, model TEXT NOT NULL, completion TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, completion):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO completions (key, model, completion, created_at) VALUES (?, ?, ?, ?)",
+                               (key, model, completion, time.time()))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def tree_sketch(a11y_tree, k=128):
+    """The k smallest shingle hashes of an a11y tree (a bottom-k MinHash sketch)."""
+    return frozenset(heapq.nsmallest(k, {hash(s) for s in shingles(a11y_tree or "")}))
+
+def sketch_similarity(a, b, k=128):
+    """Estimated Jaccard similarity of the shingle sets behind two sketches."""
+    union = heapq.nsmallest(k, a | b)
+    if not union:
+        return 1.0
+    return sum(1 for h in union if h in a and h in b) / len(union)
+
+def screenshot_dhash(image_bytes):
+    """dHash of a screenshot as an int, or None when it cannot be decoded."""
+    if not image_bytes:
+        return None
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("L", (64, 64))
+        return int(image_dhash(image), 16)
+    except Exception:
+        return None
+
+class TupleCluster:
+    def __init__(self, cluster_id, representative_id):
+        self.cluster_id = cluster_id
+        self.representative_id = representative_id
+        self.llm_cot = None
+        self.failed = False
+        self.waiting = []  # rows that arrived before the representative was answered
+
+class TupleClusterer:
+    def __init__(self, tree_threshold=0.9, max_hamming=4, sketch_size=128, max_clusters=4096):
+        self.tree_threshold = tree_threshold
+        self.max_hamming = max_hamming
+        self.sketch_size = sketch_size
+        self.max_clusters = max_clusters
+        self._buckets = {}  # (bad_action, good_action) -> [(cluster, dhash, image_key, sketch)]
+        self._order = OrderedDict()  # cluster_id -> bucket key, oldest first
+        self._dhashes = {}  # image_key -> dhash, frames repeat a lot
+        self.clusters = 0
+        self.duplicates = 0
+
+    def _image_matches(self, dhash, image_key, other_dhash, other_key):
+        if dhash is not None and other_dhash is not None:
+            return bin(dhash ^ other_dhash).count("1") <= self.max_hamming
+        return image_key == other_key
+
+    def assign(self, row_id, a11y_tree, bad_action, good_action, image_key, load_image):
+        """Returns (cluster, is_new). `image_key` identifies the screenshot
+        (its frame hash); `load_image()` is only called the first time a key is seen."""
+        if image_key not in self._dhashes:
+            self._dhashes[image_key] = screenshot_dhash(load_image())
+        dhash = self._dhashes[image_key]
+        sketch = tree_sketch(a11y_tree, self.sketch_size)
+        bucket_key = (bad_action, good_action)
+        bucket = self._buckets.setdefault(bucket_key, [])
+        for cluster, other_dhash, other_key, other_sketch in bucket:
+            if (self._image_matches(dhash, image_key, other_dhash, other_key)
+                    and sketch_similarity(sketch, other_sketch, self.sketch_size) >= self.tree_threshold):
+                self.duplicates += 1
+                return cluster, False
+        cluster = TupleCluster(self.clusters, row_id)
+        self.clusters += 1
+        bucket.append((cluster, dhash, image_key, sketch))
+        self._order[cluster.cluster_id] = bucket_key
+        while len(self._order) > self.max_clusters:
+            old_id, old_key = self._order.popitem(last=False)
+            old_bucket = self._buckets[old_key]
+            old_bucket[:] = [entry for entry in old_bucket if entry[0].cluster_id != old_id]
+            if not old_bucket:
+                del self._buckets[old_key]
+        return cluster, True
@@ -1,19 +1,15 @@
 import os
 import time
 import json
-import sqlite3
-from openai import OpenAI
-
-# Load Configuration
-def load_config():
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smartchrome_config.json")
-    if os.path.exists(config_path):
-        with open(config_path, "r") as f:
-            return json.load(f)
-    return {
-        "db_path": "rlhf_tuples.db", "training_dataset": "training_dataset.jsonl",
-        "host": "127.0.0.1", "port": 8000
-    }
+import base64
+import random
+import asyncio
+from openai import AsyncOpenAI
+import rlhf_store
+import training_shards
+from metrics import REGISTRY, start_http_server
+from teacher_cache import TeacherCache, TupleClusterer, prompt_key
+from config import load_config
 
 CONFIG = load_config()
 
@@ -22,50 +18,447 @@ TEACHER_API_KEY = os.environ.get("TEACHER_API_KEY", "EMPTY")
 TEACHER_BASE_URL = os.environ.get("TEACHER_BASE_URL", "http://localhost:11434/v1")
 TEACHER_MODEL = os.environ.get("TEACHER_MODEL", "qwen2.5:32b")
 
-client = OpenAI(api_key=TEACHER_API_KEY, base_url=TEACHER_BASE_URL)
+TEACHER_CONCURRENCY = CONFIG.get("teacher_concurrency", 8)
+TEACHER_RPS = CONFIG.get("teacher_rps", 10.0)
+TEACHER_MAX_RETRIES = CONFIG.get("teacher_max_retries", 5)
+TEACHER_BATCH_SIZE = CONFIG.get("teacher_batch_size", 32)
+TEACHER_CACHE_PATH = CONFIG.get("teacher_cache_path", "teacher_cache.db")
+CLUSTER_TREE_THRESHOLD = CONFIG.get("teacher_cluster_tree_threshold", 0.9)
+CLUSTER_MAX_HAMMING = CONFIG.get("teacher_cluster_max_hamming", 4)
+
+# Retries are handled by call_teacher so they share the rate limiter.
+client = AsyncOpenAI(api_key=TEACHER_API_KEY, base_url=TEACHER_BASE_URL, max_retries=0)
+
+# Served on http://127.0.0.1:<teacher_metrics_port>/metrics (see metrics.py).
+teacher_call_seconds = REGISTRY.histogram(
+    "smartchrome_teacher_call_seconds", "Teacher completion latency per attempt.", ("outcome",))
+teacher_rate_wait_seconds = REGISTRY.histogram(
+    "smartchrome_teacher_rate_wait_seconds", "Time spent waiting for the teacher rate limiter.")
+teacher_tuples = REGISTRY.counter(
+    "smartchrome_teacher_tuples_total", "RLHF tuples handled by the teacher worker.", ("outcome",))
+teacher_calls_avoided = REGISTRY.counter(
+    "smartchrome_teacher_calls_avoided_total", "Tuples answered without a teacher call.", ("reason",))
+teacher_write_seconds = REGISTRY.histogram(
+    "smartchrome_teacher_write_seconds", "Time to append and commit one batch of training lines.")
+teacher_pass_seconds = REGISTRY.histogram(
+    "smartchrome_teacher_pass_seconds", "Duration of a full pass over unprocessed tuples.")
+
+class EmptyCompletionError(RuntimeError):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def build_mentor_prompt(a11y_tree, bad_action, good_action):
+    return f"Accessibility Tree: {a11y_tree}\nAgent bad action: {bad_action}\nHuman good action: {good_action}\nExplain why the human was right."
+
+def build_training_line(image_bytes, a11y_tree, llm_cot, good_action, image_url=None):
+    if image_url is None:
+        image_base64 = base64.b64encode(image_bytes).decode("ascii") if image_bytes else ""
+        image_url = f"data:image/jpeg;base64,{image_base64}"
+    return {
+        "messages": [
+            {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_url}}, {"type": "text", "text": a11y_tree}]},
+            {"role": "assistant", "content": f"<think>{llm_cot}</think>\n{good_action}"}
+        ]
+    }
+
+async def call_teacher(teacher, prompt, bucket, max_retries=TEACHER_MAX_RETRIES, base_delay=0.5):
+    for attempt in range(max_retries + 1):
+        with teacher_rate_wait_seconds.time():
+            await bucket.acquire()
+        start = time.perf_counter()
+        try:
+            response = await teacher.chat.completions.create(
+                model=TEACHER_MODEL,
+                messages=[{"role": "user", "content": prompt}]
+            )
+        except Exception as e:
+            teacher_call_seconds.observe(time.perf_counter() - start, outcome="error")
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            print(f"Teacher call failed ({e}); retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+            continue
+        content = response.choices[0].message.content
+        # Not transient: asking again would only spend rate-limit tokens on the same answer.
+        if not content or not content.strip():
+            teacher_call_seconds.observe(time.perf_counter() - start, outcome="empty")
+            raise EmptyCompletionError("The teacher returned no content (for example, a content-filter stop).")
+        teacher_call_seconds.observe(time.perf_counter() - start, outcome="ok")
+        return content.strip()
+
+def iter_unprocessed(conn, page_size):
+    # Keyset pagination keeps memory flat regardless of backlog size.
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, image_hash, image_base64, a11y_tree, bad_action, good_action FROM tuples WHERE processed = 0 AND id > ? ORDER BY id LIMIT ?",
+            (last_id, page_size)
+        ).fetchall()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+# The dataset is either a JSONL file (path ending in .jsonl) or a sharded
+# dataset directory (see training_shards.py).
+#
+# Crash safety: before appending a batch, its ids and the pre-write file size
+# (or record count, for shards) are saved to <dataset>.pending. The marker is
+# removed after the processed flags commit. If it is still present on startup,
+# the partial append is truncated away and those rows are queued again, so no
+# line is duplicated.
+def _pending_path(dataset_path):
+    return dataset_path.rstrip(os.sep) + ".pending"
+
+def _is_jsonl(dataset_path):
+    return dataset_path.endswith(".jsonl")
+
+def recover_pending_batch(conn, dataset_path):
+    pending_path = _pending_path(dataset_path)
+    if not os.path.exists(pending_path):
+        return 0
+    with open(pending_path, "r") as f:
+        pending = json.load(f)
+    if not _is_jsonl(dataset_path):
+        writer = training_shards.ShardWriter(dataset_path)
+        writer.rollback(pending["records"])
+        writer.close()
+    elif os.path.exists(dataset_path):
+        with open(dataset_path, "r+b") as f:
+            f.truncate(pending["offset"])
+    conn.executemany("UPDATE tuples SET processed = 0 WHERE id = ?", [(i,) for i in pending["ids"]])
+    conn.commit()
+    os.remove(pending_path)
+    return len(pending["ids"])
+
+def migrate_legacy_dataset(db_path, dataset_path):
+    """Move a training_dataset.jsonl left by an older version into the sharded
+    dataset that replaced it, so its lines are not silently left behind."""
+    legacy = training_shards.legacy_jsonl_path(dataset_path)
+    if _is_jsonl(dataset_path) or not os.path.isfile(legacy):
+        return None
+    if os.path.exists(_pending_path(legacy)) and os.path.exists(db_path):
+        conn = rlhf_store.connect(db_path)
+        try:
+            recover_pending_batch(conn, legacy)
+        finally:
+            conn.close()
+    stats = training_shards.migrate_legacy_jsonl(dataset_path)
+    if stats:
+        print(f"Converted {legacy} into {dataset_path}: {stats['records']} records, {stats['images']} unique images.")
+    return stats
+
+class DatasetWriter:
+    def __init__(self, conn, dataset_path):
+        self.conn = conn
+        self.dataset_path = dataset_path
+        self.file = open(dataset_path, "ab")
+        self.written = 0
+
+    def encode(self, image_bytes, a11y_tree, llm_cot, good_action):
+        return build_training_line(image_bytes, a11y_tree, llm_cot, good_action)
+
+    def write_batch(self, results):
+        if not results:
+            return
+        ids = [row_id for row_id, _ in results]
+        with open(_pending_path(self.dataset_path), "w") as f:
+            json.dump({"offset": self.file.tell(), "ids": ids}, f)
+        self.file.write(b"".join((json.dumps(line) + "\n").encode("utf-8") for _, line in results))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._mark_processed(ids)
+
+    def _mark_processed(self, ids):
+        self.conn.executemany("UPDATE tuples SET processed = 1 WHERE id = ?", [(i,) for i in ids])
+        self.conn.commit()
+        os.remove(_pending_path(self.dataset_path))
+        self.written += len(ids)
+
+    def close(self):
+        self.file.close()
+
+class ShardedDatasetWriter(DatasetWriter):
+    """Writes batches into a sharded dataset directory; screenshots go to its
+    image store once per hash instead of being inlined in every line."""
+
+    def __init__(self, conn, dataset_dir, max_shard_bytes=training_shards.DEFAULT_MAX_SHARD_BYTES):
+        self.conn = conn
+        self.dataset_path = dataset_dir
+        self.shards = training_shards.ShardWriter(dataset_dir, max_shard_bytes)
+        self.written = 0
+
+    def encode(self, image_bytes, a11y_tree, llm_cot, good_action):
+        if not image_bytes:
+            return build_training_line(image_bytes, a11y_tree, llm_cot, good_action)
+        digest = self.shards.put_image(image_bytes)
+        line = build_training_line(None, a11y_tree, llm_cot, good_action, training_shards.IMAGE_URL_PREFIX + digest)
+        line["image"] = digest
+        return line
+
+    def write_batch(self, results):
+        if not results:
+            return
+        ids = [row_id for row_id, _ in results]
+        with open(_pending_path(self.dataset_path), "w") as f:
+            json.dump({"records": self.shards.records, "ids": ids}, f)
+        for _, line in results:
+            self.shards.append(line)
+        self.shards.commit()
+        self._mark_processed(ids)
+
+    def close(self):
+        self.shards.close()
+
+def open_dataset_writer(conn, dataset_path):
+    if _is_jsonl(dataset_path):
+        return DatasetWriter(conn, dataset_path)
+    return ShardedDatasetWriter(conn, dataset_path, CONFIG.get("training_shard_mb", 64) * 2 ** 20)
+
+def _image_key(image_hash, inline_image):
+    if image_hash:
+        return image_hash
+    return rlhf_store.frame_hash(inline_image.encode("ascii")) if inline_image else None
+
+def format_stats(stats):
+    avoided = stats["cache_hits"] + stats["cluster_reuses"]
+    return (f"Teacher pass: {stats['processed']} processed, {stats['failed']} failed, "
+            f"{stats['teacher_calls']} teacher calls, {avoided} avoided "
+            f"({stats['cache_hits']} cached, {stats['cluster_reuses']} near-duplicates).")
+
+async def process_rlhf_tuples_async(db_path, dataset_path, teacher=None, concurrency=TEACHER_CONCURRENCY,
+                                    rps=TEACHER_RPS, batch_size=TEACHER_BATCH_SIZE, max_retries=TEACHER_MAX_RETRIES,
+                                    cache=None, cluster=True):
+    """One pass over unprocessed tuples. Near-duplicate tuples are clustered
+    first (see teacher_cache.py) and only each cluster's representative is
+    sent to the teacher; `cache` is an optional TeacherCache consulted before
+    every call."""
+    teacher = teacher or client
+    conn = rlhf_store.connect(db_path)
+    rlhf_store.init_schema(conn)
+    recovered = recover_pending_batch(conn, dataset_path)
+    if recovered:
+        print(f"Recovered {recovered} tuples from an interrupted batch.")
+
+    bucket = TokenBucket(rps, capacity=concurrency)
+    rows = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue()
+    writer = open_dataset_writer(conn, dataset_path)
+    clusterer = TupleClusterer(CLUSTER_TREE_THRESHOLD, CLUSTER_MAX_HAMMING) if cluster else None
+    stats = {"processed": 0, "failed": 0, "teacher_calls": 0, "cache_hits": 0, "cluster_reuses": 0}
+
+    def emit(row, llm_cot):
+        row_id, image_hash, inline_image, a11y_tree, _, good_action = row
+        # Screenshots are fetched from the frame store only once the teacher has answered.
+        image_bytes = rlhf_store.load_tuple_image(conn, image_hash, inline_image)
+        results.put_nowait((row_id, writer.encode(image_bytes, a11y_tree, llm_cot, good_action)))
+
+    def fail(row_ids):
+        stats["failed"] += len(row_ids)
+        teacher_tuples.inc(len(row_ids), outcome="failed")
+
+    def reuse(row, tuple_cluster):
+        stats["cluster_reuses"] += 1
+        teacher_calls_avoided.inc(reason="cluster")
+        emit(row, tuple_cluster.llm_cot)
+
+    async def produce():
+        for row in iter_unprocessed(conn, batch_size):
+            if clusterer is None:
+                await rows.put((row, None))
+                continue
+            row_id, image_hash, inline_image, a11y_tree, bad_action, good_action = row
+            tuple_cluster, is_new = clusterer.assign(
+                row_id, a11y_tree, bad_action, good_action, _image_key(image_hash, inline_image),
+                lambda: rlhf_store.load_tuple_image(conn, image_hash, inline_image))
+            if is_new:
+                await rows.put((row, tuple_cluster))
+            elif tuple_cluster.llm_cot is not None:
+                reuse(row, tuple_cluster)
+            elif tuple_cluster.failed:
+                # Left unprocessed; the next pass retries it.
+                fail([row_id])
+            else:
+                tuple_cluster.waiting.append(row)
+        for _ in range(concurrency):
+            await rows.put(None)
+
+    async def work():
+        while (item := await rows.get()) is not None:
+            row, tuple_cluster = item
+            row_id, _, _, a11y_tree, bad_action, good_action = row
+            prompt = build_mentor_prompt(a11y_tree, bad_action, good_action)
+            key = prompt_key(TEACHER_MODEL, None, prompt) if cache is not None else None
+            llm_cot = cache.get(key) if cache is not None else None
+            if llm_cot is not None:
+                stats["cache_hits"] += 1
+                teacher_calls_avoided.inc(reason="cache")
+            else:
+                stats["teacher_calls"] += 1
+                try:
+                    llm_cot = await call_teacher(teacher, prompt, bucket, max_retries)
+                except Exception as e:
+                    print(f"Error on tuple {row_id}: {e}")
+                    fail([row_id])
+                    if tuple_cluster is not None:
+                        tuple_cluster.failed = True
+                        fail([waiting[0] for waiting in tuple_cluster.waiting])
+                        tuple_cluster.waiting.clear()
+                    continue
+                if cache is not None:
+                    cache.put(key, TEACHER_MODEL, llm_cot)
+            emit(row, llm_cot)
+            if tuple_cluster is not None:
+                tuple_cluster.llm_cot = llm_cot
+                for waiting in tuple_cluster.waiting:
+                    reuse(waiting, tuple_cluster)
+                tuple_cluster.waiting.clear()
+
+    async def write():
+        batch = []
+        while (item := await results.get()) is not None:
+            batch.append(item)
+            if len(batch) >= batch_size or results.empty():
+                with teacher_write_seconds.time():
+                    writer.write_batch(batch)
+                teacher_tuples.inc(len(batch), outcome="processed")
+                batch = []
+        writer.write_batch(batch)
+        teacher_tuples.inc(len(batch), outcome="processed")
+
+    writer_task = asyncio.create_task(write())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(produce(), *[work() for _ in range(concurrency)])
+    finally:
+        await results.put(None)
+        await writer_task
+        writer.close()
+        conn.close()
+        teacher_pass_seconds.observe(time.perf_counter() - started)
+    stats["processed"] = writer.written
+    return stats
 
 def process_rlhf_tuples():
     db_path = CONFIG["db_path"]
-    jsonl_path = CONFIG["training_dataset"]
-    
+    dataset_path = CONFIG["training_dataset"]
+
     if not os.path.exists(db_path):
         return
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, image_base64, a11y_tree, bad_action, good_action FROM tuples WHERE processed = 0")
-    rows = cursor.fetchall()
+    migrate_legacy_dataset(db_path, dataset_path)
+    cache = TeacherCache(TEACHER_CACHE_PATH) if TEACHER_CACHE_PATH else None
+    try:
+        stats = asyncio.run(process_rlhf_tuples_async(db_path, dataset_path, cache=cache))
+    finally:
+        if cache is not None:
+            cache.close()
+    if stats["processed"] or stats["failed"]:
+        print(format_stats(stats))
+
+class _WakeupProtocol(asyncio.DatagramProtocol):
+    def __init__(self, event):
+        self.event = event
 
-    for row in rows:
-        row_id, image_base64, a11y_tree, bad_action, good_action = row
-        mentor_prompt = f"Accessibility Tree: {a11y_tree}\nAgent bad action: {bad_action}\nHuman good action: {good_action}\nExplain why the human was right."
+    def datagram_received(self, data, addr):
+        self.event.set()
 
+class WakeupListener:
+    """Wakes the worker when vlm_server reports new tuples over UDP, or when
+    PRAGMA data_version shows another connection committed to the database."""
+
+    def __init__(self, db_path, port, check_interval_s=5.0):
+        self.db_path = db_path
+        self.port = port
+        self.check_interval_s = check_interval_s
+        self.event = asyncio.Event()
+        self._transport = None
+        self._conn = None
+        self._data_version = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
         try:
-            response = client.chat.completions.create(
-                model=TEACHER_MODEL,
-                messages=[{"role": "user", "content": mentor_prompt}]
-            )
-            llm_cot = response.choices[0].message.content.strip()
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _WakeupProtocol(self.event), local_addr=("127.0.0.1", self.port))
+        except OSError as e:
+            print(f"Wakeup socket unavailable on port {self.port} ({e}); relying on data_version checks.")
+        return self
 
-            training_line = {
-                "messages": [
-                    {"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}, {"type": "text", "text": a11y_tree}]},
-                    {"role": "assistant", "content": f"<think>{llm_cot}</think>\n{good_action}"}
-                ]
-            }
+    def database_changed(self):
+        if self._conn is None:
+            if not os.path.exists(self.db_path):
+                return False
+            self._conn = rlhf_store.connect(self.db_path)
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = self._data_version is not None and version != self._data_version
+        self._data_version = version
+        return changed
 
-            with open(jsonl_path, "a") as f:
-                f.write(json.dumps(training_line) + "\n")
+    async def wait(self):
+        while not self.event.is_set():
+            try:
+                await asyncio.wait_for(self.event.wait(), self.check_interval_s)
+            except asyncio.TimeoutError:
+                if self.database_changed():
+                    break
+        self.event.clear()
 
-            cursor.execute("UPDATE tuples SET processed = 1 WHERE id = ?", (row_id,))
-            conn.commit()
-        except Exception as e:
-            print(f"Error: {e}")
+    def close(self):
+        if self._transport:
+            self._transport.close()
+        if self._conn:
+            self._conn.close()
 
-    conn.close()
+async def run_worker(db_path, dataset_path, port, check_interval_s=5.0):
+    migrate_legacy_dataset(db_path, dataset_path)
+    listener = await WakeupListener(db_path, port, check_interval_s).start()
+    cache = TeacherCache(TEACHER_CACHE_PATH) if TEACHER_CACHE_PATH else None
+    try:
+        while True:
+            # Clear before the pass so tuples logged mid-pass trigger another one.
+            listener.event.clear()
+            listener.database_changed()
+            if os.path.exists(db_path):
+                stats = await process_rlhf_tuples_async(db_path, dataset_path, cache=cache)
+                if stats["processed"] or stats["failed"]:
+                    print(format_stats(stats))
+                if stats["processed"]:
+                    continue
+            await listener.wait()
+    finally:
+        listener.close()
+        if cache is not None:
+            cache.close()
 
 if __name__ == "__main__":
-    print(f"Teacher Worker started. Polling {CONFIG['db_path']}...")
-    while True:
-        process_rlhf_tuples()
-        time.sleep(60)
+    port = CONFIG.get("teacher_notify_port", 8765)
+    print(f"Teacher Worker started. Watching {CONFIG['db_path']} (wakeups on udp://127.0.0.1:{port})...")
+    metrics_port = CONFIG.get("teacher_metrics_port", 9101)
+    try:
+        start_http_server(metrics_port)
+    except OSError as e:
+        print(f"Metrics endpoint unavailable on port {metrics_port} ({e}).")
+    asyncio.run(run_worker(CONFIG["db_path"], CONFIG["training_dataset"], port,
+                           CONFIG.get("teacher_check_interval_s", 5.0)))
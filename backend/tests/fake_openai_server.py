@@ -0,0 +1,61 @@
+import asyncio
+import socket
+import threading
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Minimal OpenAI-compatible /v1/chat/completions with configurable latency
+# and injected failures, for exercising teacher clients end to end.
+def create_app(latency_s=0.0, fail_every=0, reply="Because the human clicked the right link."):
+    app = FastAPI()
+    app.state.calls = 0
+    app.state.in_flight = 0
+    app.state.max_in_flight = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        if fail_every and app.state.calls % fail_every == 0:
+            return JSONResponse(status_code=503, content={"error": {"message": "injected failure"}})
+        app.state.in_flight += 1
+        app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+        try:
+            await asyncio.sleep(latency_s)
+        finally:
+            app.state.in_flight -= 1
+        return {
+            "id": f"chatcmpl-{app.state.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    return app
+
+class FakeOpenAIServer:
+    def __init__(self, **kwargs):
+        self.app = create_app(**kwargs)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
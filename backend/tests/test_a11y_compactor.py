@@ -0,0 +1,56 @@
+import json
+from a11y_compactor import A11yCompactor, iter_nodes, short_id
+
+def _wrap(node, depth):
+    for _ in range(depth):
+        node = {"role": "generic", "children": [node]}
+    return node
+
+def _page():
+    children = [
+        _wrap({"id": 10, "role": "searchBox", "name": "Search", "bbox": [100, 20, 400, 30]}, 6),
+        {"id": 11, "role": "heading", "name": "Results", "bbox": [100, 80, 300, 20]},
+        {"id": 12, "role": "staticText", "name": "Some paragraph text", "bbox": [100, 110, 300, 20]},
+        {"id": 13, "role": "link", "name": "Quarterly revenue report", "bbox": [100, 140, 300, 20]},
+        {"id": 14, "role": "link", "name": "Footer link", "bbox": [100, 5000, 300, 20]},
+        {"id": 15, "role": "button", "name": "Accept cookies", "bbox": [900, 700, 100, 30]},
+    ]
+    return {"id": 1, "role": "RootWebArea", "name": "Page", "bbox": [0, 0, 1280, 6000], "children": children}
+
+def test_drops_wrappers_static_and_offscreen_nodes():
+    compact = A11yCompactor().compact(json.dumps(_page()), "revenue report")
+    roles = [n.role for n in compact.nodes]
+    assert roles == ["searchbox", "heading", "link", "button"]
+    assert "Footer link" not in compact.text
+    assert "generic" not in compact.text
+    assert compact.stats["nodes_in"] == 13
+    assert compact.stats["compression_ratio"] > 1
+
+def test_short_ids_are_stable_and_resolve_back():
+    first = A11yCompactor().compact(json.dumps(_page()))
+    second = A11yCompactor().compact(json.dumps(_page()), "something else")
+    assert [n.sid for n in first.nodes] == [n.sid for n in second.nodes]
+    assert short_id(13, 0) == "d"
+    assert first.by_sid["d"].node_id == 13
+
+def test_budget_keeps_objective_relevant_nodes():
+    links = [{"id": i, "role": "link", "name": f"Unrelated link {i}", "bbox": [0, i, 100, 10]} for i in range(100, 400)]
+    links.insert(150, {"id": 999, "role": "link", "name": "Quarterly revenue report", "bbox": [0, 500, 100, 10]})
+    compact = A11yCompactor(token_budget=100).compact(json.dumps({"role": "RootWebArea", "children": links}), "revenue report")
+    assert compact.stats["estimated_tokens"] <= 100
+    assert "Quarterly revenue report" in compact.text
+
+def test_flat_node_list_format():
+    tree = {"nodes": [
+        {"id": 1, "role": "rootWebArea", "child_ids": [2, 3]},
+        {"id": 2, "role": "button", "name": "Go", "bbox": {"x": 1, "y": 2, "width": 3, "height": 4}},
+        {"id": 3, "role": "generic", "child_ids": [4]},
+        {"id": 4, "role": "link", "name": "Next"},
+    ]}
+    assert [n.get("id") for n, _ in iter_nodes(tree)] == [1, 2, 3, 4]
+    compact = A11yCompactor().compact(json.dumps(tree))
+    assert compact.text == '[2] button "Go" @1,2,3,4\n[4] link "Next"'
+
+def test_non_json_tree_is_truncated_not_dropped():
+    compact = A11yCompactor(token_budget=10).compact("x" * 1000)
+    assert compact.text == "x" * 40
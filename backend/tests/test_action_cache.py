@@ -0,0 +1,55 @@
+import time
+from PIL import Image, ImageDraw
+from action_cache import ActionCache, cache_key, image_dhash
+
+def _frame(offset=0):
+    img = Image.new("RGB", (320, 200), "white")
+    ImageDraw.Draw(img).rectangle([40 + offset, 40, 200 + offset, 120], fill="navy")
+    return img
+
+def test_dhash_ignores_tiny_changes_but_not_layout_changes():
+    base = image_dhash(_frame())
+    nudged = _frame()
+    nudged.putpixel((300, 190), (250, 250, 250))
+    assert image_dhash(nudged) == base
+    assert image_dhash(_frame(offset=80)) != base
+
+def test_key_depends_on_objective_and_model():
+    key = cache_key('{"a": 1}', "ff", "obj", "vllm:m1")
+    assert key == cache_key('{ "a" : 1 }', "ff", "obj", "vllm:m1")
+    assert key != cache_key('{"a": 1}', "ff", "other", "vllm:m1")
+    assert key != cache_key('{"a": 1}', "ff", "obj", "vllm:m2")
+
+def test_lru_and_ttl_eviction():
+    cache = ActionCache(max_entries=2, ttl_s=0.1)
+    cache.put("a", {"action": "click"})
+    cache.put("b", {"action": "scroll"})
+    assert cache.get("a") == {"action": "click"}
+    cache.put("c", {"action": "type"})
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+    time.sleep(0.15)
+    assert cache.get("a") is None
+
+def test_disk_tier_survives_restart_and_invalidation(tmp_path):
+    path = str(tmp_path / "actions.db")
+    ActionCache(disk_path=path).put("k", {"action": "click"})
+    restarted = ActionCache(disk_path=path)
+    assert restarted.get("k") == {"action": "click"}
+    assert restarted.stats()["disk_hits"] == 1
+    restarted.invalidate()
+    assert ActionCache(disk_path=path).get("k") is None
+
+def test_disk_tier_is_bounded(tmp_path):
+    path = str(tmp_path / "actions.db")
+    cache = ActionCache(max_entries=3, ttl_s=60, disk_path=path)
+    for i in range(10):
+        cache.put(f"k{i}", {"action": "scroll", "i": i})
+    rows = [key for (key,) in cache._conn.execute("SELECT key FROM actions ORDER BY expires_at")]
+    assert rows == ["k7", "k8", "k9"]
+
+    short = ActionCache(max_entries=3, ttl_s=0.05, disk_path=str(tmp_path / "short.db"))
+    short.put("old", {"action": "click"})
+    time.sleep(0.1)
+    short.put("new", {"action": "click"})
+    assert [key for (key,) in short._conn.execute("SELECT key FROM actions")] == ["new"]
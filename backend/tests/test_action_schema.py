@@ -0,0 +1,37 @@
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from action_schema import ACTION_SCHEMA, ActionParseError, first_json_object, parse_action
+from engine_manager import action_sampling_params
+
+
+def test_first_json_object_skips_fences_chatter_and_string_braces():
+    text = 'Sure!\n```json\n{"action": "type", "text": "a } b {", "thought": "q"}\n```\nAnything else? {"x": 1}'
+    assert first_json_object(text) == '{"action": "type", "text": "a } b {", "thought": "q"}'
+    assert first_json_object('{"action": "click", "target_bbox": [1, 2') is None
+    assert first_json_object("no json here") is None
+
+
+def test_parse_action_validates_schema():
+    action = parse_action('{"action": "click", "target_bbox": [1, 2, 3, 4], "thought": "go"}')
+    assert action.to_response() == {"action": "click", "target_bbox": [1, 2, 3, 4], "thought": "go"}
+    for bad in ('{"action": "dance"}', '{"action": "click", "target_bbox": [1, 2]}', '{"thought": "x"}', "", "{"):
+        with pytest.raises(ActionParseError):
+            parse_action(bad)
+
+
+def test_action_sampling_params_use_guided_json():
+    vllm = MagicMock()
+    guided = MagicMock()
+    with patch.dict(sys.modules, {"vllm": vllm, "vllm.sampling_params": guided}):
+        action_sampling_params({"action_max_tokens": 128})
+        guided.GuidedDecodingParams.assert_called_once_with(json=ACTION_SCHEMA)
+        kwargs = vllm.SamplingParams.call_args.kwargs
+        assert kwargs["max_tokens"] == 128
+        assert kwargs["guided_decoding"] is guided.GuidedDecodingParams.return_value
+
+        vllm.reset_mock()
+        action_sampling_params({"guided_decoding": False})
+        assert "guided_decoding" not in vllm.SamplingParams.call_args.kwargs
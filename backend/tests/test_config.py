@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+import config
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / "smartchrome_config.json"
+    saved = dict(config.CONFIG)
+    monkeypatch.setattr(config, "CONFIG_PATH", str(path))
+    monkeypatch.setattr(config, "_overrides", {})
+    monkeypatch.setattr(config, "_listeners", [])
+    monkeypatch.setattr(config, "_stamp", config._stamp)
+    path.write_text(json.dumps({"engine": "mock"}))
+    config.reload()
+    yield path
+    config.CONFIG.clear()
+    config.CONFIG.update(saved)
+
+def test_reload_updates_the_shared_dict_in_place(config_file):
+    shared = config.load_config()
+    config_file.write_text(json.dumps({"engine": "vllm", "port": 9000}))
+    changes = []
+    config.on_change(changes.append)
+    assert config.reload() == {"engine", "port"}
+    assert config.load_config() is shared
+    assert (shared["engine"], shared["port"], shared["db_path"]) == ("vllm", 9000, "rlhf_tuples.db")
+
+    assert config.reload() == set()  # file unchanged: no re-read
+    config.override(engine="sim")
+    config_file.write_text(json.dumps({"engine": "mlx", "port": 9001, "fast_path_rules": []}))
+    assert config.reload() == {"port", "fast_path_rules"}
+    assert (shared["engine"], shared["port"]) == ("sim", 9001)
+    assert changes[-1] == {"port", "fast_path_rules"}
+
+def test_unreadable_file_keeps_previous_values(config_file):
+    config_file.write_text(json.dumps({"port": 9002}))
+    config.reload()
+    config_file.write_text('{"port": 90')
+    assert config.reload() == set()
+    assert config.CONFIG["port"] == 9002
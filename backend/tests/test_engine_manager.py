@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+from engine_manager import Engine, EngineManager, EngineLoadError
+
+def _loader(delay=0.0, fail=False):
+    def load(kind, model_path, config):
+        time.sleep(delay)
+        if fail:
+            raise EngineLoadError("weights missing")
+        return Engine(kind, model_path)
+    return load
+
+async def _wait_for(manager, states=("succeeded", "failed")):
+    while manager.reload_status["state"] not in states:
+        await asyncio.sleep(0.01)
+
+def test_old_engine_serves_until_new_one_is_ready():
+    async def run():
+        manager = EngineManager({}, loader=_loader(delay=0.2))
+        old = manager.active
+        manager.start_reload("mock", "v2")
+        await asyncio.sleep(0.05)
+        assert manager.active is old
+        assert manager.reload_status["state"] == "loading"
+        await _wait_for(manager)
+        return old, manager
+
+    old, manager = asyncio.run(run())
+    assert manager.reload_status["state"] == "succeeded"
+    assert manager.active is not old
+    assert manager.active.model_path == "v2"
+
+def test_failed_load_keeps_active_engine():
+    async def run():
+        manager = EngineManager({}, loader=_loader(fail=True))
+        old = manager.active
+        manager.start_reload("vllm", "broken")
+        await _wait_for(manager)
+        return old, manager
+
+    old, manager = asyncio.run(run())
+    assert manager.active is old
+    assert manager.reload_status["state"] == "failed"
+    assert "weights missing" in manager.reload_status["error"]
+
+def test_failed_health_check_keeps_active_engine():
+    def checker(engine):
+        raise RuntimeError("warmup produced garbage")
+
+    async def run():
+        manager = EngineManager({}, loader=_loader(), checker=checker)
+        old = manager.active
+        manager.start_reload("mock", "v2")
+        await _wait_for(manager)
+        return old, manager
+
+    old, manager = asyncio.run(run())
+    assert manager.active is old
+    assert manager.reload_status["state"] == "failed"
+
+def test_previous_engine_released_only_after_drain():
+    closed = threading.Event()
+
+    async def run():
+        manager = EngineManager({}, loader=_loader())
+        old = manager.active
+        old.close = closed.set
+        with manager.lease():
+            manager.start_reload("mock", "v2")
+            await _wait_for(manager, ("draining",))
+            # Traffic has switched but the in-flight request still holds the old engine.
+            assert manager.active is not old
+            await asyncio.sleep(0.05)
+            assert not closed.is_set()
+        await _wait_for(manager)
+        return manager
+
+    manager = asyncio.run(run())
+    assert closed.is_set()
+    assert manager.reload_status["state"] == "succeeded"
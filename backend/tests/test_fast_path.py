@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from a11y_index import A11yIndex
+from fast_path import FastPathEngine
+from session_state import Session
+
+RULES = [
+    {"name": "bootstrap_search", "type": "empty_page"},
+    {"name": "consent_banner", "type": "click_node", "name_pattern": "^(accept all|i agree)$"},
+    {"name": "load_more", "type": "click_node", "name_pattern": "^load more", "max_hits_per_session": 2},
+    {"name": "search_box", "type": "type_objective", "roles": ["searchbox"]},
+]
+
+
+def _index(*children):
+    return A11yIndex.build(json.dumps({"role": "RootWebArea", "name": "Some page", "id": 1, "children": list(children)}))
+
+
+def _session(objective="quarterly revenue report"):
+    return Session("tab", objective)
+
+
+def test_empty_page_searches_for_objective():
+    hit = FastPathEngine(RULES).evaluate(A11yIndex.build("{}"), _session("q3 revenue & costs"))
+    assert hit == ("bootstrap_search", {"action": "navigate", "url": "https://www.google.com/search?q=q3+revenue+%26+costs",
+                                        "thought": "Starting mission by searching for objective."})
+
+
+def test_consent_button_is_clicked():
+    index = _index({"role": "dialog", "name": "Cookies", "children": [
+        {"role": "button", "name": "Manage", "bbox": [0, 0, 10, 10]},
+        {"role": "button", "name": "Accept all", "bbox": [600, 500, 120, 32]},
+    ]})
+    rule, action = FastPathEngine(RULES).evaluate(index, _session())
+    assert rule == "consent_banner"
+    assert action["target_bbox"] == [600, 500, 120, 32]
+
+
+def test_search_box_only_when_empty():
+    engine = FastPathEngine(RULES)
+    empty = _index({"role": "searchbox", "name": "Search", "bbox": [10, 10, 300, 30]})
+    assert engine.evaluate(empty, _session())[1] == {"action": "type", "target_bbox": [10, 10, 300, 30],
+                                                     "text": "quarterly revenue report",
+                                                     "thought": "Entering the objective into the search box."}
+    filled = _index({"role": "searchbox", "name": "Search", "value": "quarterly revenue report", "bbox": [10, 10, 300, 30]})
+    assert engine.evaluate(filled, _session()) is None
+
+
+def test_search_box_does_not_take_over_a_task():
+    engine = FastPathEngine(RULES)
+    session = _session()
+    header = _index({"role": "searchbox", "name": "Search site", "bbox": [900, 10, 200, 30]})
+    assert engine.evaluate(header, session)[0] == "search_box"
+    # The model steps in between; the header box is still empty on the next page.
+    session.last_action = {"action": "click", "target_bbox": [1, 2, 3, 4]}
+    assert engine.evaluate(header, session) is None  # once per session
+    # A second, empty box next to the one holding the objective is left alone.
+    results = _index({"role": "searchbox", "name": "Search", "value": "Quarterly Revenue Report", "bbox": [10, 10, 300, 30]},
+                     {"role": "searchbox", "name": "Search site", "bbox": [900, 10, 200, 30]})
+    assert engine.evaluate(results, _session()) is None
+
+
+def test_hit_limits_and_repeat_guard():
+    engine = FastPathEngine(RULES)
+    session = _session()
+    load_more = _index({"role": "button", "name": "Load more results", "bbox": [10, 700, 200, 30]})
+    assert engine.evaluate(load_more, session)[0] == "load_more"
+    session.last_action = None
+    assert engine.evaluate(load_more, session)[0] == "load_more"
+    session.last_action = None
+    assert engine.evaluate(load_more, session) is None  # max_hits_per_session
+
+    consent = _index({"role": "button", "name": "I agree", "bbox": [1, 2, 3, 4]})
+    _, action = engine.evaluate(consent, session)
+    session.last_action = action
+    assert engine.evaluate(consent, session) is None  # same click again did nothing; defer
+
+
+def test_counters():
+    engine = FastPathEngine(RULES)
+    engine.evaluate(A11yIndex.build("{}"), _session())
+    engine.evaluate(_index({"role": "link", "name": "Annual report 2024", "bbox": [1, 2, 3, 4]}), _session())
+    stats = engine.stats()
+    assert stats["evaluations"] == 2 and stats["hits"] == 1 and stats["hit_rate"] == 0.5
+    assert stats["rules"]["bootstrap_search"]["hits"] == 1
+    assert stats["rules"]["consent_banner"]["evaluations"] == 1
+    assert stats["avg_us"] > 0
+
+
+def test_unknown_rule_type():
+    with pytest.raises(ValueError):
+        FastPathEngine([{"name": "x", "type": "teleport"}])
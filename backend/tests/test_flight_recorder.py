@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from flight_recorder import FlightRecorder, note_phase, read_steps, read_trace, trace_files
+
+def _record(recorder, n, frame=b"jpeg-bytes", tree="tree"):
+    for i in range(n):
+        with recorder.step("/vlm/act", {"session_id": "tab-1", "i": i}, {"frame": frame, "a11y_tree": tree}) as step:
+            note_phase("generate", 0.25)
+            note_phase("generate", 0.25)
+            step["response"] = {"action": "scroll", "i": i}
+
+def test_steps_round_trip_with_deduplicated_blobs(tmp_path):
+    recorder = FlightRecorder(str(tmp_path))
+    _record(recorder, 5)
+    with pytest.raises(ValueError):
+        with recorder.step("/vlm/act", {"session_id": "tab-1"}, {"frame": lambda: b"other"}):
+            raise ValueError("boom")
+    recorder.close()
+
+    assert recorder.stats()["recorded"] == 6
+    assert (recorder.blobs_written, recorder.blobs_deduplicated) == (3, 8)
+    steps = read_steps([str(tmp_path)])
+    assert [s["request"].get("i") for s in steps] == [0, 1, 2, 3, 4, None]
+    assert steps[0]["data"] == {"frame": b"jpeg-bytes", "a11y_tree": "tree"}
+    assert steps[0]["phases"] == {"generate": 500.0}
+    assert steps[0]["response"] == {"action": "scroll", "i": 0}
+    assert (steps[-1]["status"], steps[-1]["error"], steps[-1]["data"]) == (500, "boom", {"frame": b"other"})
+
+def test_rotation_keeps_directory_under_cap(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), max_bytes=6000, max_file_bytes=2000, flush_interval_s=0)
+    for i in range(40):
+        _record(recorder, 1, frame=os.urandom(600))
+        recorder.flush()
+    recorder.close()
+    files = trace_files(str(tmp_path))
+    assert len(files) > 1 and recorder.files_deleted > 0
+    assert sum(os.path.getsize(p) for p in files) <= 6000 + 1000
+    # Every remaining file is readable on its own.
+    assert all(step["data"]["frame"] for path in files for step in read_trace(path))
+
+def test_truncated_trace_reads_complete_batches(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), flush_interval_s=0)
+    _record(recorder, 3)
+    recorder.flush()
+    _record(recorder, 3)
+    recorder.close()
+    path = trace_files(str(tmp_path))[0]
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 10)
+    assert 3 <= len(list(read_trace(path))) < 6
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), queue_size=1)
+    recorder._thread = object()  # no writer running
+    recorder.record({"type": "step"})
+    recorder.record({"type": "step"})
+    assert recorder.dropped == 1
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+from PIL import Image
+
+from a11y_compactor import CompactNode
+from image_preprocess import BBoxTransform, ImagePreprocessor, smart_resize, vision_tokens
+
+
+def _jpeg(size):
+    buf = io.BytesIO()
+    Image.new("RGB", size, "white").save(buf, format="JPEG")
+    return Image.open(io.BytesIO(buf.getvalue()))
+
+
+def test_smart_resize_respects_patch_grid_and_budget():
+    w, h = smart_resize(2560, 1600, patch=28, max_pixels=1280 * 28 * 28)
+    assert w % 28 == 0 and h % 28 == 0
+    assert w * h <= 1280 * 28 * 28
+    assert abs(w / h - 1.6) < 0.05
+    assert smart_resize(4, 4) == (56, 56)
+    assert vision_tokens(56, 56) == 4
+
+
+def test_jpeg_draft_decode_reduces_scale():
+    pre = ImagePreprocessor(max_pixels=320 * 28 * 28)
+    image = pre.decode(_jpeg((2560, 1600)))
+    assert image.size[0] < 2560
+    assert image.info["source_size"] == (2560, 1600)
+    prepared = pre.prepare(image)
+    assert prepared.image.size == smart_resize(2560, 1600, max_pixels=320 * 28 * 28)
+    assert prepared.stats["vision_tokens"] < prepared.stats["source_vision_tokens"]
+
+
+def test_bbox_round_trip_through_hidpi_resize():
+    pre = ImagePreprocessor()
+    prepared = pre.prepare(pre.decode(_jpeg((2560, 1600))), viewport=(1280, 800))
+    model_bbox = prepared.transform.to_model([100, 200, 50, 20])
+    assert prepared.transform.to_page(model_bbox) == [100, 200, 50, 20]
+
+
+def test_page_size_defaults_to_the_source_frame():
+    pre = ImagePreprocessor()
+    prepared = pre.prepare(pre.decode(_jpeg((1920, 1080))))
+    model_w, model_h = prepared.stats["model_size"]
+    assert prepared.transform.to_model([1920, 1080, 0, 0])[:2] == [model_w, model_h]
+    assert prepared.transform.to_page([model_w / 2, model_h / 2, 0, 0])[:2] == [960, 540]
+
+
+def test_crop_to_nodes_maps_back_to_page_coordinates():
+    pre = ImagePreprocessor(crop_to_nodes=True, crop_margin=0)
+    nodes = [CompactNode("a", 1, "button", "Go", [600, 400, 100, 40], 0)]
+    prepared = pre.prepare(pre.decode(_jpeg((1280, 800))), nodes, (1280, 800))
+    assert prepared.stats["cropped"]
+    assert prepared.stats["vision_tokens"] < 50
+    x, y, w, h = prepared.transform.to_model([600, 400, 100, 40])
+    assert (x, y) == (0, 0)
+    assert prepared.transform.to_page([x, y, w, h]) == [600, 400, 100, 40]
+
+
+def test_large_node_regions_are_not_cropped():
+    pre = ImagePreprocessor(crop_to_nodes=True)
+    nodes = [CompactNode("a", 1, "link", "x", [0, 0, 1280, 800], 0)]
+    assert not pre.prepare(pre.decode(_jpeg((1280, 800))), nodes, (1280, 800)).stats["cropped"]
+
+
+def test_identity_transform():
+    assert BBoxTransform().to_page([1.4, 2.6, 3, 4]) == [1, 3, 3, 4]
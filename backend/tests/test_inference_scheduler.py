@@ -0,0 +1,55 @@
+import asyncio
+import time
+import pytest
+from inference_scheduler import InferenceScheduler, QueueFullError, DeadlineExceededError
+
+def _slow_echo(delay):
+    def generate(batch):
+        time.sleep(delay)
+        return batch
+    return generate
+
+def test_batches_concurrent_submissions():
+    calls = []
+
+    def generate(batch):
+        calls.append(list(batch))
+        return [x * 2 for x in batch]
+
+    async def run():
+        scheduler = InferenceScheduler(generate, max_batch_size=4, max_wait_ms=20)
+        return await asyncio.gather(*[scheduler.submit(i) for i in range(10)])
+
+    assert asyncio.run(run()) == [i * 2 for i in range(10)]
+    assert all(len(batch) <= 4 for batch in calls)
+    assert len(calls) < 10
+
+def test_queue_full_raises():
+    async def run():
+        scheduler = InferenceScheduler(_slow_echo(0.2), max_batch_size=1, max_wait_ms=0, max_queue_size=1)
+        tasks = [asyncio.ensure_future(scheduler.submit(i)) for i in range(4)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return scheduler, results
+
+    scheduler, results = asyncio.run(run())
+    assert any(isinstance(r, QueueFullError) for r in results)
+    assert scheduler.rejected >= 1
+
+def test_deadline_exceeded():
+    async def run():
+        scheduler = InferenceScheduler(_slow_echo(0.3), max_batch_size=1, max_wait_ms=0)
+        with pytest.raises(DeadlineExceededError):
+            await scheduler.submit("x", timeout_s=0.05)
+
+    asyncio.run(run())
+
+def test_generate_errors_propagate_to_callers():
+    def generate(batch):
+        raise RuntimeError("engine crashed")
+
+    async def run():
+        scheduler = InferenceScheduler(generate, max_batch_size=2, max_wait_ms=5)
+        return await asyncio.gather(scheduler.submit(1), scheduler.submit(2), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+pytest.importorskip("requests")
+
+from local_forge import count_training_examples, iter_training_examples, run_epochs
+from teacher_worker import build_training_line
+from training_shards import convert_jsonl
+
+def _jsonl(path, n):
+    with open(path, "w") as f:
+        for i in range(n):
+            line = build_training_line(f"frame-{i % 3}".encode(), f"tree {i}", f"cot {i}", json.dumps({"i": i}))
+            f.write(json.dumps(line) + "\n")
+
+def _i(line):
+    return json.loads(line["messages"][-1]["content"].split("\n", 1)[1])["i"]
+
+def test_iterates_legacy_jsonl_and_sharded_datasets(tmp_path):
+    jsonl = str(tmp_path / "training_dataset.jsonl")
+    _jsonl(jsonl, 20)
+    assert count_training_examples(jsonl) == 20
+    legacy = list(iter_training_examples(jsonl))
+    assert [_i(line) for line, _ in legacy] == list(range(20))
+    assert all(image == f"frame-{_i(line) % 3}".encode() for line, image in legacy)
+
+    sharded = str(tmp_path / "shards")
+    convert_jsonl(jsonl, sharded, max_shard_bytes=500)
+    assert count_training_examples(sharded) == 20
+    orders = []
+    for epoch in range(2):
+        examples = list(iter_training_examples(sharded, epoch=epoch, seed=3))
+        assert sorted(_i(line) for line, _ in examples) == list(range(20))
+        assert all(image == f"frame-{_i(line) % 3}".encode() for line, image in examples)
+        orders.append([_i(line) for line, _ in examples])
+    assert orders[0] != orders[1]  # reshuffled per epoch
+
+    images = []
+    assert run_epochs(sharded, lambda line, image: images.append(image), epochs=2) == 40
+    assert None not in images
@@ -0,0 +1,56 @@
+import urllib.request
+
+import pytest
+
+from metrics import Registry, start_http_server
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram("op_seconds", "Op latency.", ("phase",), buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 5.0):
+        histogram.observe(value, phase="parse")
+    text = registry.render()
+    assert 'op_seconds_bucket{phase="parse",le="0.01"} 1' in text
+    assert 'op_seconds_bucket{phase="parse",le="0.1"} 3' in text
+    assert 'op_seconds_bucket{phase="parse",le="1.0"} 3' in text
+    assert 'op_seconds_bucket{phase="parse",le="+Inf"} 4' in text
+    assert 'op_seconds_count{phase="parse"} 4' in text
+    assert "# TYPE op_seconds histogram" in text
+    assert histogram.count(phase="parse") == 4
+
+
+def test_counters_gauges_and_callbacks():
+    registry = Registry()
+    counter = registry.counter("steps_total", "Steps.", ("outcome",))
+    counter.inc(outcome="model")
+    counter.inc(2, outcome='we"ird\n')
+    assert registry.counter("steps_total", "Steps.", ("outcome",)) is counter
+    registry.gauge("depth", "Depth.").set(7)
+    registry.callback("sessions", "Sessions.", lambda: {("a",): 1, ("b",): 2}, labelnames=("id",))
+    text = registry.render()
+    assert 'steps_total{outcome="model"} 1' in text
+    assert 'steps_total{outcome="we\\"ird\\n"} 2' in text
+    assert "depth 7" in text
+    assert 'sessions{id="b"} 2' in text
+
+
+def test_label_and_registration_mismatches_raise():
+    registry = Registry()
+    counter = registry.counter("c_total", "C.", ("a",))
+    with pytest.raises(ValueError):
+        counter.inc(b="x")
+    with pytest.raises(ValueError):
+        registry.histogram("c_total", "C.", ("a",))
+
+
+def test_http_exporter_serves_metrics():
+    registry = Registry()
+    registry.counter("served_total", "Served.").inc()
+    server = start_http_server(0, registry=registry)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "served_total 1" in response.read().decode()
+    finally:
+        server.shutdown()
@@ -0,0 +1,98 @@
+import json
+import os
+import random
+import statistics
+import time
+
+import pytest
+from PIL import Image
+
+from engine_manager import load_engine
+from flight_recorder import FlightRecorder
+from inference_scheduler import QueueFullError
+from mock_engine import LatencyModel, SimulatedEngineError, SimulatedLLM
+
+def _texts(outputs):
+    return [o.outputs[0].text for o in outputs]
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    lognormal = LatencyModel({"dist": "lognormal", "median_ms": 200, "sigma": 0.5}, rng)
+    samples = [lognormal.sample() for _ in range(4000)]
+    assert 0.18 < statistics.median(samples) < 0.22
+    assert max(samples) > 0.5  # a long tail
+    capped = LatencyModel({"dist": "lognormal", "median_ms": 200, "sigma": 2.0, "cap_ms": 300}, rng)
+    assert max(capped.sample() for _ in range(1000)) == 0.3
+    uniform = LatencyModel({"dist": "uniform", "min_ms": 10, "max_ms": 20}, rng)
+    assert all(0.01 <= uniform.sample() <= 0.02 for _ in range(100))
+    assert LatencyModel({"dist": "constant", "ms": 5}).sample() == 0.005
+    with pytest.raises(ValueError):
+        LatencyModel({"dist": "pareto"})
+
+def test_batches_beyond_capacity_take_extra_rounds():
+    llm = SimulatedLLM(latency={"dist": "constant", "ms": 30}, batch_capacity=2)
+    start = time.perf_counter()
+    assert len(llm.generate([{}] * 2)) == 2
+    two = time.perf_counter() - start
+    start = time.perf_counter()
+    assert len(llm.generate([{}] * 5)) == 5
+    five = time.perf_counter() - start
+    assert 0.03 <= two < 0.06
+    assert 0.09 <= five < 0.13
+    assert llm.stats()["items"] == 7
+
+def test_script_cycles_and_faults_are_injected():
+    script = [{"action": "click", "target_id": "1"}, {"action": "scroll", "direction": "down"}]
+    llm = SimulatedLLM(script=script)
+    assert [json.loads(t) for t in _texts(llm.generate([{}] * 3))] == [script[0], script[1], script[0]]
+
+    assert _texts(SimulatedLLM(malformed_rate=1.0).generate([{}]))[0].endswith("[1, 2")
+    with pytest.raises(SimulatedEngineError):
+        SimulatedLLM(error_rate=1.0).generate([{}])
+    with pytest.raises(QueueFullError):
+        SimulatedLLM(overload_rate=1.0).generate([{}])
+    hung = SimulatedLLM(timeout_rate=1.0, timeout_s=0.05)
+    start = time.perf_counter()
+    hung.generate([{}])
+    assert time.perf_counter() - start >= 0.05
+    assert hung.stats()["injected"]["timeout"] == 1
+
+def test_debug_dumps_are_sampled_and_bounded(tmp_path):
+    item = {"prompt": "prompt text", "multi_modal_data": {"image": Image.new("RGB", (8, 8))}}
+    llm = SimulatedLLM(debug_dump_rate=1.0, debug_dump_dir=str(tmp_path), debug_dump_keep=2)
+    llm.generate([item] * 5)
+    assert sorted(os.listdir(tmp_path)) == ["dump-000004.jpg", "dump-000004.txt", "dump-000005.jpg", "dump-000005.txt"]
+    assert SimulatedLLM(debug_dump_rate=0.0, debug_dump_dir=str(tmp_path / "none")).generate([item]) and not os.path.exists(tmp_path / "none")
+
+def test_replays_actions_from_flight_recorder_traces(tmp_path):
+    recorder = FlightRecorder(str(tmp_path))
+    for response, status in (({"action": "click", "target_bbox": [1, 2, 3, 4]}, 200), ({"detail": "resync"}, 409),
+                             ({"action": "scroll", "direction": "down", "skipped": True}, 200)):
+        with recorder.step("/vlm/act/binary", {"session_id": "tab"}) as step:
+            step["response"] = response
+            step["status"] = status
+    recorder.close()
+    llm = load_engine("sim", None, {"sim_engine": {"replay": str(tmp_path)}}).llm
+    assert [json.loads(t) for t in _texts(llm.generate([{}] * 2))] == [
+        {"action": "click", "target_bbox": [1, 2, 3, 4]}, {"action": "scroll", "direction": "down"}]
+
+def test_sim_engine_drives_the_action_pipeline():
+    from test_vlm_server import client, vlm_server, _png_b64
+    from engine_manager import Engine
+    tree = '{"role": "RootWebArea", "name": "Results", "children": [{"id": 7, "role": "button", "name": "Go", "bbox": [10, 20, 30, 40]}]}'
+    previous = vlm_server.engines.active
+    llm = SimulatedLLM(script=[{"action": "click", "target_id": "1", "thought": "Scripted."}])
+    vlm_server.engines.active = Engine("sim", llm=llm)
+    vlm_server.action_cache.invalidate()
+    try:
+        response = client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": tree})
+        assert response.status_code == 200
+        assert response.json()["action"] == "click" and response.json()["thought"] == "Scripted."
+        llm.overload_rate = 1.0
+        vlm_server.action_cache.invalidate()
+        overloaded = client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": tree})
+        assert overloaded.status_code == 503 and overloaded.headers["retry-after"] == "1"
+        assert 'smartchrome_sim_injected_faults_total{fault="overload"} 1' in client.get("/metrics").text
+    finally:
+        vlm_server.engines.active = previous
+        vlm_server.action_cache.invalidate()
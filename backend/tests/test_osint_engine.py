@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from osint_engine import EmptyCompletionError, OSINTMapReduce, dedup_paragraphs, pack_chunks, estimate_tokens
+
+class StubLLM:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, system_prompt, user_content):
+        with self._lock:
+            self.calls.append(user_content)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return f"- summary {len(self.calls)}"
+
+def _paragraph(i):
+    return f"Company {i} reported revenue of {i * 7} million in quarter {i % 4} according to filing number {i * 13}."
+
+def test_dedup_drops_exact_and_near_duplicates():
+    paragraphs = [_paragraph(1), _paragraph(1), _paragraph(1).replace("reported", "Reported") + " ", _paragraph(2),
+                  _paragraph(3) + " Source: wire."]
+    kept, dropped = dedup_paragraphs(paragraphs + [_paragraph(3) + " Source: wire!"])
+    assert kept == [_paragraph(1), _paragraph(2), _paragraph(3) + " Source: wire."]
+    assert len(dropped) == 3
+
+def test_pack_chunks_respects_budget():
+    paragraphs = [_paragraph(i) for i in range(100)]
+    chunks = pack_chunks(paragraphs, 200)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(c) <= 200 + 5 for c in chunks)
+    assert "\n\n".join(chunks).count("Company") == 100
+
+def test_small_input_uses_single_call():
+    llm = StubLLM()
+    brief, stats = asyncio.run(OSINTMapReduce(llm).run("obj", "short raw data"))
+    assert brief == "- summary 1"
+    assert stats["llm_calls"] == 1
+    assert stats["chunks"] == 1
+
+def test_map_reduce_runs_concurrently_and_merges_hierarchically():
+    llm = StubLLM(delay=0.05)
+    raw = "\n\n".join(_paragraph(i) for i in range(200)) + "\n\n" + "\n\n".join(_paragraph(i) for i in range(50))
+    engine = OSINTMapReduce(llm, chunk_tokens=300, merge_tokens=20, concurrency=4)
+    brief, stats = asyncio.run(engine.run("Track revenue", raw))
+    assert stats["duplicate_paragraphs"] == 50
+    assert stats["tokens_saved_by_dedup"] > 0
+    assert stats["chunks"] > 4
+    assert stats["reduce_levels"] >= 2
+    assert llm.max_in_flight > 1
+    assert set(stats["timings_ms"]) == {"dedup", "map", "reduce", "total"}
+    assert "Merge them, remove repetition" in llm.calls[-1]
+    assert brief == f"- summary {stats['llm_calls']}"
+
+def test_missing_completion_content_fails_clearly():
+    with pytest.raises(EmptyCompletionError):
+        asyncio.run(OSINTMapReduce(lambda system_prompt, user_content: None).run("obj", "short raw data"))
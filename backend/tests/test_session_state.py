@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import pytest
+
+from session_state import (DEFAULT_SESSION, DeltaFormatError, EventLog, Session, SessionStore, TreeVersionMismatch,
+                           diff_nodes, flatten_tree)
+
+NESTED = {"role": "RootWebArea", "name": "Page", "id": 1, "children": [
+    {"role": "link", "name": "Home", "id": 2},
+    {"role": "generic", "children": [{"role": "button", "name": "Go", "id": 4}]},
+]}
+
+
+def test_flatten_nested_tree_assigns_child_ids():
+    nodes, roots = flatten_tree(NESTED)
+    assert roots == [1]
+    assert nodes[1]["child_ids"] == [2, "_1"]
+    assert nodes["_1"]["child_ids"] == [4]
+    assert "children" not in nodes[1]
+
+
+def test_flatten_flat_tree_finds_roots():
+    nodes, roots = flatten_tree({"nodes": [{"id": 1, "child_ids": [2]}, {"id": 2}]})
+    assert list(nodes) == [1, 2]
+    assert roots == [1]
+
+
+def test_diff_nodes():
+    old = {1: {"id": 1, "name": "a"}, 2: {"id": 2, "name": "b"}}
+    new = {1: {"id": 1, "name": "a2"}, 3: {"id": 3, "name": "c"}}
+    added, removed, changed = diff_nodes(old, new)
+    assert [n["id"] for n in added] == [3]
+    assert [n["id"] for n in removed] == [2]
+    assert [n["id"] for n in changed] == [1]
+
+
+def test_delta_reconstructs_tree_and_counts_savings():
+    session = SessionStore("obj").get("tab")
+    session.apply_full_tree(json.dumps(NESTED))
+    assert session.tree_version == 1
+    delta = {"upsert": [{"id": 2, "role": "link", "name": "Home page"}], "remove": [4]}
+    tree = json.loads(session.apply_delta(delta, 1, delta_bytes=len(json.dumps(delta))))
+    by_id = {n["id"]: n for n in tree["nodes"]}
+    assert by_id[2]["name"] == "Home page"
+    assert 4 not in by_id
+    assert session.tree_version == 2
+    assert "~1 changed" in session.describe_changes()
+    assert session.stats()["bytes_saved"] > 0
+
+
+def test_delta_against_wrong_version_raises():
+    session = SessionStore("obj").get("tab")
+    with pytest.raises(TreeVersionMismatch):
+        session.apply_delta({}, 0)  # no tree acknowledged yet
+    session.apply_full_tree(json.dumps(NESTED), version=7)
+    with pytest.raises(TreeVersionMismatch) as info:
+        session.apply_delta({}, 6)
+    assert info.value.server_version == 7
+    assert session.resyncs == 2
+
+
+@pytest.mark.parametrize("delta", [
+    [1],
+    {"remove": [2], "upsert": ["bad"]},
+    {"remove": [["x"]]},
+    {"remove": 2},
+    {"upsert": [{"name": "no id"}]},
+    {"root_ids": [{"id": 1}]},
+])
+def test_malformed_delta_is_rejected_before_any_change(delta):
+    session = SessionStore("obj").get("tab")
+    session.apply_full_tree(json.dumps(NESTED))
+    before = json.loads(session.tree_json())
+    with pytest.raises(DeltaFormatError):
+        session.apply_delta(delta, 1)
+    assert json.loads(session.tree_json()) == before
+    assert session.tree_version == 1
+    assert session.apply_delta({"remove": [2]}, 1) and session.tree_version == 2
+
+
+def test_store_objectives_and_eviction():
+    store = SessionStore("explore", max_sessions=3)
+    store.set_objective("shop", "tab-1")
+    store.get("tab-2")
+    store.set_objective("research")
+    assert store.get("tab-1").objective == "shop"
+    assert store.get("tab-2").objective == "research"
+    store.get("tab-3")
+    assert store.find(DEFAULT_SESSION) is not None
+    assert store.find("tab-1") is None  # least recently used
+    assert len(store.all()) == 3
+
+
+def test_event_log_resume_and_gap():
+    log = EventLog(capacity=4)
+    for i in range(6):
+        log.emit("reasoning", {"message": i})
+    missed, events = log.since(3)
+    assert missed == 0 and [seq for seq, _, _ in events] == [4, 5, 6]
+    missed, events = log.since(0)
+    assert missed == 2 and [seq for seq, _, _ in events] == [3, 4, 5, 6]
+    assert log.since(6) == (0, [])
+    assert len(log.since(99)[1]) == 4  # seq from before a restart: replay the ring
+
+    async def drain(after):
+        return [(seq, event) async for seq, event, _ in log.stream(after, follow=False)]
+
+    assert asyncio.run(drain(0)) == [(2, "gap"), (3, "reasoning"), (4, "reasoning"), (5, "reasoning"), (6, "reasoning")]
+
+
+def test_reasoning_log_is_tail_of_events():
+    session = Session("tab", "objective")
+    for i in range(15):
+        session.log(f"thought {i}")
+    assert session.events.seq == 15
+    assert len(session.reasoning_log) == 10
+    assert session.reasoning_log[-1].endswith("] thought 14")
+
+
+def test_event_log_fans_out_to_hundreds_of_subscribers():
+    log = EventLog(capacity=64)
+    subscribers, events = 500, 40
+
+    async def subscribe():
+        seen = []
+        async for seq, _, data in log.stream(0, keepalive_s=5):
+            seen.append((seq, data["n"]))
+            if seq == events:
+                return seen
+
+    async def run():
+        tasks = [asyncio.ensure_future(subscribe()) for _ in range(subscribers)]
+        await asyncio.sleep(0)
+        for n in range(1, events + 1):
+            log.emit("reasoning", {"n": n})
+            if n % 7 == 0:
+                await asyncio.sleep(0)  # let subscribers drain mid-burst
+        return await asyncio.wait_for(asyncio.gather(*tasks), 10)
+
+    results = asyncio.run(run())
+    expected = [(n, n) for n in range(1, events + 1)]
+    assert all(seen == expected for seen in results)
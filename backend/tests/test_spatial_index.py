@@ -0,0 +1,47 @@
+import json
+
+from a11y_compactor import INTERACTIVE_ROLES
+from a11y_index import A11yIndex
+from spatial_index import ground_bbox
+
+TREE = {"role": "RootWebArea", "name": "Page", "bbox": [0, 0, 1280, 4000], "children": [
+    {"role": "link", "name": "Big card", "bbox": [100, 100, 400, 200]},
+    {"role": "button", "name": "Buy", "bbox": [300, 250, 60, 30]},
+    {"role": "staticText", "name": "Price", "bbox": [600, 100, 100, 20]},
+    {"role": "link", "name": "No box"},
+    {"role": "link", "name": "Footer", "bbox": [20, 3900, 100, 20]},
+    {"role": "link", "name": "Page-wide overlay", "bbox": [0, 0, 1280, 4000]},
+]}
+
+
+def _index():
+    return A11yIndex.build(json.dumps(TREE))
+
+
+def test_node_table_columns():
+    index = _index()
+    assert len(index) == 7
+    assert index.roles[2] == "button" and index.names[2] == "Buy"
+    assert index.bbox(2) == [300, 250, 60, 30]
+    assert index.bbox(4) is None
+    assert list(index.by_role["link"]) == [1, 4, 5, 6]
+
+
+def test_smallest_containing_node_wins():
+    index = _index()
+    order, bbox, status = ground_bbox(index, [320, 255, 10, 10], INTERACTIVE_ROLES)
+    assert (index.names[order], bbox, status) == ("Buy", [300, 250, 60, 30], "inside")
+
+
+def test_near_miss_snaps_and_far_miss_is_ungrounded():
+    index = A11yIndex.build(json.dumps({"role": "RootWebArea", "children": TREE["children"][:5]}))
+    order, bbox, status = ground_bbox(index, [15, 3880, 4, 4], INTERACTIVE_ROLES, max_distance=48)
+    assert (index.names[order], status) == ("Footer", "snapped")
+    assert ground_bbox(index, [900, 2000, 10, 10], INTERACTIVE_ROLES) == (None, None, "ungrounded")
+
+
+def test_oversized_nodes_do_not_fill_the_grid():
+    grid = _index().spatial(INTERACTIVE_ROLES)
+    assert list(grid.oversized) == [6]
+    assert all(6 not in cell for cell in grid.cells.values())
+    assert grid.count == 4
@@ -0,0 +1,71 @@
+import io
+import json
+
+from PIL import Image
+
+from teacher_cache import TeacherCache, TupleClusterer, prompt_key, sketch_similarity, tree_sketch
+
+def _png(color, box=(0, 0, 32, 16)):
+    buf = io.BytesIO()
+    image = Image.new("RGB", (64, 48), (20, 20, 20))
+    image.paste(color, box)
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+def _tree(names):
+    return json.dumps({"role": "RootWebArea", "children": [{"role": "link", "name": name} for name in names]})
+
+def test_cache_persists_completions(tmp_path):
+    path = str(tmp_path / "teacher_cache.db")
+    key = prompt_key("teacher", "system", "prompt")
+    assert key != prompt_key("teacher", None, "prompt")
+    assert key != prompt_key("other", "system", "prompt")
+    cache = TeacherCache(path)
+    assert cache.get(key) is None
+    cache.put(key, "teacher", "completion")
+    cache.close()
+
+    cache = TeacherCache(path)
+    assert cache.get(key) == "completion"
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 0, "hit_rate": 1.0}
+    cache.close()
+
+def test_tree_sketch_estimates_similarity():
+    base = [f"Result number {n} about the target" for n in range(200)]
+    same = tree_sketch(_tree(base))
+    assert sketch_similarity(same, tree_sketch(_tree(base))) == 1.0
+    assert sketch_similarity(same, tree_sketch(_tree(base[:-2] + ["Ad", "Footer"]))) > 0.9
+    assert sketch_similarity(same, tree_sketch(_tree([f"Unrelated page {n}" for n in range(200)]))) < 0.1
+
+def test_clusterer_groups_on_actions_tree_and_screenshot():
+    images = {"red": _png((220, 30, 30)), "red2": _png((215, 30, 30)), "white": None, "moved": _png((220, 30, 30), (32, 24, 64, 48))}
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return images[key]
+
+    clusterer = TupleClusterer()
+    tree = _tree([f"Result {n}" for n in range(40)])
+    assign = lambda row_id, tree, bad, good, key: clusterer.assign(row_id, tree, bad, good, key, lambda: load(key))
+
+    first, is_new = assign(1, tree, "bad", "good", "red")
+    assert is_new and first.representative_id == 1
+    assert assign(2, tree, "bad", "good", "red") == (first, False)
+    # A re-rendered screenshot is still within the dHash distance.
+    assert assign(3, tree, "bad", "good", "red2") == (first, False)
+    assert assign(4, tree, "bad", "other", "red")[1]
+    assert assign(5, _tree([f"Other {n}" for n in range(40)]), "bad", "good", "red")[1]
+    assert assign(6, tree, "bad", "good", "moved")[1]
+    # Undecodable or missing screenshots only match the same frame.
+    assert assign(7, tree, "bad", "good", "white")[1]
+    assert assign(8, tree, "bad", "good", "white")[0].representative_id == 7
+    assert loads == ["red", "red2", "moved", "white"]
+    assert (clusterer.clusters, clusterer.duplicates) == (5, 3)
+
+def test_clusterer_bounds_remembered_clusters():
+    clusterer = TupleClusterer(max_clusters=2)
+    for row_id in range(3):
+        clusterer.assign(row_id, "tree", "bad", f"good-{row_id}", None, lambda: None)
+    assert clusterer.assign(3, "tree", "bad", "good-0", None, lambda: None)[1]
+    assert not clusterer.assign(4, "tree", "bad", "good-2", None, lambda: None)[1]
@@ -0,0 +1,226 @@
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import time
+import io
+from types import SimpleNamespace
+import pytest
+from PIL import Image
+
+openai = pytest.importorskip("openai")
+
+import rlhf_store
+import teacher_worker
+import training_shards
+from fake_openai_server import FakeOpenAIServer
+from teacher_cache import TeacherCache
+
+@pytest.fixture
+def teacher_env(tmp_path):
+    db_path = str(tmp_path / "rlhf.db")
+    jsonl_path = str(tmp_path / "dataset.jsonl")
+    conn = rlhf_store.connect(db_path)
+    rlhf_store.init_schema(conn)
+    cursor = conn.cursor()
+    for i in range(20):
+        digest = rlhf_store.store_frame(cursor, f"frame-{i % 4}".encode())
+        cursor.execute("INSERT INTO tuples (timestamp, image_hash, a11y_tree, bad_action, good_action) VALUES (?, ?, ?, ?, ?)",
+                       (str(i), digest, f"tree-{i}", "bad", f"good-{i}"))
+    conn.commit()
+    conn.close()
+    return db_path, jsonl_path
+
+def _read_lines(jsonl_path):
+    with open(jsonl_path) as f:
+        return [json.loads(line) for line in f]
+
+def _teacher(server):
+    return openai.AsyncOpenAI(api_key="EMPTY", base_url=server.base_url, max_retries=0)
+
+def test_pipeline_runs_requests_concurrently(teacher_env):
+    db_path, jsonl_path = teacher_env
+    latency = 0.2
+    with FakeOpenAIServer(latency_s=latency) as server:
+        start = time.perf_counter()
+        stats = asyncio.run(teacher_worker.process_rlhf_tuples_async(db_path, jsonl_path, _teacher(server), concurrency=10, rps=0))
+        elapsed = time.perf_counter() - start
+        assert server.app.state.max_in_flight > 1
+    assert stats == {"processed": 20, "failed": 0, "teacher_calls": 20, "cache_hits": 0, "cluster_reuses": 0}
+    assert elapsed < 20 * latency / 2
+    lines = _read_lines(jsonl_path)
+    assert sorted(l["messages"][1]["content"].split("\n")[1] for l in lines) == sorted(f"good-{i}" for i in range(20))
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM tuples WHERE processed = 0").fetchone()[0] == 0
+    conn.close()
+
+def test_pipeline_retries_failed_calls(teacher_env):
+    db_path, jsonl_path = teacher_env
+    with FakeOpenAIServer(fail_every=3) as server:
+        stats = asyncio.run(teacher_worker.process_rlhf_tuples_async(db_path, jsonl_path, _teacher(server), concurrency=4, rps=0))
+    assert stats == {"processed": 20, "failed": 0, "teacher_calls": 20, "cache_hits": 0, "cluster_reuses": 0}
+    assert len(_read_lines(jsonl_path)) == 20
+
+def test_empty_teacher_completion_fails_without_retrying():
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=None))])
+
+    teacher = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    with pytest.raises(teacher_worker.EmptyCompletionError, match="no content"):
+        asyncio.run(teacher_worker.call_teacher(teacher, "prompt", teacher_worker.TokenBucket(0), max_retries=3))
+    assert len(calls) == 1
+
+def test_pipeline_resumes_interrupted_batch_without_duplicates(teacher_env):
+    db_path, jsonl_path = teacher_env
+    # Simulate a crash after lines were appended but before processed was committed.
+    with open(jsonl_path, "w") as f:
+        f.write(json.dumps({"messages": []}) + "\n")
+    offset = os.path.getsize(jsonl_path)
+    with open(jsonl_path, "a") as f:
+        f.write(json.dumps({"messages": [], "partial": True}) + "\n")
+    with open(jsonl_path + ".pending", "w") as f:
+        json.dump({"offset": offset, "ids": [1, 2]}, f)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE tuples SET processed = 1 WHERE id IN (1, 2)")
+    conn.commit()
+    conn.close()
+
+    with FakeOpenAIServer() as server:
+        stats = asyncio.run(teacher_worker.process_rlhf_tuples_async(db_path, jsonl_path, _teacher(server), concurrency=4, rps=0))
+    assert stats["processed"] == 20
+    lines = _read_lines(jsonl_path)
+    assert len(lines) == 21
+    assert not any(l.get("partial") for l in lines)
+    assert not os.path.exists(jsonl_path + ".pending")
+
+def _png(color, size=(64, 48)):
+    buf = io.BytesIO()
+    image = Image.new("RGB", size, color)
+    image.paste((255, 255, 255), (0, 0, size[0] // 2, size[1] // 3))
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+def test_near_duplicate_tuples_share_one_teacher_call(tmp_path):
+    db_path = str(tmp_path / "rlhf.db")
+    jsonl_path = str(tmp_path / "dataset.jsonl")
+    tree = json.dumps({"role": "RootWebArea", "children": [{"role": "link", "name": f"Result {n}"} for n in range(40)]})
+    conn = rlhf_store.connect(db_path)
+    rlhf_store.init_schema(conn)
+    cursor = conn.cursor()
+    for i in range(12):
+        # Three distinct corrections, each repeated four times on the same page
+        # (two of the repeats on a screenshot re-rendered a shade darker).
+        digest = rlhf_store.store_frame(cursor, _png((200 - i % 2, 40, 40)))
+        cursor.execute("INSERT INTO tuples (timestamp, image_hash, a11y_tree, bad_action, good_action) VALUES (?, ?, ?, ?, ?)",
+                       (str(i), digest, tree, "bad", f"good-{i % 3}"))
+    conn.commit()
+    conn.close()
+
+    cache = TeacherCache(str(tmp_path / "teacher_cache.db"))
+    with FakeOpenAIServer(latency_s=0.05) as server:
+        stats = asyncio.run(teacher_worker.process_rlhf_tuples_async(db_path, jsonl_path, _teacher(server),
+                                                                    concurrency=4, rps=0, cache=cache))
+        assert server.app.state.calls == 3
+    assert stats == {"processed": 12, "failed": 0, "teacher_calls": 3, "cache_hits": 0, "cluster_reuses": 9}
+    lines = _read_lines(jsonl_path)
+    assert sorted(l["messages"][1]["content"].split("\n")[1] for l in lines) == sorted(f"good-{i % 3}" for i in range(12))
+
+    # A rerun of the same tuples is answered from the persistent cache.
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE tuples SET processed = 0")
+    conn.commit()
+    conn.close()
+    with FakeOpenAIServer() as server:
+        stats = asyncio.run(teacher_worker.process_rlhf_tuples_async(db_path, jsonl_path, _teacher(server),
+                                                                    concurrency=4, rps=0, cache=cache, cluster=False))
+        assert server.app.state.calls == 0
+    cache.close()
+    assert stats == {"processed": 12, "failed": 0, "teacher_calls": 0, "cache_hits": 12, "cluster_reuses": 0}
+    assert "12 avoided" in teacher_worker.format_stats(stats)
+
+def test_token_bucket_limits_rate():
+    async def run():
+        bucket = teacher_worker.TokenBucket(rate=20, capacity=1)
+        start = time.perf_counter()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) >= 4 / 20 * 0.9
+
+def test_training_line_embeds_stored_frame():
+    line = teacher_worker.build_training_line(b"jpeg", "tree", "cot", "good")
+    assert line["messages"][0]["content"][0]["image_url"]["url"] == "data:image/jpeg;base64," + base64.b64encode(b"jpeg").decode()
+    assert line["messages"][1]["content"] == "<think>cot</think>\ngood"
+
+def _free_udp_port():
+    import socket
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_worker_wakes_on_notification(teacher_env, monkeypatch, tmp_path):
+    db_path, jsonl_path = teacher_env
+    port = _free_udp_port()
+
+    async def run(server):
+        monkeypatch.setattr(teacher_worker, "client", _teacher(server))
+        monkeypatch.setattr(teacher_worker, "TEACHER_CACHE_PATH", str(tmp_path / "teacher_cache.db"))
+        worker = asyncio.create_task(teacher_worker.run_worker(db_path, jsonl_path, port, check_interval_s=30))
+        while not os.path.exists(jsonl_path) or len(_read_lines(jsonl_path)) < 20:
+            await asyncio.sleep(0.05)
+
+        conn = rlhf_store.connect(db_path)
+        digest = rlhf_store.store_frame(conn.cursor(), b"new-frame")
+        conn.execute("INSERT INTO tuples (timestamp, image_hash, a11y_tree, bad_action, good_action) VALUES ('t', ?, 'tree', 'bad', 'late')", (digest,))
+        conn.commit()
+        conn.close()
+        start = time.perf_counter()
+        rlhf_store.notify_teacher(port)
+        while len(_read_lines(jsonl_path)) < 21:
+            await asyncio.sleep(0.05)
+        latency = time.perf_counter() - start
+        worker.cancel()
+        return latency
+
+    with FakeOpenAIServer() as server:
+        latency = asyncio.run(run(server))
+    # Well under the 30 s fallback check interval.
+    assert latency < 2
+
+def test_processed_index_is_used(teacher_env):
+    db_path, _ = teacher_env
+    conn = sqlite3.connect(db_path)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM tuples WHERE processed = 0 AND id > 0 ORDER BY id LIMIT 10").fetchall()
+    conn.close()
+    assert any("idx_tuples_processed" in row[-1] for row in plan)
+
+def test_pipeline_writes_sharded_dataset_and_resumes(teacher_env, tmp_path):
+    db_path, _ = teacher_env
+    dataset_dir = str(tmp_path / "training_dataset")
+    # A crash after a committed batch but before its tuples were marked processed.
+    writer = training_shards.ShardWriter(dataset_dir)
+    writer.append({"messages": [], "partial": True})
+    writer.commit()
+    writer.close()
+    with open(dataset_dir + ".pending", "w") as f:
+        json.dump({"records": 0, "ids": [1, 2]}, f)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE tuples SET processed = 1 WHERE id IN (1, 2)")
+    conn.commit()
+    conn.close()
+
+    with FakeOpenAIServer() as server:
+        stats = asyncio.run(teacher_worker.process_rlhf_tuples_async(db_path, dataset_dir, _teacher(server), concurrency=4, rps=0))
+    assert stats == {"processed": 20, "failed": 0, "teacher_calls": 20, "cache_hits": 0, "cluster_reuses": 0}
+    assert not os.path.exists(dataset_dir + ".pending")
+    with training_shards.ShardedDataset(dataset_dir) as dataset:
+        assert len(dataset) == 20
+        assert not any(record.get("partial") for record in dataset)
+        assert dataset.index["images"] == 4
+        line = dataset.training_line(0)
+        assert line["messages"][0]["content"][0]["image_url"]["url"].startswith("data:image/jpeg;base64,")
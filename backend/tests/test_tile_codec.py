@@ -0,0 +1,52 @@
+import struct
+
+import pytest
+from PIL import Image, ImageDraw
+
+from frame_codec import FrameFormatError
+from tile_codec import apply_tile_delta, changed_tiles, decode_tile_delta, encode_tile_delta, is_tile_delta
+
+
+def _frames():
+    before = Image.new("RGB", (200, 130), "white")
+    after = before.copy()
+    ImageDraw.Draw(after).rectangle([70, 70, 80, 75], fill="black")  # a spinner-sized change
+    return before, after
+
+
+def test_changed_tiles_finds_only_the_touched_cells():
+    before, after = _frames()
+    assert changed_tiles(before, before) == []
+    assert changed_tiles(before, after, tile_size=64) == [(1, 1)]
+
+
+def test_tile_delta_round_trip_rebuilds_frame():
+    before, after = _frames()
+    cells = changed_tiles(before, after, tile_size=64)
+    payload = encode_tile_delta(3, after, cells, tile_size=64, format="PNG")
+    assert is_tile_delta(payload)
+    delta = decode_tile_delta(payload)
+    assert delta.base_version == 3
+    assert delta.changed_fraction() == pytest.approx(64 * 64 / (200 * 130))
+    frame = before.copy()
+    assert apply_tile_delta(frame, delta) is frame
+    assert frame.tobytes() == after.tobytes()
+
+
+def test_edge_tiles_are_cropped():
+    before, after = _frames()
+    ImageDraw.Draw(after).point((199, 129), fill="red")
+    delta = decode_tile_delta(encode_tile_delta(1, after, changed_tiles(before, after, 64), 64, format="PNG"))
+    frame = apply_tile_delta(before.copy(), delta)
+    assert frame.getpixel((199, 129)) == (255, 0, 0)
+
+
+def test_malformed_deltas_are_rejected():
+    before, after = _frames()
+    payload = encode_tile_delta(1, after, [(1, 1)], 64, format="PNG")
+    with pytest.raises(FrameFormatError):
+        decode_tile_delta(payload[:-10])
+    with pytest.raises(FrameFormatError):
+        decode_tile_delta(b"SCT1" + struct.pack("!IHHHH", 1, 200, 130, 64, 1) + struct.pack("!HHI", 9, 0, 0))
+    with pytest.raises(FrameFormatError):
+        apply_tile_delta(Image.new("RGB", (10, 10)), decode_tile_delta(payload))
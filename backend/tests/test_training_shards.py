@@ -0,0 +1,98 @@
+import base64
+import json
+import os
+
+import pytest
+
+import training_shards
+from teacher_worker import build_training_line
+from training_shards import ShardWriter, ShardedDataset, convert_jsonl
+
+
+def _write(path, n, max_shard_bytes=300, images=3):
+    writer = ShardWriter(str(path), max_shard_bytes)
+    for i in range(n):
+        digest = writer.put_image(f"frame-{i % images}".encode())
+        writer.append({"i": i, "image": digest})
+    writer.commit()
+    writer.close()
+    return writer
+
+
+def test_shards_roll_and_images_are_deduplicated(tmp_path):
+    _write(tmp_path, 40)
+    index = training_shards.read_index(str(tmp_path))
+    assert index["records"] == 40 and index["images"] == 3
+    assert len(index["shards"]) > 1
+    assert all(s["bytes"] <= 300 for s in index["shards"])
+    assert sum(len(files) for _, _, files in os.walk(tmp_path / "images")) == 3
+    with ShardedDataset(str(tmp_path)) as dataset:
+        assert len(dataset) == 40
+        assert [dataset[i]["i"] for i in range(40)] == list(range(40))
+        assert dataset.image(dataset[4]["image"]) == b"frame-1"
+        with pytest.raises(IndexError):
+            dataset.raw(40)
+
+
+def test_shuffled_epochs_cover_every_record_once(tmp_path):
+    _write(tmp_path, 50)
+    with ShardedDataset(str(tmp_path)) as dataset:
+        first = dataset.indices(shuffle=True, seed=7, epoch=0)
+        assert sorted(first) == list(range(50)) and first != list(range(50))
+        assert dataset.indices(shuffle=True, seed=7, epoch=0) == first
+        assert dataset.indices(shuffle=True, seed=7, epoch=1) != first
+        ranks = [dataset.indices(shuffle=True, seed=7, rank=r, world_size=3) for r in range(3)]
+        assert sorted(i for rank in ranks for i in rank) == list(range(50))
+        pairs = list(dataset.iterate(shuffle=True, with_images=True))
+        assert all(image == f"frame-{record['i'] % 3}".encode() for record, image in pairs)
+
+
+def test_uncommitted_appends_are_dropped_and_rollback_truncates(tmp_path):
+    _write(tmp_path, 10)
+    writer = ShardWriter(str(tmp_path), 300)
+    for i in range(10, 30):
+        writer.append({"i": i})
+    writer.close()  # no commit: a crash mid-batch
+    writer = ShardWriter(str(tmp_path), 300)
+    assert writer.records == 10
+    writer.rollback(4)
+    writer.append({"i": "after"})
+    writer.commit()
+    writer.close()
+    with ShardedDataset(str(tmp_path)) as dataset:
+        assert [dataset[i]["i"] for i in range(len(dataset))] == [0, 1, 2, 3, "after"]
+
+
+def test_convert_jsonl_round_trips_training_lines(tmp_path):
+    jsonl_path = tmp_path / "training_dataset.jsonl"
+    lines = [build_training_line(f"jpeg-{i % 2}".encode(), f"tree-{i}", "cot", f"good-{i}") for i in range(6)]
+    jsonl_path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    stats = convert_jsonl(str(jsonl_path), str(tmp_path / "shards"))
+    assert stats["records"] == 6 and stats["images"] == 2
+    with ShardedDataset(str(tmp_path / "shards")) as dataset:
+        record = dataset[0]
+        assert record["messages"][0]["content"][0]["image_url"]["url"] == "image:" + record["image"]
+        assert [dataset.training_line(i) for i in range(6)] == lines
+        assert training_shards.inline_image(dataset.training_line(1)) == b"jpeg-1"
+    with pytest.raises(ValueError):
+        convert_jsonl(str(jsonl_path), str(tmp_path / "shards"))
+
+
+def test_legacy_jsonl_is_migrated_once_into_an_unused_dataset(tmp_path, capsys):
+    dataset = str(tmp_path / "training_dataset")
+    legacy = tmp_path / "training_dataset.jsonl"
+    lines = [build_training_line(f"jpeg-{i % 2}".encode(), f"tree-{i}", "cot", f"good-{i}") for i in range(4)]
+    legacy.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    ShardWriter(dataset).close()  # a fresh, empty dataset started before the conversion
+    assert training_shards.migrate_legacy_jsonl(dataset)["records"] == 4
+    assert not legacy.exists() and (tmp_path / "training_dataset.jsonl.converted").exists()
+    assert not os.path.exists(dataset + ".converting")
+    with ShardedDataset(dataset) as converted:
+        assert [converted.training_line(i) for i in range(4)] == lines
+    assert training_shards.migrate_legacy_jsonl(dataset) is None
+
+    # A dataset that already holds records is left alone, with a warning.
+    legacy.write_text(json.dumps(lines[0]) + "\n")
+    assert training_shards.migrate_legacy_jsonl(dataset) is None
+    assert "was not converted" in capsys.readouterr().out
+    assert training_shards.read_index(dataset)["records"] == 4
@@ -3,8 +3,12 @@ from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 import os
 import sqlite3
+import json
 import base64
 import io
+import time
+import asyncio
+import httpx
 from PIL import Image
 
 # 1. Mock heavy libraries AND OpenAI class
@@ -20,8 +24,23 @@ with patch.dict('sys.modules', {
 }):
     import vlm_server
 
+from frame_codec import encode_frame, FRAME_CONTENT_TYPE
+from engine_manager import Engine
+
 client = TestClient(vlm_server.app)
 
+def _use_engine(kind, llm=None):
+    vlm_server.engines.active = Engine(kind, llm=llm)
+    vlm_server.action_cache.invalidate()
+
+@pytest.fixture(autouse=True)
+def teacher_cache_path(tmp_path):
+    old_path = vlm_server.TEACHER_CACHE_PATH
+    vlm_server.TEACHER_CACHE_PATH = str(tmp_path / "teacher_cache.db")
+    yield vlm_server.TEACHER_CACHE_PATH
+    vlm_server.close_teacher_cache()
+    vlm_server.TEACHER_CACHE_PATH = old_path
+
 @pytest.fixture
 def test_db():
     db_name = "test_rlhf.db"
@@ -35,6 +54,7 @@ def test_db():
     old_db = vlm_server.DB_PATH
     vlm_server.DB_PATH = db_name
     yield db_name
+    vlm_server.close_rlhf_writer()
     vlm_server.DB_PATH = old_db
     if os.path.exists(db_name):
         os.remove(db_name)
@@ -44,32 +64,590 @@ def test_vlm_act_endpoint(test_db):
     buf = io.BytesIO()
     img.save(buf, format='PNG')
     img_b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    payload = {"image_base64": img_b64, "a11y_tree": "{}"}
-    vlm_server.model_engine = "vllm"
-    vlm_server.llm = MagicMock()
+    payload = {"image_base64": img_b64, "a11y_tree": '{"role": "RootWebArea", "name": "Results", "children": []}'}
+    llm = MagicMock()
     mock_output = MagicMock()
     mock_output.outputs = [MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')]
-    vlm_server.llm.generate.return_value = [mock_output]
+    llm.generate.return_value = [mock_output]
+    _use_engine("vllm", llm)
     response = client.post("/vlm/act", json=payload)
     assert response.status_code == 200
     assert response.json()["action"] == "click"
-    vlm_server.model_engine = None
+    _use_engine("mock")
 
 def test_rlhf_log_endpoint(test_db):
-    payload = {"timestamp": "123", "state_image_base64": "img", "state_a11y_tree": "tree", "vlm_bad_action": "bad", "human_good_action": "good"}
+    img_b64 = base64.b64encode(b"jpeg-bytes").decode("ascii")
+    payload = {"timestamp": "123", "state_image_base64": img_b64, "state_a11y_tree": "tree", "vlm_bad_action": "bad", "human_good_action": "good"}
     response = client.post("/vlm/rlhf_log", json=payload)
     assert response.status_code == 200
     conn = sqlite3.connect(test_db)
     assert conn.execute("SELECT good_action FROM tuples").fetchone()[0] == "good"
     conn.close()
 
+def test_rlhf_log_stores_each_screenshot_once(test_db):
+    img_b64 = base64.b64encode(b"same-frame").decode("ascii")
+    for good in ("a", "b", "c"):
+        payload = {"timestamp": "1", "state_image_base64": img_b64, "state_a11y_tree": "tree", "vlm_bad_action": "bad", "human_good_action": good}
+        assert client.post("/vlm/rlhf_log", json=payload).status_code == 200
+    conn = sqlite3.connect(test_db)
+    assert conn.execute("SELECT COUNT(*) FROM frames").fetchone()[0] == 1
+    hashes = {r[0] for r in conn.execute("SELECT image_hash FROM tuples")}
+    assert len(hashes) == 1
+    assert conn.execute("SELECT COUNT(*) FROM tuples WHERE image_base64 IS NOT NULL").fetchone()[0] == 0
+    conn.close()
+
+def test_rlhf_log_rejects_invalid_base64(test_db):
+    payload = {"timestamp": "1", "state_image_base64": "not base64!", "state_a11y_tree": "tree", "vlm_bad_action": "bad", "human_good_action": "good"}
+    assert client.post("/vlm/rlhf_log", json=payload).status_code == 400
+
+def test_migrate_inline_images(test_db):
+    conn = sqlite3.connect(test_db)
+    frame = base64.b64encode(b"legacy-frame").decode("ascii")
+    for _ in range(3):
+        conn.execute("INSERT INTO tuples (timestamp, image_base64, a11y_tree, bad_action, good_action) VALUES ('t', ?, 'tree', 'bad', 'good')", (frame,))
+    conn.commit()
+    vlm_server.rlhf_store.init_schema(conn)
+    assert vlm_server.rlhf_store.migrate_inline_images(conn) == 3
+    assert conn.execute("SELECT COUNT(*) FROM frames").fetchone()[0] == 1
+    image_hash, inline = conn.execute("SELECT image_hash, image_base64 FROM tuples").fetchone()
+    assert inline is None
+    assert vlm_server.rlhf_store.load_frame(conn, image_hash) == b"legacy-frame"
+    conn.close()
+
 def test_osint_analyze_endpoint():
     payload = {"objective": "obj", "raw_data": "raw"}
     mock_resp = MagicMock()
     mock_resp.choices = [MagicMock(message=MagicMock(content="Brief Content"))]
-    vlm_server.client.chat.completions.create.return_value = mock_resp
-    response = client.post("/osint/analyze", json=payload)
+    with patch.object(vlm_server.client.chat.completions, "create", return_value=mock_resp):
+        with TestClient(vlm_server.app) as c:
+            response = c.post("/osint/analyze", json=payload)
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+            events = c.get(f"/osint/jobs/{job_id}/events").text
+            assert "event: status" in events and '"succeeded"' in events
+            job = c.get(f"/osint/jobs/{job_id}").json()
+            assert job["status"] == "succeeded"
+            assert "report_path" in job
+            assert c.get(f"/osint/jobs/{job_id}/report").text == "Brief Content"
+        if os.path.exists(job["report_path"]):
+            os.remove(job["report_path"])
+
+def test_osint_analyze_reuses_cached_completions():
+    payload = {"objective": "cached obj", "raw_data": "cached raw"}
+    mock_resp = MagicMock()
+    mock_resp.choices = [MagicMock(message=MagicMock(content="Cached Brief"))]
+    with patch.object(vlm_server.client.chat.completions, "create", return_value=mock_resp) as create:
+        with TestClient(vlm_server.app) as c:
+            reports = []
+            for _ in range(2):
+                job_id = c.post("/osint/analyze", json=payload).json()["job_id"]
+                c.get(f"/osint/jobs/{job_id}/events")
+                job = c.get(f"/osint/jobs/{job_id}").json()
+                assert job["status"] == "succeeded"
+                assert c.get(f"/osint/jobs/{job_id}/report").text == "Cached Brief"
+                reports.append(job["report_path"])
+    assert create.call_count == 1
+    assert vlm_server.get_teacher_cache().stats()["hits"] == 1
+    for report_path in reports:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+
+def test_osint_job_fails_when_completion_has_no_content():
+    mock_resp = MagicMock()
+    mock_resp.choices = [MagicMock(message=MagicMock(content=None))]
+    with patch.object(vlm_server.client.chat.completions, "create", return_value=mock_resp):
+        with TestClient(vlm_server.app) as c:
+            job_id = c.post("/osint/analyze", json={"objective": "filtered", "raw_data": "filtered raw"}).json()["job_id"]
+            c.get(f"/osint/jobs/{job_id}/events")
+            job = c.get(f"/osint/jobs/{job_id}").json()
+    assert job["status"] == "failed" and "no content" in job["error"]
+
+def test_osint_unknown_job_returns_404():
+    assert client.get("/osint/jobs/nope").status_code == 404
+
+def test_vlm_act_latency_flat_during_osint_job():
+    def slow_completion(**kwargs):
+        time.sleep(1.0)
+        return MagicMock(choices=[MagicMock(message=MagicMock(content="Slow Brief"))])
+
+    payload = {"image_base64": _png_b64(), "a11y_tree": '{"role": "RootWebArea", "name": "Results", "children": []}'}
+    _use_engine("mock")
+
+    async def run():
+        transport = httpx.ASGITransport(app=vlm_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            job_id = (await ac.post("/osint/analyze", json={"objective": "obj", "raw_data": "raw"})).json()["job_id"]
+            await asyncio.sleep(0.1)
+            latencies = []
+            for _ in range(10):
+                start = time.perf_counter()
+                assert (await ac.post("/vlm/act", json=payload)).status_code == 200
+                latencies.append(time.perf_counter() - start)
+            running = (await ac.get(f"/osint/jobs/{job_id}")).json()["status"]
+            events = (await ac.get(f"/osint/jobs/{job_id}/events")).text
+            return latencies, running, events, (await ac.get(f"/osint/jobs/{job_id}")).json()
+
+    with patch.object(vlm_server.client.chat.completions, "create", side_effect=slow_completion):
+        latencies, running, events, job = asyncio.run(run())
+    _use_engine("mock")
+    assert running == "running"
+    assert max(latencies) < 0.25
+    assert job["status"] == "succeeded"
+    if os.path.exists(job["report_path"]):
+        os.remove(job["report_path"])
+
+def _png_b64(size=(1, 1)):
+    img = Image.new('RGB', size, color='black')
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
+
+class SlowLLM:
+    def __init__(self, delay):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def generate(self, batch, sampling_params):
+        time.sleep(self.delay)
+        self.batch_sizes.append(len(batch))
+        return [MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')]) for _ in batch]
+
+def test_vlm_act_concurrent_requests_share_one_batch():
+    n, delay = 8, 0.3
+    payload = {"image_base64": _png_b64(), "a11y_tree": '{"role": "RootWebArea", "name": "Results", "children": []}'}
+    llm = SlowLLM(delay)
+    _use_engine("vllm", llm)
+
+    async def run():
+        transport = httpx.ASGITransport(app=vlm_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[ac.post("/vlm/act", json=payload) for _ in range(n)])
+            return responses, time.perf_counter() - start
+
+    try:
+        responses, elapsed = asyncio.run(run())
+        assert all(r.status_code == 200 and r.json()["action"] == "click" for r in responses)
+        assert sum(llm.batch_sizes) == n
+        assert max(llm.batch_sizes) > 1
+        # Serial execution would take n * delay; batching keeps it near one batch.
+        assert elapsed < 3 * delay
+    finally:
+        _use_engine("mock")
+
+def test_vlm_act_returns_503_when_queue_full():
+    payload = {"image_base64": _png_b64(), "a11y_tree": '{"role": "RootWebArea", "name": "Results", "children": []}'}
+    _use_engine("vllm", MagicMock())
+    with patch.object(vlm_server.scheduler, "submit", side_effect=vlm_server.QueueFullError("full")):
+        response = client.post("/vlm/act", json=payload)
+    _use_engine("mock")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+def test_vlm_act_binary_endpoint():
+    img = Image.new('RGB', (4, 4), color='white')
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG')
+    body = encode_frame('{"role": "RootWebArea", "name": "Results", "children": []}', buf.getvalue())
+    seen = {}
+
+    def generate(batch, sampling_params):
+        seen["size"] = batch[0]["multi_modal_data"]["image"].size
+        return [MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')])]
+
+    llm = MagicMock()
+    llm.generate.side_effect = generate
+    _use_engine("vllm", llm)
+    response = client.post("/vlm/act/binary", content=body, headers={"Content-Type": FRAME_CONTENT_TYPE})
+    _use_engine("mock")
     assert response.status_code == 200
-    assert "report_path" in response.json()
-    if os.path.exists(response.json()["report_path"]):
-        os.remove(response.json()["report_path"])
+    assert response.json()["action"] == "click"
+    assert seen["size"] == (56, 56)  # upscaled to the minimum patch grid
+
+def test_vlm_act_binary_rejects_malformed_frame():
+    response = client.post("/vlm/act/binary", content=b"not a frame")
+    assert response.status_code == 400
+
+def test_reload_is_non_blocking_and_pollable():
+    def loader(kind, model_path, config):
+        time.sleep(0.2)
+        return Engine("mock", model_path)
+
+    _use_engine("mock")
+    with patch.object(vlm_server.engines, "loader", loader), TestClient(vlm_server.app) as c:
+        start = time.perf_counter()
+        response = c.post("/vlm/reload", json={"new_model_path": "models/v2"})
+        assert response.status_code == 202
+        assert time.perf_counter() - start < 0.2
+        assert c.post("/vlm/reload", json={"new_model_path": "models/v3"}).status_code == 409
+        status = c.get("/vlm/reload").json()
+        while status["state"] not in ("succeeded", "failed"):
+            time.sleep(0.02)
+            status = c.get("/vlm/reload").json()
+    assert status["state"] == "succeeded"
+    assert vlm_server.engines.active.model_path == "models/v2"
+
+def test_vlm_act_caches_repeated_observations():
+    payload = {"image_base64": _png_b64(), "a11y_tree": '{"role": "RootWebArea", "name": "Results", "children": []}'}
+    llm = MagicMock()
+    llm.generate.return_value = [MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')])]
+    _use_engine("vllm", llm)
+    before = client.get("/vlm/cache").json()
+    # Key order and whitespace in the tree do not matter.
+    reordered = dict(payload, a11y_tree='{"children": [], "name": "Results",  "role": "RootWebArea"}')
+    for body in (payload, reordered, payload):
+        assert client.post("/vlm/act", json=body).json()["action"] == "click"
+    assert llm.generate.call_count == 1
+    stats = client.get("/vlm/cache").json()
+    assert stats["hits"] - before["hits"] == 2
+    assert stats["misses"] - before["misses"] == 1
+
+    client.post("/vlm/objective", json={"objective": "A different mission"})
+    client.post("/vlm/act", json=payload)
+    assert llm.generate.call_count == 2
+    # Changing the mission does not flush the shared cache; the first mission's entry still answers.
+    client.post("/vlm/objective", json={"objective": "Explore the web and find interesting facts."})
+    client.post("/vlm/act", json=payload)
+    assert llm.generate.call_count == 2
+    _use_engine("mock")
+
+def _capture_prompts(llm, prompts):
+    def generate(batch, sampling_params):
+        prompts.extend(item["prompt"] for item in batch)
+        return [MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')]) for _ in batch]
+    llm.generate.side_effect = generate
+
+def test_vlm_act_accepts_tree_deltas_per_session():
+    tree = {"nodes": [
+        {"id": 1, "role": "RootWebArea", "name": "Results", "child_ids": [2, 3]},
+        {"id": 2, "role": "link", "name": "First result", "bbox": [10, 100, 200, 20]},
+        {"id": 3, "role": "button", "name": "Next page", "bbox": [10, 700, 80, 30]},
+    ]}
+    prompts = []
+    llm = MagicMock()
+    _capture_prompts(llm, prompts)
+    _use_engine("vllm", llm)
+    full = client.post("/vlm/act", json={"image_base64": _png_b64(), "session_id": "tab-7", "tree_version": 1,
+                                         "a11y_tree": json.dumps(tree)})
+    assert full.status_code == 200
+    assert full.headers["x-tree-version"] == "1"
+
+    delta = {"upsert": [{"id": 1, "role": "RootWebArea", "name": "Results", "child_ids": [2, 4]},
+                        {"id": 4, "role": "link", "name": "Second result", "bbox": [10, 140, 200, 20]}],
+             "remove": [3]}
+    step = client.post("/vlm/act", json={"image_base64": _png_b64(), "session_id": "tab-7", "tree_version": 2,
+                                         "base_version": 1, "a11y_delta": delta})
+    _use_engine("mock")
+    assert step.status_code == 200
+    assert step.headers["x-tree-version"] == "2"
+    assert '"Second result"' in prompts[-1]
+    assert "Changes since previous step: +1 added, -1 removed" in prompts[-1]
+    assert '"Next page"' not in prompts[-1].split("Changes since")[0]
+
+    stats = client.get("/vlm/sessions/tab-7").json()
+    assert stats["tree_version"] == 2
+    assert stats["delta_steps"] == 1
+    assert stats["bytes_saved"] > 0
+    assert client.get("/vlm/status", params={"session_id": "tab-7"}).json()["session"]["steps"] == 2
+
+def test_vlm_act_delta_against_stale_version_requests_resync():
+    tree = '{"role": "RootWebArea", "name": "Results", "id": 1, "children": []}'
+    client.post("/vlm/act", json={"image_base64": _png_b64(), "session_id": "tab-8", "a11y_tree": tree})
+    response = client.post("/vlm/act", json={"image_base64": _png_b64(), "session_id": "tab-8",
+                                             "base_version": 5, "a11y_delta": {"remove": [1]}})
+    assert response.status_code == 409
+    detail = response.json()["detail"]
+    assert detail["resync"] is True
+    assert detail["server_version"] == 1
+    assert client.get("/vlm/sessions/tab-8").json()["resyncs"] == 1
+    assert client.get("/vlm/sessions/unknown-tab").status_code == 404
+
+def test_vlm_act_binary_delta_frame():
+    tree = {"nodes": [{"id": 1, "role": "RootWebArea", "name": "Results page", "child_ids": [2]},
+                      {"id": 2, "role": "link", "name": "First result"}]}
+    headers = {"Content-Type": FRAME_CONTENT_TYPE, "X-Session-Id": "tab-9"}
+    image = base64.b64decode(_png_b64())
+    first = client.post("/vlm/act/binary", content=encode_frame(json.dumps(tree), image), headers=headers)
+    assert first.headers["x-tree-version"] == "1"
+    delta = encode_frame(json.dumps({"upsert": [{"id": 2, "role": "link", "name": "Renamed result"}]}), image)
+    second = client.post("/vlm/act/binary", content=delta, headers={**headers, "X-Base-Version": "1"})
+    assert second.status_code == 200
+    assert second.headers["x-tree-version"] == "2"
+    for bad in ("[1]", '{"remove": [2], "upsert": ["bad"]}', '{"remove": [["x"]]}'):
+        rejected = client.post("/vlm/act/binary", content=encode_frame(bad, image), headers={**headers, "X-Base-Version": "2"})
+        assert rejected.status_code == 400
+    third = client.post("/vlm/act/binary", content=delta, headers={**headers, "X-Base-Version": "2"})
+    assert third.status_code == 200 and third.headers["x-tree-version"] == "3"
+
+def test_objective_can_be_set_per_session():
+    client.post("/vlm/objective", json={"objective": "Compare laptop prices", "session_id": "tab-10"})
+    assert client.get("/vlm/status", params={"session_id": "tab-10"}).json()["objective"] == "Compare laptop prices"
+    assert client.get("/vlm/status").json()["objective"] == "Explore the web and find interesting facts."
+
+def test_vlm_act_binary_tile_deltas_skip_unchanged_frames():
+    from tile_codec import changed_tiles, encode_tile_delta
+    from PIL import ImageDraw
+    tree = '{"role": "RootWebArea", "name": "Results page", "id": 1, "children": []}'
+    base = Image.new("RGB", (640, 400), "white")
+    buf = io.BytesIO()
+    base.save(buf, format="PNG")
+    headers = {"Content-Type": FRAME_CONTENT_TYPE, "X-Session-Id": "tab-tiles"}
+    seen = []
+    llm = MagicMock()
+
+    def generate(batch, sampling_params):
+        seen.extend(item["multi_modal_data"]["image"].getpixel((300, 200)) for item in batch)
+        return [MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')]) for _ in batch]
+
+    llm.generate.side_effect = generate
+    _use_engine("vllm", llm)
+    first = client.post("/vlm/act/binary", content=encode_frame(tree, buf.getvalue()), headers=headers)
+    assert first.headers["x-frame-version"] == "1"
+
+    spinner = base.copy()
+    ImageDraw.Draw(spinner).rectangle([10, 10, 14, 14], fill="black")
+    tiny = encode_tile_delta(1, spinner, changed_tiles(base, spinner, 32), 32, format="PNG")
+    skipped = client.post("/vlm/act/binary", content=encode_frame(tree, tiny), headers=headers)
+    assert skipped.json()["skipped"] is True
+    assert skipped.headers["x-frame-version"] == "2"
+    assert llm.generate.call_count == 1
+
+    dialog = spinner.copy()
+    ImageDraw.Draw(dialog).rectangle([200, 100, 440, 300], fill=(255, 0, 0))
+    big = encode_tile_delta(2, dialog, changed_tiles(spinner, dialog, 32), 32, format="PNG")
+    updated = client.post("/vlm/act/binary", content=encode_frame(tree, big), headers=headers)
+    assert updated.json()["action"] == "click"
+    assert "skipped" not in updated.json()
+    assert seen[-1] == (255, 0, 0)  # the model saw the rebuilt frame
+
+    stale = client.post("/vlm/act/binary", content=encode_frame(tree, big), headers=headers)
+    _use_engine("mock")
+    assert stale.status_code == 409
+    assert stale.json()["detail"]["error"] == "frame_version_mismatch"
+    stats = client.get("/vlm/sessions/tab-tiles").json()
+    assert stats["frames_delta"] == 2
+    assert stats["frames_skipped"] == 1
+    assert stats["image_bytes_saved"] > 0
+
+def test_vlm_act_downscales_hidpi_frames_and_maps_bbox_back():
+    buf = io.BytesIO()
+    Image.new("RGB", (2560, 1600), "white").save(buf, format="JPEG")
+    tree = '{"role": "RootWebArea", "name": "Results", "children": [{"id": 2, "role": "button", "name": "Go", "bbox": [100, 200, 50, 20]}]}'
+    seen = {}
+
+    def generate(batch, sampling_params):
+        seen["size"] = batch[0]["multi_modal_data"]["image"].size
+        seen["prompt"] = batch[0]["prompt"]
+        return [MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [61, 121, 30, 12]}')])]
+
+    llm = MagicMock()
+    llm.generate.side_effect = generate
+    _use_engine("vllm", llm)
+    response = client.post("/vlm/act/binary", content=encode_frame(tree, buf.getvalue()),
+                           headers={"Content-Type": FRAME_CONTENT_TYPE, "X-Viewport": "1280x800"})
+    _use_engine("mock")
+    width, height = seen["size"]
+    assert width % 28 == 0 and height % 28 == 0 and width * height <= 1280 * 28 * 28
+    scale = width / 1280
+    assert f'"Go" @{int(100 * scale)},{int(200 * scale)}' in seen["prompt"]
+    x, y, w, h = response.json()["target_bbox"]
+    assert abs(x - 61 / scale) <= 1 and abs(y - 121 / (height / 800)) <= 1
+    assert client.get("/vlm/status").json()["last_preprocess"]["source_size"] == [2560, 1600]
+
+def test_vlm_act_maps_bbox_back_through_the_page_viewport():
+    tree = '{"role": "RootWebArea", "name": "Wide", "children": [{"role": "button", "name": "Go", "bbox": [1500, 900, 60, 30]}]}'
+    seen = {}
+
+    def generate(batch, sampling_params):
+        width, height = seen["size"] = batch[0]["multi_modal_data"]["image"].size
+        # Point at the centre of the model's image.
+        return [MagicMock(outputs=[MagicMock(text=json.dumps({"action": "scroll", "target_bbox": [width / 2, height / 2, 2, 2]}))])]
+
+    llm = MagicMock()
+    llm.generate.side_effect = generate
+    _use_engine("vllm", llm)
+    try:
+        # A 1920x1080 frame at 1x: with no viewport the source size is the page size.
+        wide = client.post("/vlm/act", json={"image_base64": _png_b64((1920, 1080)), "a11y_tree": tree})
+        assert wide.json()["target_bbox"][:2] == [960, 540]
+        vlm_server.action_cache.invalidate()
+        # The same pixels as a DPR-2 capture of a 960x540 page.
+        hidpi = client.post("/vlm/act", json={"image_base64": _png_b64((1920, 1080)), "a11y_tree": tree, "viewport": [960, 540]})
+        assert hidpi.json()["target_bbox"][:2] == [480, 270]
+        assert client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": tree, "viewport": [0, 540]}).status_code == 400
+        bad = client.post("/vlm/act/binary", content=encode_frame(tree, base64.b64decode(_png_b64())),
+                          headers={"Content-Type": FRAME_CONTENT_TYPE, "X-Viewport": "wide"})
+        assert bad.status_code == 400
+    finally:
+        _use_engine("mock")
+
+def test_vlm_act_validates_model_output_against_action_schema():
+    payload = {"image_base64": _png_b64(), "a11y_tree": '{"role": "RootWebArea", "name": "Schema results", "children": []}'}
+    outputs = iter(['Here you go: {"action": "type", "text": "laptops", "thought": "Search"} Hope that helps.',
+                    '{"action": "teleport", "thought": "?"}'])
+    llm = MagicMock()
+    llm.generate.side_effect = lambda batch, sampling_params: [MagicMock(outputs=[MagicMock(text=next(outputs))])]
+    _use_engine("vllm", llm)
+    before = dict(vlm_server.action_parse_stats)
+    assert client.post("/vlm/act", json=payload).json() == {"action": "type", "text": "laptops", "thought": "Search"}
+    vlm_server.action_cache.invalidate()
+    assert client.post("/vlm/act", json=payload).json() == {"action": "scroll", "direction": "down"}
+    _use_engine("mock")
+    assert vlm_server.action_parse_stats["parsed"] - before["parsed"] == 1
+    assert vlm_server.action_parse_stats["failed"] - before["failed"] == 1
+
+def test_vlm_act_fast_path_skips_the_model():
+    tree = json.dumps({"role": "RootWebArea", "name": "News", "children": [
+        {"role": "button", "name": "Accept all", "bbox": [600, 500, 120, 32]}]})
+    llm = MagicMock()
+    _use_engine("vllm", llm)
+    with patch.object(vlm_server, "fast_path", vlm_server.FastPathEngine(
+            [{"name": "consent_banner", "type": "click_node", "name_pattern": "^accept all$"}])):
+        response = client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": tree, "session_id": "tab-fast"})
+        stats = client.get("/vlm/fast_path").json()
+    _use_engine("mock")
+    assert response.json()["action"] == "click"
+    assert response.json()["target_bbox"] == [600, 500, 120, 32]
+    assert llm.generate.call_count == 0
+    assert stats["rules"]["consent_banner"]["hits"] == 1
+
+def test_serves_fast_path_and_503_while_model_loads(test_db, monkeypatch):
+    consent = json.dumps({"role": "RootWebArea", "name": "News", "children": [
+        {"role": "button", "name": "Accept all", "bbox": [600, 500, 120, 32]}]})
+    results = '{"role": "RootWebArea", "name": "Results", "children": []}'
+    monkeypatch.setitem(vlm_server.CONFIG, "engine", "mock")
+    monkeypatch.setitem(vlm_server.CONFIG, "startup_retry_after_s", 3)
+    monkeypatch.setitem(vlm_server.startup, "state", "loading")
+    _use_engine("vllm", MagicMock())
+    try:
+        assert client.get("/healthz").status_code == 200
+        not_ready = client.get("/readyz")
+        assert not_ready.status_code == 503 and not_ready.headers["retry-after"] == "3"
+        with patch.object(vlm_server, "fast_path", vlm_server.FastPathEngine(
+                [{"name": "consent_banner", "type": "click_node", "name_pattern": "^accept all$"}])):
+            assert client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": consent}).json()["action"] == "click"
+            loading = client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": results})
+        assert loading.status_code == 503 and loading.headers["retry-after"] == "3"
+        assert "smartchrome_ready 0" in client.get("/metrics").text
+
+        vlm_server.warm_up()
+        ready = client.get("/readyz")
+        assert ready.status_code == 200 and ready.json()["engine"] == "mock"
+        assert client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": results}).status_code == 200
+    finally:
+        _use_engine("mock")
+
+def test_vlm_act_grounds_target_by_id_and_snaps_near_misses():
+    buf = io.BytesIO()
+    Image.new("RGB", (1280, 800), "white").save(buf, format="PNG")
+    image_b64 = base64.b64encode(buf.getvalue()).decode("ascii")
+    tree = json.dumps({"role": "RootWebArea", "name": "Shop", "children": [
+        {"id": 40, "role": "button", "name": "Add to basket", "bbox": [700, 420, 140, 36]}]})
+    outputs = iter(['{"action": "click", "target_id": "14", "thought": "Add it"}',
+                    '{"action": "click", "target_bbox": [660, 380, 20, 20], "thought": "Add it"}'])
+    llm = MagicMock()
+    llm.generate.side_effect = lambda batch, sampling_params: [MagicMock(outputs=[MagicMock(text=next(outputs))])]
+    _use_engine("vllm", llm)
+    before = dict(vlm_server.grounding_stats)
+    by_id = client.post("/vlm/act", json={"image_base64": image_b64, "a11y_tree": tree}).json()
+    vlm_server.action_cache.invalidate()
+    snapped = client.post("/vlm/act", json={"image_base64": image_b64, "a11y_tree": tree}).json()
+    _use_engine("mock")
+    assert by_id == {"action": "click", "target_bbox": [700, 420, 140, 36], "thought": "Add it"}  # id 40 is "14" in base36
+    assert snapped["target_bbox"] == [700, 420, 140, 36]
+    assert vlm_server.grounding_stats["by_id"] - before["by_id"] == 1
+    assert vlm_server.grounding_stats["snapped"] - before["snapped"] == 1
+
+
+def test_status_etag_short_circuits_unchanged_polls():
+    first = client.get("/vlm/status", params={"session_id": "etag-tab"})
+    etag = first.headers["etag"]
+    assert client.get("/vlm/status", params={"session_id": "etag-tab"}, headers={"If-None-Match": etag}).status_code == 304
+    # Another tab's steps move the global counters but not this tab's ETag.
+    client.post("/vlm/objective", json={"objective": "Elsewhere", "session_id": "other-tab"})
+    client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": "", "session_id": "other-tab"})
+    vlm_server.last_compaction["nodes_in"] = vlm_server.last_compaction.get("nodes_in", 0) + 1
+    assert client.get("/vlm/status", params={"session_id": "etag-tab"}, headers={"If-None-Match": etag}).status_code == 304
+    client.post("/vlm/objective", json={"objective": "Find the changelog", "session_id": "etag-tab"})
+    changed = client.get("/vlm/status", params={"session_id": "etag-tab"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["event_seq"] == 1
+
+
+def test_session_events_resume_from_last_event_id():
+    for objective in ("First", "Second", "Third"):
+        client.post("/vlm/objective", json={"objective": objective, "session_id": "sse-tab"})
+    body = client.get("/vlm/events", params={"session_id": "sse-tab", "follow": "false"}).text
+    assert body.count("event: objective") == 3 and body.startswith("id: 1\n")
+    resumed = client.get("/vlm/events", params={"session_id": "sse-tab", "follow": "false"}, headers={"Last-Event-ID": "2"}).text
+    assert resumed.startswith("id: 3\n") and "Third" in resumed and "Second" not in resumed
+
+def test_metrics_endpoint_exposes_phase_timings_and_fallbacks():
+    payload = {"image_base64": _png_b64(), "a11y_tree": '{"role": "RootWebArea", "name": "Metrics page", "children": []}'}
+    outputs = iter(['{"action": "scroll", "direction": "down", "thought": "Read on"}', "not json"])
+    llm = MagicMock()
+    llm.generate.side_effect = lambda batch, sampling_params: [MagicMock(outputs=[MagicMock(text=next(outputs))])]
+    phases = vlm_server.act_phase_seconds
+    before = {phase: phases.count(phase=phase) for phase in ("request_parse", "base64_decode", "cache_lookup", "generate", "json_parse")}
+    fallbacks = vlm_server.act_fallbacks.value(reason="parse_error")
+    _use_engine("vllm", llm)
+    client.post("/vlm/act", json=payload)
+    vlm_server.action_cache.invalidate()
+    client.post("/vlm/act", json=payload)
+    _use_engine("mock")
+    assert all(phases.count(phase=phase) - n == 2 for phase, n in before.items())
+    assert vlm_server.act_fallbacks.value(reason="parse_error") - fallbacks == 1
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'smartchrome_act_phase_seconds_bucket{phase="generate",le="+Inf"}' in text
+    assert 'smartchrome_act_outcomes_total{engine="vllm",outcome="model"}' in text
+    assert 'smartchrome_http_request_seconds_count{method="POST",route="/vlm/act",status="200"}' in text
+    assert "smartchrome_inference_queue_depth 0" in text
+
+def test_flight_recorder_traces_replay_against_the_server(tmp_path):
+    from flight_recorder import read_steps, replay
+    from tile_codec import changed_tiles, encode_tile_delta
+    from PIL import ImageDraw
+    llm = MagicMock()
+    llm.generate.side_effect = lambda batch, sampling_params: [
+        MagicMock(outputs=[MagicMock(text='{"action": "click", "target_bbox": [1, 2, 3, 4]}')]) for _ in batch]
+    _use_engine("vllm", llm)
+    tree = '{"role": "RootWebArea", "name": "Results page", "id": 1, "children": []}'
+    base = Image.new("RGB", (320, 200), "white")
+    buf = io.BytesIO()
+    base.save(buf, format="PNG")
+    moved = base.copy()
+    ImageDraw.Draw(moved).rectangle([100, 50, 220, 150], fill=(255, 0, 0))
+    delta = encode_tile_delta(1, moved, changed_tiles(base, moved, 32), 32, format="PNG")
+    headers = {"Content-Type": FRAME_CONTENT_TYPE, "X-Session-Id": "tab-rec"}
+
+    old_recorder = vlm_server.flight_recorder
+    # The class vlm_server imported, whose context variable its phase timers use.
+    vlm_server.flight_recorder = vlm_server.FlightRecorder(str(tmp_path))
+    try:
+        client.post("/vlm/objective", json={"objective": "Find the red box", "session_id": "tab-rec"})
+        for _ in range(3):
+            assert client.post("/vlm/act", json={"image_base64": _png_b64(), "a11y_tree": tree, "session_id": "tab-rec"}).status_code == 200
+        client.post("/vlm/act/binary", content=encode_frame(tree, buf.getvalue()), headers=headers)
+        client.post("/vlm/act/binary", content=encode_frame(tree, delta), headers=headers)
+        vlm_server.flight_recorder.close()
+        assert vlm_server.flight_recorder.blobs_deduplicated >= 3
+    finally:
+        vlm_server.flight_recorder = old_recorder
+
+    steps = read_steps([str(tmp_path)])
+    assert [s["route"] for s in steps] == ["/vlm/objective"] + ["/vlm/act"] * 3 + ["/vlm/act/binary"] * 2
+    assert steps[1]["engine"] == "vllm" and "generate" in steps[1]["phases"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=vlm_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await replay(steps, ac, speed=0, session_suffix="-replay")
+
+    summary = asyncio.run(run())
+    _use_engine("mock")
+    assert summary["steps"] == 6 and summary["status_mismatches"] == 0
+    assert summary["actions_compared"] == 5 and summary["actions_matched"] == 5
+    assert client.get("/vlm/status", params={"session_id": "tab-rec-replay"}).json()["objective"] == "Find the red box"
@@ -0,0 +1,107 @@
+import io
+import struct
+
+from PIL import Image, ImageChops
+
+from frame_codec import BufferReader, FrameFormatError
+
+# Tiled delta screenshot, sent in place of the encoded image in an SCF1 frame
+# (see frame_codec.py) once the server has acknowledged a base frame:
+#   4 bytes  magic b"SCT1"
+#   4 bytes  uint32 base frame version (X-Frame-Version of an earlier response)
+#   2+2 B    uint16 full frame width, height
+#   2 bytes  uint16 tile size in pixels
+#   2 bytes  uint16 tile count
+#   per tile: uint16 column, uint16 row, uint32 length, encoded JPEG/PNG tile
+# All integers are big-endian. Edge tiles are cropped to the frame.
+TILE_MAGIC = b"SCT1"
+_HEADER = struct.Struct("!4sIHHHH")
+_TILE = struct.Struct("!HHI")
+
+
+class TileDelta:
+    def __init__(self, base_version, size, tile_size, tiles):
+        self.base_version = base_version
+        self.size = size
+        self.tile_size = tile_size
+        self.tiles = tiles  # [(col, row, memoryview)]
+
+    def changed_fraction(self):
+        width, height = self.size
+        ts = self.tile_size
+        area = sum(min(ts, width - col * ts) * min(ts, height - row * ts) for col, row, _ in self.tiles)
+        return area / (width * height) if width and height else 0.0
+
+
+def is_tile_delta(view):
+    return bytes(view[:4]) == TILE_MAGIC
+
+
+def changed_tiles(previous, current, tile_size=64):
+    """Grid cells (col, row) where `current` differs from `previous` at all."""
+    if previous.size != current.size:
+        raise ValueError("Frames must have the same size.")
+    diff = ImageChops.difference(previous.convert("RGB"), current.convert("RGB"))
+    bbox = diff.getbbox()
+    if bbox is None:
+        return []
+    width, height = current.size
+    cells = []
+    # Only scan the grid cells under the overall changed bounding box.
+    for row in range(bbox[1] // tile_size, (bbox[3] - 1) // tile_size + 1):
+        for col in range(bbox[0] // tile_size, (bbox[2] - 1) // tile_size + 1):
+            box = (col * tile_size, row * tile_size, min(width, (col + 1) * tile_size), min(height, (row + 1) * tile_size))
+            if diff.crop(box).getbbox() is not None:
+                cells.append((col, row))
+    return cells
+
+
+def encode_tile_delta(base_version, image, cells, tile_size=64, format="JPEG", quality=85):
+    width, height = image.size
+    parts = [_HEADER.pack(TILE_MAGIC, base_version, width, height, tile_size, len(cells))]
+    for col, row in cells:
+        box = (col * tile_size, row * tile_size, min(width, (col + 1) * tile_size), min(height, (row + 1) * tile_size))
+        buf = io.BytesIO()
+        image.crop(box).save(buf, format=format, quality=quality)
+        parts.append(_TILE.pack(col, row, buf.tell()))
+        parts.append(buf.getvalue())
+    return b"".join(parts)
+
+
+def decode_tile_delta(view):
+    """Parse an SCT1 payload without copying the tile bytes."""
+    view = memoryview(view)
+    if len(view) < _HEADER.size:
+        raise FrameFormatError("Tile delta is shorter than its header.")
+    magic, base_version, width, height, tile_size, count = _HEADER.unpack_from(view)
+    if magic != TILE_MAGIC:
+        raise FrameFormatError("Bad tile delta magic.")
+    if not tile_size:
+        raise FrameFormatError("Tile size must be positive.")
+    cols, rows = -(-width // tile_size), -(-height // tile_size)
+    tiles = []
+    offset = _HEADER.size
+    for _ in range(count):
+        if offset + _TILE.size > len(view):
+            raise FrameFormatError("Truncated tile header.")
+        col, row, length = _TILE.unpack_from(view, offset)
+        offset += _TILE.size
+        if col >= cols or row >= rows:
+            raise FrameFormatError(f"Tile ({col}, {row}) is outside a {cols}x{rows} grid.")
+        if offset + length > len(view):
+            raise FrameFormatError("Tile length exceeds delta size.")
+        tiles.append((col, row, view[offset:offset + length]))
+        offset += length
+    return TileDelta(base_version, (width, height), tile_size, tiles)
+
+
+def apply_tile_delta(frame, delta):
+    """Paste the delta's tiles into `frame` in place."""
+    if frame.size != delta.size:
+        raise FrameFormatError(f"Delta is for a {delta.size} frame, base frame is {frame.size}.")
+    ts = delta.tile_size
+    for col, row, data in delta.tiles:
+        tile = Image.open(BufferReader(data))
+        tile.load()
+        frame.paste(tile.convert(frame.mode), (col * ts, row * ts))
+    return frame
@@ -0,0 +1,396 @@
+import argparse
+import base64
+import bisect
+import json
+import mmap
+import os
+import random
+import shutil
+import sys
+from array import array
+
+from rlhf_store import frame_hash
+
+# Sharded training dataset, written by teacher_worker and read by local_forge.
+#
+#   <dir>/index.json                  {"format": 1, "records": N, "images": M,
+#                                      "shards": [{"name": "shard-00000", "records": n, "bytes": b}, ...]}
+#   <dir>/shard-00000.bin             UTF-8 JSON records, back to back
+#   <dir>/shard-00000.idx             little-endian uint64 end offset of each record
+#   <dir>/images/ab/<sha256>.jpg      screenshots, stored once per content hash
+#
+# A record is a training line (see teacher_worker.build_training_line) whose
+# screenshot URL is "image:<sha256>" instead of an inline data: URL, with the
+# hash also under "image". Shards roll over at max_shard_bytes. index.json is
+# the commit point: bytes appended after the last commit are truncated away
+# when a writer reopens the directory.
+
+FORMAT_VERSION = 1
+INDEX_NAME = "index.json"
+IMAGE_URL_PREFIX = "image:"
+DEFAULT_MAX_SHARD_BYTES = 64 * 2 ** 20
+
+
+def _shard_name(number):
+    return f"shard-{number:05d}"
+
+
+def read_index(path):
+    with open(os.path.join(path, INDEX_NAME)) as f:
+        index = json.load(f)
+    if index.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path} has dataset format {index.get('format')}, expected {FORMAT_VERSION}.")
+    return index
+
+
+def is_sharded_dataset(path):
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+def _image_path(path, digest):
+    return os.path.join(path, "images", digest[:2], digest + ".jpg")
+
+
+def _offsets_bytes(offsets):
+    data = array("Q", offsets)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+class ShardWriter:
+    """Appends records to rolling shards. Nothing is visible to readers
+    until commit(); call it after each batch."""
+
+    def __init__(self, path, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES):
+        self.path = path
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(os.path.join(path, "images"), exist_ok=True)
+        if is_sharded_dataset(path):
+            self.index = read_index(path)
+        else:
+            self.index = {"format": FORMAT_VERSION, "records": 0, "images": 0, "shards": []}
+        self._bin = self._idx = None
+        self._restore()
+
+    @property
+    def records(self):
+        return self.index["records"]
+
+    def _restore(self):
+        # Drop anything written after the last commit.
+        committed = {s["name"] for s in self.index["shards"]}
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            if ext in (".bin", ".idx") and stem.startswith("shard-") and stem not in committed:
+                os.remove(os.path.join(self.path, name))
+        if self.index["shards"]:
+            shard = self.index["shards"][-1]
+            self._open(shard["name"])
+            self._bin.truncate(shard["bytes"])
+            self._idx.truncate(shard["records"] * 8)
+            self._bin.seek(0, os.SEEK_END)
+            self._idx.seek(0, os.SEEK_END)
+
+    def _open(self, name):
+        self._close_files()
+        base = os.path.join(self.path, name)
+        for ext in (".bin", ".idx"):
+            if not os.path.exists(base + ext):
+                open(base + ext, "wb").close()
+        self._bin = open(base + ".bin", "r+b")
+        self._idx = open(base + ".idx", "r+b")
+        self._bin.seek(0, os.SEEK_END)
+        self._idx.seek(0, os.SEEK_END)
+
+    def _roll(self):
+        shard = {"name": _shard_name(len(self.index["shards"])), "records": 0, "bytes": 0}
+        self.index["shards"].append(shard)
+        self._open(shard["name"])
+        return shard
+
+    def put_image(self, image_bytes):
+        """Store a screenshot once per content hash; returns the hash."""
+        digest = frame_hash(image_bytes)
+        target = _image_path(self.path, digest)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f"{target}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(image_bytes)
+            os.replace(tmp, target)
+            self.index["images"] += 1
+        return digest
+
+    def append(self, record):
+        data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        shard = self.index["shards"][-1] if self.index["shards"] else None
+        if shard is None or (shard["records"] and shard["bytes"] + len(data) > self.max_shard_bytes):
+            shard = self._roll()
+        self._bin.write(data)
+        shard["bytes"] += len(data)
+        shard["records"] += 1
+        self._idx.write(_offsets_bytes([shard["bytes"]]))
+        self.index["records"] += 1
+
+    def commit(self):
+        if self._bin is not None:
+            for f in (self._bin, self._idx):
+                f.flush()
+                os.fsync(f.fileno())
+        tmp = os.path.join(self.path, INDEX_NAME + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, INDEX_NAME))
+
+    def rollback(self, records):
+        """Drop committed records past the first `records` (crash recovery)."""
+        kept, remaining = [], records
+        for shard in self.index["shards"]:
+            if remaining <= 0:
+                break
+            if shard["records"] > remaining:
+                with open(os.path.join(self.path, shard["name"] + ".idx"), "rb") as f:
+                    ends = array("Q", f.read(shard["records"] * 8))
+                if sys.byteorder != "little":
+                    ends.byteswap()
+                shard = {**shard, "records": remaining, "bytes": ends[remaining - 1]}
+            kept.append(shard)
+            remaining -= shard["records"]
+        self._close_files()
+        self.index["shards"] = kept
+        self.index["records"] = sum(s["records"] for s in kept)
+        self.commit()
+        self._restore()
+
+    def _close_files(self):
+        for f in (self._bin, self._idx):
+            if f is not None:
+                f.close()
+        self._bin = self._idx = None
+
+    def close(self):
+        self._close_files()
+
+
+class _ShardReader:
+    def __init__(self, path, shard):
+        self.records = shard["records"]
+        base = os.path.join(path, shard["name"])
+        self._maps = []
+        self.data = self._map(base + ".bin")
+        ends = self._map(base + ".idx")
+        if sys.byteorder == "little":
+            self.ends = memoryview(ends).cast("Q")[:self.records]
+        else:
+            self.ends = array("Q", ends[:self.records * 8])
+            self.ends.byteswap()
+
+    def _map(self, filename):
+        with open(filename, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(m)
+        return m
+
+    def raw(self, i):
+        start = self.ends[i - 1] if i else 0
+        return self.data[start:self.ends[i]]
+
+    def close(self):
+        if isinstance(self.ends, memoryview):
+            self.ends.release()
+        for m in self._maps:
+            m.close()
+
+
+class ShardedDataset:
+    """Random access over a committed snapshot of a sharded dataset.
+
+    Records are read straight out of memory-mapped shards; screenshots are
+    only read when asked for, so iterating records never touches image bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = read_index(path)
+        self.shards = [_ShardReader(path, s) for s in self.index["shards"] if s["records"]]
+        self.starts = []
+        total = 0
+        for shard in self.shards:
+            self.starts.append(total)
+            total += shard.records
+        self.total = total
+
+    def __len__(self):
+        return self.total
+
+    def raw(self, i):
+        if not 0 <= i < self.total:
+            raise IndexError(i)
+        n = bisect.bisect_right(self.starts, i) - 1
+        return self.shards[n].raw(i - self.starts[n])
+
+    def __getitem__(self, i):
+        return json.loads(self.raw(i))
+
+    def image(self, digest):
+        with open(_image_path(self.path, digest), "rb") as f:
+            return f.read()
+
+    def training_line(self, i):
+        """Record i as a self-contained JSONL training line (data: URL inlined)."""
+        record = self[i]
+        digest = record.pop("image", None)
+        if digest:
+            url = "data:image/jpeg;base64," + base64.b64encode(self.image(digest)).decode("ascii")
+            for item in image_items(record):
+                item["image_url"]["url"] = url
+        return record
+
+    def indices(self, shuffle=False, seed=0, epoch=0, rank=0, world_size=1):
+        """Record order for one epoch: a permutation across all shards when
+        shuffling, split round-robin between `world_size` loader ranks."""
+        order = list(range(self.total))
+        if shuffle:
+            random.Random(f"{seed}:{epoch}").shuffle(order)
+        return order[rank::world_size]
+
+    def iterate(self, shuffle=False, seed=0, epoch=0, rank=0, world_size=1, with_images=False):
+        for i in self.indices(shuffle, seed, epoch, rank, world_size):
+            record = self[i]
+            if with_images:
+                digest = record.get("image")
+                yield record, self.image(digest) if digest else None
+            else:
+                yield record
+
+    def __iter__(self):
+        return self.iterate()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def image_items(line):
+    for message in line.get("messages", ()):
+        content = message.get("content")
+        if isinstance(content, list):
+            for item in content:
+                if isinstance(item, dict) and item.get("type") == "image_url":
+                    yield item
+
+
+def inline_image(line):
+    """Screenshot bytes from a JSONL line's data: URL, or None."""
+    for item in image_items(line):
+        url = item["image_url"].get("url", "")
+        if url.startswith("data:"):
+            return base64.b64decode(url.split(",", 1)[1]) or None
+    return None
+
+
+def shard_record(line, writer):
+    """Move a JSONL line's inline screenshot into the writer's image store."""
+    digest = None
+    for item in image_items(line):
+        url = item["image_url"].get("url", "")
+        if url.startswith("data:"):
+            image_bytes = base64.b64decode(url.split(",", 1)[1])
+            if image_bytes:
+                digest = writer.put_image(image_bytes)
+                item["image_url"]["url"] = IMAGE_URL_PREFIX + digest
+    if digest:
+        line["image"] = digest
+    return line
+
+
+def convert_jsonl(jsonl_path, out_dir, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES, commit_every=1000):
+    """Convert a training_dataset.jsonl file; returns counts and sizes."""
+    writer = ShardWriter(out_dir, max_shard_bytes)
+    if writer.records:
+        writer.close()
+        raise ValueError(f"{out_dir} already holds {writer.records} records.")
+    with open(jsonl_path, "rb") as f:
+        for n, line in enumerate(f, 1):
+            if line.strip():
+                writer.append(shard_record(json.loads(line), writer))
+            if n % commit_every == 0:
+                writer.commit()
+    writer.commit()
+    writer.close()
+    index = writer.index
+    return {"records": index["records"], "images": index["images"], "shards": len(index["shards"]),
+            "jsonl_bytes": os.path.getsize(jsonl_path), "dataset_bytes": dataset_bytes(out_dir)}
+
+
+def legacy_jsonl_path(path):
+    """Where versions before the sharded format kept the dataset at `path`."""
+    return path.rstrip(os.sep) + ".jsonl"
+
+
+def _is_unused(path):
+    if not os.path.exists(path):
+        return True
+    if is_sharded_dataset(path):
+        return read_index(path)["records"] == 0
+    return dataset_bytes(path) == 0
+
+
+def migrate_legacy_jsonl(path, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES):
+    """Convert <path>.jsonl, left by a version before the sharded format, into
+    the sharded dataset at `path`, then rename it to <path>.jsonl.converted.
+    Returns convert_jsonl's stats, or None when there was nothing to convert."""
+    legacy = legacy_jsonl_path(path)
+    if path.endswith(".jsonl") or not os.path.isfile(legacy):
+        return None
+    if not _is_unused(path):
+        print(f"Warning: {legacy} was not converted because {path} already holds data. Convert it with "
+              f"`python training_shards.py convert {legacy} <new dir>` and merge by hand.")
+        return None
+    # Converted aside and moved in whole, so an interrupted run leaves nothing half-converted at path.
+    staging = path.rstrip(os.sep) + ".converting"
+    shutil.rmtree(staging, ignore_errors=True)
+    stats = convert_jsonl(legacy, staging, max_shard_bytes)
+    if os.path.exists(path):
+        shutil.rmtree(path)  # an empty dataset started before the conversion
+    os.replace(staging, path)
+    os.replace(legacy, legacy + ".converted")
+    return stats
+
+
+def dataset_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded training dataset tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Convert a JSONL training file into a sharded dataset")
+    convert.add_argument("jsonl_path")
+    convert.add_argument("out_dir")
+    convert.add_argument("--max-shard-mb", type=float, default=DEFAULT_MAX_SHARD_BYTES / 2 ** 20)
+    info = commands.add_parser("info", help="Show a sharded dataset's index")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        stats = convert_jsonl(args.jsonl_path, args.out_dir, int(args.max_shard_mb * 2 ** 20))
+        print(f"{stats['records']} records, {stats['images']} unique images in {stats['shards']} shards: "
+              f"{stats['jsonl_bytes'] / 2 ** 20:.1f} MB -> {stats['dataset_bytes'] / 2 ** 20:.1f} MB")
+    else:
+        index = read_index(args.path)
+        print(f"{index['records']} records, {index['images']} images, {len(index['shards'])} shards, "
+              f"{dataset_bytes(args.path) / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
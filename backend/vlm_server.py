@@ -3,28 +3,44 @@ import os
 import json
 import base64
 import io
-import sqlite3
-import gc
+import atexit
+import asyncio
+import binascii
+import uuid
+import argparse
+import hashlib
+import time
+import threading
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 from PIL import Image
-from fastapi import FastAPI, HTTPException
+from typing import Optional, Tuple
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse
 from pydantic import BaseModel
 import uvicorn
-from openai import OpenAI
-
-# Load Configuration
-def load_config():
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smartchrome_config.json")
-    if os.path.exists(config_path):
-        with open(config_path, "r") as f:
-            return json.load(f)
-    return {
-        "host": "127.0.0.1", "port": 8000, "db_path": "rlhf_tuples.db",
-        "engine": "mock", "model_path": None, "reports_dir": "reports"
-    }
-
-CONFIG = load_config()
+from frame_codec import decode_frame, BufferReader, FrameFormatError
+from inference_scheduler import InferenceScheduler, QueueFullError, DeadlineExceededError
+import rlhf_store
+from engine_manager import EngineManager, ReloadInProgressError, generate_batch
+from action_cache import ActionCache, cache_key, image_dhash
+from a11y_compactor import A11yCompactor, INTERACTIVE_ROLES
+from a11y_index import A11yIndex
+from fast_path import FastPathEngine
+from spatial_index import ground_bbox
+from image_preprocess import ImagePreprocessor
+from action_schema import parse_action, ActionParseError
+from session_state import SessionStore, TreeVersionMismatch, DeltaFormatError
+from tile_codec import is_tile_delta, decode_tile_delta
+from osint_engine import OSINTMapReduce
+from teacher_cache import TeacherCache, prompt_key
+from osint_jobs import OSINTJobManager, JobQueueFullError, format_sse
+from metrics import REGISTRY, CONTENT_TYPE, RequestMetricsMiddleware
+from flight_recorder import FlightRecorder, note_phase
+import config
+
+CONFIG = config.load_config()
 
 app = FastAPI()
 
@@ -42,15 +58,36 @@ TEACHER_API_KEY = os.environ.get("TEACHER_API_KEY", "EMPTY")
 TEACHER_BASE_URL = os.environ.get("TEACHER_BASE_URL", "http://localhost:11434/v1")
 TEACHER_MODEL = os.environ.get("TEACHER_MODEL", "qwen2.5:32b")
 
-client = OpenAI(api_key=TEACHER_API_KEY, base_url=TEACHER_BASE_URL)
+class LazyOpenAI:
+    """The teacher client, built on first use: importing openai is the
+    slowest part of starting the server and only OSINT needs it."""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(**self._kwargs)
+        return getattr(self._client, name)
+
+client = LazyOpenAI(api_key=TEACHER_API_KEY, base_url=TEACHER_BASE_URL)
 
-# Global State for Commander UI
-current_objective = "Explore the web and find interesting facts."
-reasoning_log = []
+# Per-tab state for the Commander UI and the action loop (see session_state.py).
+# Requests without a session_id share the "default" session.
+sessions = SessionStore("Explore the web and find interesting facts.", event_capacity=CONFIG.get("session_event_capacity", 256))
 
 class VLMActionRequest(BaseModel):
     image_base64: str
-    a11y_tree: str
+    a11y_tree: str = ""
+    session_id: Optional[str] = None
+    tree_version: Optional[int] = None
+    # When base_version is set, a11y_delta is applied to that acknowledged tree instead of sending a11y_tree.
+    base_version: Optional[int] = None
+    a11y_delta: Optional[dict] = None
+    # CSS (width, height) of the page the screenshot shows; without it the frame is taken to be at 1x.
+    viewport: Optional[Tuple[int, int]] = None
 
 class RLHFLogRequest(BaseModel):
     timestamp: str
@@ -68,213 +105,725 @@ class ReloadModelRequest(BaseModel):
 
 class ObjectiveRequest(BaseModel):
     objective: str
+    session_id: Optional[str] = None
 
 # Database Initialization
 DB_PATH = CONFIG["db_path"]
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tuples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            image_base64 TEXT,
-            a11y_tree TEXT,
-            bad_action TEXT,
-            good_action TEXT,
-            processed INTEGER DEFAULT 0
-        )
-    """)
-    try:
-        cursor.execute("ALTER TABLE tuples ADD COLUMN processed INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
-    conn.commit()
+    conn = rlhf_store.connect(DB_PATH)
+    rlhf_store.init_schema(conn)
+    migrated = rlhf_store.migrate_inline_images(conn)
+    if migrated:
+        print(f"Migrated {migrated} inline screenshots to the frame store.")
     conn.close()
 
-# Hardware-aware Model Loader
-model_engine = None
-llm = None
-sampling_params = None
-model = None
-processor = None
+# Long-lived, group-committing writer for /vlm/rlhf_log
+rlhf_writer = None
+
+def get_rlhf_writer():
+    global rlhf_writer
+    if rlhf_writer is None or rlhf_writer.db_path != DB_PATH:
+        close_rlhf_writer()
+        rlhf_writer = rlhf_store.RLHFWriter(DB_PATH)
+    return rlhf_writer
+
+def close_rlhf_writer():
+    global rlhf_writer
+    if rlhf_writer is not None:
+        rlhf_writer.close()
+        rlhf_writer = None
+
+atexit.register(close_rlhf_writer)
+
+# Observation -> action cache, flushed whenever the model changes; keys for
+# other missions simply age out through the TTL and LRU bound.
+action_cache = ActionCache(
+    max_entries=CONFIG.get("action_cache_size", 1024),
+    ttl_s=CONFIG.get("action_cache_ttl_s", 600),
+    disk_path=CONFIG.get("action_cache_path"),
+)
+
+# Prompt-side a11y tree compaction, sized to the engine's context window
+a11y_compactor = A11yCompactor(token_budget=CONFIG.get("prompt_token_budget", 1500))
+last_compaction = {}
+
+# Config-declared rules that answer predictable states without the VLM (see fast_path.py)
+fast_path = FastPathEngine(CONFIG.get("fast_path_rules"))
+
+# Screenshot decode/resize to the vision encoder's patch grid (see image_preprocess.py)
+image_preprocessor = ImagePreprocessor(
+    patch=CONFIG.get("vision_patch_size", 28),
+    min_pixels=CONFIG.get("vision_min_pixels", 4 * 28 * 28),
+    max_pixels=CONFIG.get("vision_max_pixels", 1280 * 28 * 28),
+    crop_to_nodes=CONFIG.get("vision_crop_to_nodes", False),
+)
+last_preprocess = {}
+action_parse_stats = {"parsed": 0, "failed": 0}
+
+# Predicted boxes are checked against the a11y tree the client just sent and
+# snapped to the actionable node under (or nearest) their centre.
+grounding_stats = {"by_id": 0, "inside": 0, "snapped": 0, "ungrounded": 0}
+
+# Prometheus metrics for GET /metrics (see metrics.py). Scheduler, cache and
+# engine state are read at scrape time; only phase timings and outcomes are
+# recorded on the request path.
+http_request_seconds = REGISTRY.histogram(
+    "smartchrome_http_request_seconds", "Time to response headers per route.", ("method", "route", "status"))
+act_phase_seconds = REGISTRY.histogram(
+    "smartchrome_act_phase_seconds", "Time spent in each phase of an action step.", ("phase",))
+act_outcomes = REGISTRY.counter(
+    "smartchrome_act_outcomes_total", "Action steps by engine and how they were answered.", ("engine", "outcome"))
+act_fallbacks = REGISTRY.counter(
+    "smartchrome_act_fallbacks_total", "Action steps answered with the default scroll action.", ("reason",))
+rlhf_log_phase_seconds = REGISTRY.histogram(
+    "smartchrome_rlhf_log_phase_seconds", "Time spent in each phase of /vlm/rlhf_log.", ("phase",))
+osint_stage_seconds = REGISTRY.histogram(
+    "smartchrome_osint_stage_seconds", "OSINT map-reduce stage durations.", ("stage",))
+osint_jobs_finished = REGISTRY.counter("smartchrome_osint_jobs_total", "Finished OSINT jobs.", ("status",))
+osint_llm_calls = REGISTRY.counter("smartchrome_osint_llm_calls_total", "LLM calls made by OSINT jobs.")
+app.add_middleware(RequestMetricsMiddleware, histogram=http_request_seconds)
+
+@contextmanager
+def act_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        act_phase_seconds.observe(elapsed, phase=phase)
+        note_phase(phase, elapsed)
+
+# Compressed, frame-deduplicated traces of every action step, written off the
+# request path (see flight_recorder.py); replay them with
+# `python flight_recorder.py replay <dir> --url ...`.
+flight_recorder = None
+if CONFIG.get("flight_recorder_dir"):
+    flight_recorder = FlightRecorder(
+        CONFIG["flight_recorder_dir"],
+        max_bytes=CONFIG.get("flight_recorder_max_mb", 512) * 2 ** 20,
+        max_file_bytes=CONFIG.get("flight_recorder_file_mb", 32) * 2 ** 20,
+    )
+    atexit.register(flight_recorder.close)
+
+def record_step(route, request, blobs=None):
+    if flight_recorder is None:
+        return nullcontext({})
+    return flight_recorder.step(route, request, blobs, engine=engines.active.kind, model_id=engines.active.model_id)
+
+def _ground_action(action, compact, index):
+    target_id = action.pop("target_id", None)
+    node = compact.by_sid.get(str(target_id)) if target_id is not None else None
+    if node is not None and node.bbox:
+        action["target_bbox"] = [round(v) for v in node.bbox]
+        grounding_stats["by_id"] += 1
+        return action
+    max_distance = CONFIG.get("bbox_snap_max_distance", 48)
+    bbox = action.get("target_bbox")
+    if max_distance and action.get("action") in ("click", "type") and isinstance(bbox, list) and len(bbox) == 4:
+        _, snapped, status = ground_bbox(index, bbox, INTERACTIVE_ROLES, max_distance)
+        grounding_stats[status] += 1
+        if snapped is not None:
+            action["target_bbox"] = snapped
+    return action
+
+def _load_observation(load_image):
+    image = load_image()
+    with act_phase("image_open"):
+        image = image_preprocessor.decode(image)
+    with act_phase("image_hash"):
+        return image, image_dhash(image)
+
+def _open_base64_image(data):
+    with act_phase("base64_decode"):
+        raw = base64.b64decode(data)
+    return Image.open(io.BytesIO(raw))
+
+def _bbox_to_page(action, transform):
+    bbox = action.get("target_bbox")
+    if isinstance(bbox, list) and len(bbox) == 4 and all(isinstance(v, (int, float)) for v in bbox):
+        action["target_bbox"] = transform.to_page(bbox)
+    return action
+
+# Hardware-aware Model Loader (blue/green, see engine_manager.py)
+engines = EngineManager(CONFIG, on_swap=lambda engine: action_cache.invalidate())
 
 def load_vlm_model(model_path=None):
-    global model_engine, llm, sampling_params, model, processor
-    
-    # Clean up existing model
-    if llm:
-        del llm
-        import torch
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-    if model:
-        del model
-    gc.collect()
-
-    engine = CONFIG["engine"]
-    path = model_path or CONFIG["model_path"]
+    return engines.load_initial(CONFIG["engine"], model_path or CONFIG["model_path"])
+
+# Cold start: `python vlm_server.py` binds the socket first and runs warm_up()
+# in the background. Until the model is in, /readyz is 503 and /vlm/act
+# answers from the fast path or returns 503 with Retry-After; /healthz only
+# says the process is up.
+startup = {"state": "ready", "started_at": time.monotonic(), "load_s": None, "error": None}
 
+def warm_up():
+    startup.update(state="loading", started_at=time.monotonic(), load_s=None, error=None)
     try:
-        if engine == "mlx":
-            print(f"Initializing MLX-VLM with {path}...")
-            try:
-                from mlx_vlm import load
-                model, processor = load(path)
-                model_engine = "mlx"
-            except ImportError:
-                print("mlx-vlm not installed. Falling back to mock.")
-                model_engine = "mock"
-        elif engine == "vllm":
-            print(f"Initializing VLLM with {path}...")
-            try:
-                from vllm import LLM, SamplingParams
-                llm = LLM(model=path, trust_remote_code=True, max_model_len=4096)
-                sampling_params = SamplingParams(temperature=0.0, max_tokens=512)
-                model_engine = "vllm"
-            except ImportError:
-                print("vllm not installed. Falling back to mock.")
-                model_engine = "mock"
-        else:
-            print("Using Mock Engine.")
-            model_engine = "mock"
+        init_db()
+        load_vlm_model()
     except Exception as e:
-        print(f"Error loading {engine} engine: {e}. Falling back to mock.")
-        model_engine = "mock"
+        print(f"Startup failed: {e}")
+        startup.update(state="failed", error=str(e))
+        return
+    startup.update(state="ready", load_s=round(time.monotonic() - startup["started_at"], 3))
+    print(f"Ready in {startup['load_s']:.1f}s with {engines.active.kind} engine.")
+
+def model_ready():
+    return startup["state"] == "ready"
+
+def _not_ready_error():
+    detail = "The model is still loading." if startup["state"] == "loading" else f"The model failed to load: {startup['error']}"
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(CONFIG.get("startup_retry_after_s", 2))})
+
+@config.on_change
+def apply_config_changes(changed):
+    # Everything read with CONFIG.get() on the request path follows the file by
+    # itself; objects built from config at import are rebuilt here.
+    global fast_path
+    if "fast_path_rules" in changed:
+        fast_path = FastPathEngine(CONFIG.get("fast_path_rules"))
+
+# Continuous micro-batching in front of llm.generate (see engine_manager.generate_batch).
+scheduler = InferenceScheduler(
+    generate_batch,
+    max_batch_size=CONFIG.get("max_batch_size", 8),
+    max_wait_ms=CONFIG.get("batch_wait_ms", 10),
+    max_queue_size=CONFIG.get("max_queue_size", 64),
+    default_timeout_s=CONFIG.get("request_timeout_s", 30.0),
+)
+
+REGISTRY.callback("smartchrome_inference_queue_depth", "Requests waiting for the inference scheduler.",
+                  lambda: scheduler.queue_depth)
+REGISTRY.callback("smartchrome_inference_batches_total", "Batches run by the inference scheduler.",
+                  lambda: scheduler.batches_run, kind="counter")
+REGISTRY.callback("smartchrome_inference_items_total", "Requests run by the inference scheduler.",
+                  lambda: scheduler.items_run, kind="counter")
+REGISTRY.callback("smartchrome_inference_rejected_total", "Requests rejected because the queue was full.",
+                  lambda: scheduler.rejected, kind="counter")
+REGISTRY.callback("smartchrome_inference_expired_total", "Requests that missed their deadline in the queue.",
+                  lambda: scheduler.expired, kind="counter")
+REGISTRY.callback("smartchrome_action_cache_lookups_total", "Action cache lookups.",
+                  lambda: {("hit",): action_cache.hits, ("miss",): action_cache.misses}, kind="counter",
+                  labelnames=("result",))
+REGISTRY.callback("smartchrome_engine_info", "The active engine (always 1).",
+                  lambda: {(engines.active.kind, engines.active.model_id, engines.active.version): 1},
+                  labelnames=("engine", "model_id", "version"))
+REGISTRY.callback("smartchrome_sim_injected_faults_total", "Faults injected by the sim engine.",
+                  lambda: {(fault,): n for fault, n in engines.active.llm.injected.items()} if engines.active.kind == "sim" else {},
+                  kind="counter", labelnames=("fault",))
+REGISTRY.callback("smartchrome_ready", "1 once the model can answer action steps.",
+                  lambda: int(startup["state"] == "ready"))
+REGISTRY.callback("smartchrome_sessions", "Live browser sessions.", lambda: len(sessions.all()))
+REGISTRY.callback("smartchrome_flight_recorder_steps_total", "Action steps written to or dropped by the flight recorder.",
+                  lambda: {("recorded",): flight_recorder.recorded, ("dropped",): flight_recorder.dropped} if flight_recorder else {},
+                  kind="counter", labelnames=("result",))
+REGISTRY.callback("smartchrome_teacher_cache_lookups_total", "Teacher completion cache lookups.",
+                  lambda: {("hit",): teacher_cache.hits, ("miss",): teacher_cache.misses} if teacher_cache else {},
+                  kind="counter", labelnames=("result",))
+
+# The a11y tree either arrives in full, or as a delta against the tree version the
+# server last acknowledged for the session (X-Tree-Version on the response).
+# A delta against any other version gets 409 and the client resends in full.
+def resolve_a11y_tree(session, a11y_tree, tree_version, base_version, delta, delta_bytes):
+    if base_version is None:
+        return session.apply_full_tree(a11y_tree, tree_version)
+    try:
+        return session.apply_delta({} if delta is None else delta, base_version, tree_version, delta_bytes)
+    except TreeVersionMismatch as e:
+        raise _resync_error(e)
+    except DeltaFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _resync_error(e):
+    return HTTPException(status_code=409, detail={
+        "error": f"{e.kind}_version_mismatch", "resync": True,
+        "server_version": e.server_version, "base_version": e.base_version,
+    })
+
+def _decode_full_frame(image_view):
+    image = Image.open(BufferReader(image_view))
+    return image.convert("RGB")
+
+def _viewport(value, name):
+    """(width, height) from a [w, h] pair or a "WxH" header, or None."""
+    if value is None:
+        return None
+    try:
+        width, height = (int(v) for v in (value.lower().split("x") if isinstance(value, str) else value))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be WIDTHxHEIGHT in CSS pixels.")
+    if width <= 0 or height <= 0:
+        raise HTTPException(status_code=400, detail=f"{name} must be positive.")
+    return width, height
+
+def _optional_int(value, name):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer.")
 
 @app.post("/vlm/act")
-async def act(request: VLMActionRequest):
-    global reasoning_log
-
-    # Bootstrap Logic: If page is empty/NTP, initiate search
-    is_empty_state = len(request.a11y_tree) < 50 or "newtab" in request.a11y_tree.lower()
-
-    if is_empty_state and current_objective:
-        search_url = f"https://www.google.com/search?q={current_objective.replace(' ', '+')}"
-        reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] Bootstrap: Page is empty. Initiating search for: {current_objective}")
-        if len(reasoning_log) > 5: reasoning_log.pop(0)
-        return {"action": "navigate", "url": search_url, "thought": "Starting mission by searching for objective."}
-
-    # DEBUG LOGGING
-    reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] DEBUG: Engine={model_engine}, Objective={current_objective}")
-    if len(reasoning_log) > 10: reasoning_log.pop(0)
-
-    if model_engine == "mock":
-        action = {"action": "scroll", "direction": "down"}
-        reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] DEBUG: Using MOCK response.")
-        if len(reasoning_log) > 10: reasoning_log.pop(0)
+async def act(request: VLMActionRequest, response: Response):
+    blobs = {"frame": lambda: base64.b64decode(request.image_base64), "a11y_tree": request.a11y_tree}
+    with record_step("/vlm/act", request.model_dump(exclude={"image_base64", "a11y_tree"}), blobs) as step:
+        session = sessions.get(request.session_id)
+        with act_phase("request_parse"):
+            delta_bytes = len(json.dumps(request.a11y_delta)) if request.a11y_delta is not None else 0
+            a11y_tree = resolve_a11y_tree(session, request.a11y_tree, request.tree_version, request.base_version,
+                                          request.a11y_delta, delta_bytes)
+        response.headers["X-Tree-Version"] = str(session.tree_version)
+        session.last_action = step["response"] = await run_action_step(
+            session, a11y_tree, lambda: _open_base64_image(request.image_base64), _viewport(request.viewport, "viewport"))
+        return session.last_action
+
+# Raw screenshot bytes + a11y tree in one length-prefixed body (see frame_codec.py).
+# The image is decoded straight out of the received buffer. Session and tree
+# versions travel in X-Session-Id / X-Tree-Version / X-Base-Version; with
+# X-Base-Version set the a11y section holds a JSON delta. X-Viewport carries
+# the page's CSS size as WIDTHxHEIGHT.
+#
+# With a session, the server also keeps the decoded screenshot (acknowledged
+# as X-Frame-Version) and the image section may be an SCT1 tile delta against
+# it (see tile_codec.py). When the changed area is below
+# frame_skip_changed_fraction and the tree is unchanged, the previous action
+# is returned without running inference.
+@app.post("/vlm/act/binary")
+async def act_binary(request: Request, response: Response):
+    session_id = request.headers.get("x-session-id")
+    headers = {"session_id": session_id, "tree_version": request.headers.get("x-tree-version"),
+               "base_version": request.headers.get("x-base-version"), "viewport": request.headers.get("x-viewport")}
+    blobs = {}
+    with record_step("/vlm/act/binary", headers, blobs) as step:
+        body = await request.body()
+        try:
+            with act_phase("request_parse"):
+                a11y_text, image_view = decode_frame(body)
+                tile_delta = decode_tile_delta(image_view) if is_tile_delta(image_view) else None
+        except (FrameFormatError, UnicodeDecodeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        blobs.update(frame=image_view, a11y_tree=a11y_text)
+        step["response"] = await _act_on_frame(request, response, session_id, a11y_text, image_view, tile_delta)
+        return step["response"]
+
+async def _act_on_frame(request, response, session_id, a11y_text, image_view, tile_delta):
+    session = sessions.get(session_id)
+    if tile_delta is not None:
+        try:
+            with act_phase("frame_delta"):
+                await asyncio.to_thread(session.apply_frame_delta, tile_delta, len(image_view))
+        except TreeVersionMismatch as e:
+            raise _resync_error(e)
+        except (FrameFormatError, OSError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif session_id:
+        try:
+            with act_phase("image_open"):
+                session.set_frame(await asyncio.to_thread(_decode_full_frame, image_view), len(image_view))
+        except OSError as e:
+            raise HTTPException(status_code=400, detail=f"Unreadable screenshot: {e}")
+    tree_version = _optional_int(request.headers.get("x-tree-version"), "X-Tree-Version")
+    base_version = _optional_int(request.headers.get("x-base-version"), "X-Base-Version")
+    viewport = _viewport(request.headers.get("x-viewport"), "X-Viewport")
+    delta = None
+    if base_version is not None:
+        try:
+            delta = json.loads(a11y_text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"a11y delta is not valid JSON: {e}")
+    a11y_tree = resolve_a11y_tree(session, a11y_text, tree_version, base_version, delta,
+                                  len(a11y_text.encode("utf-8")))
+    response.headers["X-Tree-Version"] = str(session.tree_version)
+    if not session_id:
+        return await run_action_step(session, a11y_tree, lambda: Image.open(BufferReader(image_view)), viewport)
+
+    response.headers["X-Frame-Version"] = str(session.frame_version)
+    if (tile_delta is not None and session.last_action is not None and not session.tree_changed()
+            and session.frame_changed_fraction < CONFIG.get("frame_skip_changed_fraction", 0.005)):
+        session.frames_skipped += 1
+        act_outcomes.inc(engine=engines.active.kind, outcome="skipped")
+        return {**session.last_action, "skipped": True}
+    # Steps within a session are sequential, so the model can read the kept frame directly.
+    session.last_action = await run_action_step(session, a11y_tree, lambda: session.frame, viewport)
+    return session.last_action
+
+async def run_action_step(session, a11y_tree, load_image, viewport=None):
+    objective = session.objective
+
+    # Fast path: bootstrap search on empty/NTP pages, consent banners, etc.
+    with act_phase("tree_parse"):
+        index = await asyncio.to_thread(A11yIndex.build, a11y_tree)
+    with act_phase("fast_path"):
+        hit = fast_path.evaluate(index, session)
+    if hit is not None:
+        rule_name, action = hit
+        session.log(f"Fast path ({rule_name}): {action.get('thought', '')}")
+        act_outcomes.inc(engine=engines.active.kind, outcome="fast_path")
         return action
+    if not model_ready():
+        act_outcomes.inc(engine=engines.active.kind, outcome="not_ready")
+        raise _not_ready_error()
+
+    with engines.lease() as engine:
+        # DEBUG LOGGING
+        session.log(f"DEBUG: Engine={engine.kind}, Objective={objective}")
+
+        if engine.kind == "mock":
+            action = {"action": "scroll", "direction": "down"}
+            session.log("DEBUG: Using MOCK response.")
+            act_outcomes.inc(engine=engine.kind, outcome="mock")
+            return action
+
+        try:
+            image, image_hash = await asyncio.to_thread(_load_observation, load_image)
+            # Without a CSS viewport from the client, the frame is taken to be at 1x.
+            page_size = viewport or image.info.get("source_size", image.size)
+            with act_phase("cache_lookup"):
+                key = cache_key(a11y_tree, image_hash, objective, engine.model_id)
+                cached_action = action_cache.get(key)
+            if cached_action is not None:
+                session.log(f"Cache hit: {cached_action.get('thought', 'Repeating known action.')}")
+                act_outcomes.inc(engine=engine.kind, outcome="cache_hit")
+                return cached_action
+
+            system_prompt = (
+                f"You are SmartChrome, an autonomous AI browser assistant. Your current mission objective is: {objective}. "
+                "Output ONLY valid JSON matching: "
+                '{"action": "click|scroll|type", "target_id": "[id] of the element from the tree", "target_bbox": [x, y, w, h], "text": "...", "thought": "Brief explanation of why you are taking this action"}. '
+                "Prefer target_id when the element is listed in the tree."
+            )
+            with act_phase("a11y_compact"):
+                compact = await asyncio.to_thread(a11y_compactor.compact, a11y_tree, objective, index.tree, page_size)
+            last_compaction.update(compact.stats)
+            with act_phase("image_preprocess"):
+                prepared = await asyncio.to_thread(image_preprocessor.prepare, image, compact.nodes, page_size)
+            last_preprocess.update(prepared.stats)
+            with act_phase("prompt_build"):
+                changes = session.describe_changes()
+                # Boxes are listed, and answered, in pixels of the image the model sees.
+                user_content = f"Accessibility Tree ([id] role \"name\" @x,y,w,h in screenshot pixels):\n{compact.render(prepared.transform.to_model)}\n\n"
+                if changes:
+                    user_content += f"{changes}\n\n"
+                user_content += "What is the next action?"
+
+            response_text = ""
+            if engine.kind == "mlx":
+                response_text = '{"action": "scroll", "direction": "down", "thought": "Scanning page for relevant content."}' 
+            elif engine.kind in ("vllm", "sim"):
+                if engine.kind == "vllm" and not engine.llm:
+                    session.log("Internal Error: VLLM engine requested but not loaded.")
+                    act_fallbacks.inc(reason="engine_not_loaded")
+                    act_outcomes.inc(engine=engine.kind, outcome="fallback")
+                    return {"action": "scroll", "direction": "down"}
+                prompt = f"<|im_start|>system\n{system_prompt}<|im_end|>\n<|im_start|>user\n<|vision_start|><|image_pad|><|vision_end|>{user_content}<|im_end|>\n<|im_start|>assistant\n"
+                with act_phase("generate"):
+                    output = await scheduler.submit((engine, {"prompt": prompt, "multi_modal_data": {"image": prepared.image}}))
+                    response_text = output.outputs[0].text
+
+            if not response_text:
+                raise ValueError("VLM returned an empty response.")
 
-    try:
-        image_data = base64.b64decode(request.image_base64)
-        image = Image.open(io.BytesIO(image_data))
-        
-        system_prompt = (
-            f"You are SmartChrome, an autonomous AI browser assistant. Your current mission objective is: {current_objective}. "
-            "Output ONLY valid JSON matching: "
-            '{"action": "click|scroll|type", "target_bbox": [x, y, w, h], "text": "...", "thought": "Brief explanation of why you are taking this action"}.'
-        )
-        user_content = f"Accessibility Tree: {request.a11y_tree}\n\nWhat is the next action?"
-
-        response_text = ""
-        if model_engine == "mlx":
-            response_text = '{"action": "scroll", "direction": "down", "thought": "Scanning page for relevant content."}' 
-        elif model_engine == "vllm":
-            if not llm:
-                reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] Internal Error: VLLM engine requested but not loaded.")
-                return {"action": "scroll", "direction": "down"}
-            prompt = f"<|im_start|>system\n{system_prompt}<|im_end|>\n<|im_start|>user\n<|vision_start|><|image_pad|><|vision_end|>{user_content}<|im_end|>\n<|im_start|>assistant\n"
-            outputs = llm.generate([{"prompt": prompt, "multi_modal_data": {"image": image}}], sampling_params)
-            response_text = outputs[0].outputs[0].text
-
-        if not response_text:
-            raise ValueError("VLM returned an empty response.")
-
-        clean_response = response_text.strip()
-        if "```json" in clean_response:
-            clean_response = clean_response.split("```json")[1].split("```")[0].strip()
-        
-        parsed_response = json.loads(clean_response)
+            try:
+                with act_phase("json_parse"):
+                    action = parse_action(response_text)
+            except ActionParseError:
+                action_parse_stats["failed"] += 1
+                raise
+            action_parse_stats["parsed"] += 1
+            with act_phase("grounding"):
+                parsed_response = _bbox_to_page(action.to_response(), prepared.transform)
+                parsed_response = await asyncio.to_thread(_ground_action, parsed_response, compact, index)
         
-        # Log reasoning
-        thought = parsed_response.get("thought", "Executing tactical navigation.")
-        reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] {thought}")
-        if len(reasoning_log) > 5: reasoning_log.pop(0)
-
-        return parsed_response
-    except Exception as e:
-        reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] Error: {str(e)}")
-        if len(reasoning_log) > 5: reasoning_log.pop(0)
-        return {"action": "scroll", "direction": "down"}
+            # Log reasoning
+            thought = parsed_response.get("thought", "Executing tactical navigation.")
+            session.log(thought)
+
+            action_cache.put(key, parsed_response)
+            act_outcomes.inc(engine=engine.kind, outcome="model")
+            return parsed_response
+        except QueueFullError as e:
+            act_outcomes.inc(engine=engine.kind, outcome="queue_full")
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        except DeadlineExceededError as e:
+            act_outcomes.inc(engine=engine.kind, outcome="deadline")
+            raise HTTPException(status_code=504, detail=str(e))
+        except Exception as e:
+            session.log(f"Error: {str(e)}")
+            act_fallbacks.inc(reason="parse_error" if isinstance(e, ActionParseError) else "error")
+            act_outcomes.inc(engine=engine.kind, outcome="fallback")
+            return {"action": "scroll", "direction": "down"}
 
 @app.post("/vlm/objective")
 async def set_objective(request: ObjectiveRequest):
-    global current_objective, reasoning_log
-    current_objective = request.objective
-    reasoning_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] Mission Updated: {current_objective}")
-    if len(reasoning_log) > 5: reasoning_log.pop(0)
-    return {"status": "success", "objective": current_objective}
-
+    # Recorded too, so a replayed trace runs under the same missions.
+    with record_step("/vlm/objective", request.model_dump()) as step:
+        # Without a session_id this sets the global mission for every tab still following it.
+        # No cache flush: the objective is part of the action cache key.
+        session = sessions.get(request.session_id)
+        sessions.set_objective(request.objective, request.session_id)
+        session.log(f"Mission Updated: {request.objective}", event="objective")
+        step["response"] = {"status": "success", "objective": session.objective}
+        return step["response"]
+
+# Liveness and readiness probes: the process is up / the model can answer.
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "uptime_s": round(time.monotonic() - startup["started_at"], 3)}
+
+@app.get("/readyz")
+async def readyz():
+    if not model_ready():
+        raise _not_ready_error()
+    return {"status": "ready", "engine": engines.active.kind, "model_id": engines.active.model_id, "load_s": startup["load_s"]}
+
+# Pollers send If-None-Match and get 304 while nothing changed; the Commander
+# should prefer following /vlm/events. The ETag covers only this session's
+# state: the global counters in the body move with every tab's steps and
+# would defeat the 304s, so the tag is weak and those counters may be stale
+# on a 304 (read them from /metrics instead).
 @app.get("/vlm/status")
-async def get_status():
-    return {
-        "objective": current_objective,
-        "reasoning_log": reasoning_log,
-        "engine": model_engine
+async def get_status(request: Request, session_id: Optional[str] = None):
+    session = sessions.get(session_id)
+    own = {
+        "objective": session.objective,
+        "event_seq": session.events.seq,
+        "engine": engines.active.kind,
+        "session": session.stats(),
     }
+    etag = f'W/"{hashlib.blake2b(json.dumps(own, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    body = json.dumps({
+        "objective": session.objective,
+        "reasoning_log": session.reasoning_log,
+        "event_seq": session.events.seq,
+        "engine": engines.active.kind,
+        "scheduler": scheduler.stats(),
+        "action_cache": action_cache.stats(),
+        "last_compaction": last_compaction,
+        "last_preprocess": last_preprocess,
+        "action_parse": action_parse_stats,
+        "fast_path": fast_path.stats(),
+        "grounding": grounding_stats,
+        "session": session.stats(),
+    }).encode("utf-8")
+    return Response(body, media_type="application/json", headers=headers)
+
+# Server-Sent Events of a session's reasoning log, one event per entry with
+# its sequence number as the SSE id. Reconnecting clients resume from the
+# Last-Event-ID header (or ?after=); follow=false returns what is buffered.
+@app.get("/vlm/events")
+async def stream_session_events(request: Request, session_id: Optional[str] = None,
+                                after: Optional[int] = None, follow: bool = True):
+    session = sessions.get(session_id)
+    if after is None:
+        try:
+            after = int(request.headers.get("last-event-id", 0))
+        except ValueError:
+            after = 0
+
+    async def events():
+        async for seq, event, data in session.events.stream(after, follow, CONFIG.get("event_keepalive_s", 15.0)):
+            yield ": keepalive\n\n" if seq is None else format_sse(seq, event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/vlm/sessions")
+async def list_sessions():
+    return [session.stats() for session in sessions.all()]
+
+@app.get("/vlm/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = sessions.find(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown session {session_id}.")
+    return session.stats()
+
+@app.get("/vlm/fast_path")
+async def get_fast_path_stats():
+    return fast_path.stats()
+
+@app.get("/vlm/cache")
+async def get_cache_stats():
+    return action_cache.stats()
+
+@app.delete("/vlm/cache")
+async def clear_cache():
+    action_cache.invalidate()
+    return {"status": "success"}
 
 @app.post("/vlm/rlhf_log")
 async def rlhf_log(request: RLHFLogRequest):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO tuples (timestamp, image_base64, a11y_tree, bad_action, good_action)
-            VALUES (?, ?, ?, ?, ?)
-        """, (request.timestamp, request.state_image_base64, request.state_a11y_tree, 
-              request.vlm_bad_action, request.human_good_action))
-        conn.commit()
-        conn.close()
-        return {"status": "success"}
+        with rlhf_log_phase_seconds.time(phase="base64_decode"):
+            image_bytes = base64.b64decode(request.state_image_base64, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"state_image_base64 is not valid base64: {e}")
+    try:
+        with rlhf_log_phase_seconds.time(phase="write"):
+            future = get_rlhf_writer().submit(request.timestamp, image_bytes, request.state_a11y_tree,
+                                              request.vlm_bad_action, request.human_good_action)
+            row_id = await asyncio.wrap_future(future)
+        rlhf_store.notify_teacher(CONFIG.get("teacher_notify_port", 8765))
+        return {"status": "success", "id": row_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/osint/analyze")
+# Prompt -> completion cache shared with teacher_worker (see teacher_cache.py)
+TEACHER_CACHE_PATH = CONFIG.get("teacher_cache_path", "teacher_cache.db")
+teacher_cache = None
+
+def get_teacher_cache():
+    global teacher_cache
+    if teacher_cache is None or teacher_cache.path != TEACHER_CACHE_PATH:
+        close_teacher_cache()
+        teacher_cache = TeacherCache(TEACHER_CACHE_PATH)
+    return teacher_cache
+
+def close_teacher_cache():
+    global teacher_cache
+    if teacher_cache is not None:
+        teacher_cache.close()
+        teacher_cache = None
+
+atexit.register(close_teacher_cache)
+
+def teacher_complete(system_prompt, user_content):
+    cache = get_teacher_cache() if TEACHER_CACHE_PATH else None
+    key = prompt_key(TEACHER_MODEL, system_prompt, user_content)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    response = client.chat.completions.create(
+        model=TEACHER_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+    )
+    content = response.choices[0].message.content
+    if cache is not None and content:
+        cache.put(key, TEACHER_MODEL, content)
+    return content
+
+osint_engine = OSINTMapReduce(
+    teacher_complete,
+    chunk_tokens=CONFIG.get("osint_chunk_tokens", 3000),
+    merge_tokens=CONFIG.get("osint_merge_tokens", 3000),
+    concurrency=CONFIG.get("osint_concurrency", 4),
+)
+
+def _write_report(markdown_brief):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_dir = CONFIG["reports_dir"]
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, f"osint_brief_{timestamp}_{uuid.uuid4().hex[:8]}.md")
+    with open(report_path, "w") as f:
+        f.write(markdown_brief)
+    return report_path
+
+async def run_osint_job(job):
+    def on_progress(stage, stats, partial_markdown):
+        if partial_markdown:
+            job.partial_markdown = partial_markdown
+        job.emit("progress", {"stage": stage, "stats": stats, "partial_markdown": partial_markdown})
+
+    try:
+        markdown_brief, stats = await osint_engine.run(job.objective, job.raw_data, on_progress=on_progress)
+        job.partial_markdown = markdown_brief
+        report_path = await asyncio.to_thread(_write_report, markdown_brief)
+    except Exception:
+        osint_jobs_finished.inc(status="failed")
+        raise
+    for stage, ms in stats.get("timings_ms", {}).items():
+        osint_stage_seconds.observe(ms / 1000, stage=stage)
+    osint_llm_calls.inc(stats.get("llm_calls", 0))
+    osint_jobs_finished.inc(status="succeeded")
+    return report_path, stats
+
+osint_jobs = OSINTJobManager(run_osint_job, workers=CONFIG.get("osint_workers", 2))
+
+@app.post("/osint/analyze", status_code=202)
 async def analyze_osint(request: OSINTAnalyzeRequest):
     try:
-        system_prompt = f"You are an expert OSINT Analyst. Your objective is: {request.objective}."
-        user_content = f"Here is raw, unstructured data scraped by an autonomous agent:\n{request.raw_data}\n\nDeduplicate this information, extract the core insights, and generate a professional, well-structured Markdown brief."
-
-        response = client.chat.completions.create(
-            model=TEACHER_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ]
-        )
-        markdown_brief = response.choices[0].message.content.strip()
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_dir = CONFIG["reports_dir"]
-        os.makedirs(report_dir, exist_ok=True)
-        report_path = os.path.join(report_dir, f"osint_brief_{timestamp}.md")
-        with open(report_path, "w") as f:
-            f.write(markdown_brief)
-
-        return {"status": "success", "report_path": report_path}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        job = osint_jobs.submit(request.objective, request.raw_data)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return {
+        "status": job.status,
+        "job_id": job.id,
+        "status_url": f"/osint/jobs/{job.id}",
+        "events_url": f"/osint/jobs/{job.id}/events",
+        "report_url": f"/osint/jobs/{job.id}/report",
+    }
+
+def _get_osint_job(job_id):
+    job = osint_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown OSINT job {job_id}.")
+    return job
+
+@app.get("/osint/jobs/{job_id}")
+async def get_osint_job(job_id: str):
+    return _get_osint_job(job_id).summary()
+
+# Server-Sent Events: progress, partial Markdown and status changes.
+# Reconnecting clients resume from the Last-Event-ID header.
+@app.get("/osint/jobs/{job_id}/events")
+async def stream_osint_job(job_id: str, request: Request):
+    job = _get_osint_job(job_id)
+    try:
+        after_seq = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        after_seq = 0
 
-@app.post("/vlm/reload")
+    async def events():
+        async for seq, event, data in job.stream(after_seq):
+            yield format_sse(seq, event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/osint/jobs/{job_id}/report")
+async def get_osint_report(job_id: str):
+    job = _get_osint_job(job_id)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"OSINT job is {job.status}.")
+    return FileResponse(job.report_path, media_type="text/markdown", filename=os.path.basename(job.report_path))
+
+# Blue/green reload: returns immediately, poll GET /vlm/reload for progress.
+@app.post("/vlm/reload", status_code=202)
 async def reload_model(request: ReloadModelRequest):
     try:
-        load_vlm_model(request.new_model_path)
-        return {"status": "success", "model_engine": model_engine}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return engines.start_reload(CONFIG["engine"], request.new_model_path)
+    except ReloadInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/vlm/reload")
+async def get_reload_status():
+    return {**engines.reload_status, "active_engine": engines.active.kind, "active_version": engines.active.version}
 
 if __name__ == "__main__":
-    init_db()
-    load_vlm_model()
-    uvicorn.run(app, host=CONFIG["host"], port=CONFIG["port"])
+    parser = argparse.ArgumentParser(description="SmartChrome VLM server")
+    parser.add_argument("--port", type=int, default=CONFIG["port"])
+    parser.add_argument("--engine", default=CONFIG["engine"], help="Override the configured engine (vllm, mlx, sim or mock)")
+    parser.add_argument("--sim-profile", help="JSON file with the sim engine's latency, faults and script (see mock_engine.py)")
+    args = parser.parse_args()
+    overrides = {"engine": args.engine}
+    if args.sim_profile:
+        with open(args.sim_profile) as f:
+            overrides["sim_engine"] = json.load(f)
+    config.override(**overrides)
+    if CONFIG.get("config_reload_interval_s", 2.0):
+        config.watch(CONFIG.get("config_reload_interval_s", 2.0))
+    # Bind first: the browser gets 503 + Retry-After instead of connection refused while the model loads.
+    startup["state"] = "loading"
+    threading.Thread(target=warm_up, daemon=True, name="warm-up").start()
+    uvicorn.run(app, host=CONFIG["host"], port=args.port)